@@ -0,0 +1,236 @@
+"""
+Compact checkpoints of a running simulation, as a single .npz file.
+
+A checkpoint holds the population's gene class, every distinct gene (class, rod encodings,
+ground plane distances, serials, parents, validity and what NEC computed: fitness,
+radiation patterns, solve times, failures), the layout of the individuals,
+of the niche world and of the king as indices into those genes, the
+population's counters, the memetic refiner's steps and counters, the
+CMA-ES distribution (if any), the states of random and numpy.random, the run
+controller's stagnation history and the histories of stat services'
+graphers. Restored genes are never evaluated again and the run continues
+exactly as it would have.
+"""
+import json
+import os
+import random
+import tempfile
+import numpy as np
+from typing import Dict, List, Tuple
+from core.config import Config
+from core.gene import Gene, ValidInitGene, BiasedInitGene, NewGene
+from core.evaluation import IEvaluator, encodeGenes, decodeGene, collectResult, applyResult
+from core.population import Population
+from core.niche_population import NichePopulation
+from core.cmaes import CmaesPopulation
+from core.optimizers import createPopulation
+
+CHECKPOINT_VERSION = 1
+
+GENE_CLASSES = {geneClass.__name__: geneClass for geneClass in (Gene, ValidInitGene, BiasedInitGene, NewGene)}
+
+COUNTERS = ["generationNumber", "newbornsCounter", "killedGenes", "killedGenesRatio", "repairedGenes", "repairedGenesRatio", "necEvaluations", "elapsedTime", "fitnessMean", "fitnessStdDev"]
+
+
+def packRandomState() -> Dict[str, np.ndarray]:
+  version, state, gaussNext = random.getstate()
+  algorithm, keys, position, hasGauss, cachedGaussian = np.random.get_state()
+
+  return {
+    "randomVersion": np.array(version),
+    "randomState": np.array(state, dtype=np.int64),
+    "randomGaussNext": np.array(np.nan if gaussNext is None else gaussNext),
+    "numpyAlgorithm": np.array(algorithm),
+    "numpyKeys": keys,
+    "numpyPosition": np.array(position),
+    "numpyHasGauss": np.array(hasGauss),
+    "numpyCachedGaussian": np.array(cachedGaussian)
+  }
+
+def unpackRandomState(arrays: Dict[str, np.ndarray]) -> None:
+  gaussNext = float(arrays["randomGaussNext"])
+  random.setstate((
+    int(arrays["randomVersion"]),
+    tuple(int(v) for v in arrays["randomState"]),
+    None if np.isnan(gaussNext) else gaussNext
+  ))
+  np.random.set_state((
+    str(arrays["numpyAlgorithm"]),
+    arrays["numpyKeys"],
+    int(arrays["numpyPosition"]),
+    int(arrays["numpyHasGauss"]),
+    float(arrays["numpyCachedGaussian"])
+  ))
+
+def saveCheckpoint(filename: str, population: Population, histories: List[List[Dict[str, List]]] = [], runHistory: List[Tuple[float, float]] = []) -> None:
+  """
+  Atomically writes the population, random states, stat services' histories
+  (one list of grapher series per stat service, see IStatService.histories)
+  and the run controller's (king, mean) history (see RunController.history) to filename
+  """
+  # Genes may be shared (e.g. the king is usually an individual), layouts are indices
+  genes: List[Gene] = []
+  indices: Dict[int, int] = {}
+  def indexOf(gene: Gene) -> int:
+    if id(gene) not in indices:
+      indices[id(gene)] = len(genes)
+      genes.append(gene)
+    return indices[id(gene)]
+
+  individuals = np.array([indexOf(g) for g in population.individuals], dtype=np.int64)
+  king = indexOf(population.king)
+  world = np.array([indexOf(g) for g in population.populationSet()], dtype=np.int64) \
+    if isinstance(population, NichePopulation) else np.empty(0, dtype=np.int64)
+
+  encodings, gpDistances = encodeGenes(genes)
+  result = collectResult(genes)
+  arrays = {
+    "version": np.array(CHECKPOINT_VERSION),
+    "config": np.array(json.dumps(population.config.toDict())),
+    "geneClass": np.array(population.geneClass.__name__),
+    "geneClasses": np.array([type(g).__name__ for g in genes]).reshape(len(genes)),    # Offspring may be of another class
+    "encodings": encodings,
+    "gpDistances": gpDistances,
+    "serials": np.array([g.serial for g in genes], dtype=np.int64),
+    "parents": np.array([g.parents for g in genes], dtype=np.int64).reshape(len(genes), 2),
+    "evaluated": np.array([g.evaluated for g in genes]),
+    "valid": np.array([g.isValid() for g in genes]),
+    "fitness": result.fitness,
+    "gains": result.gains,
+    "thetas": result.thetas,
+    "phis": result.phis,
+    "solveTimes": result.solveTimes,
+    "failures": result.failures,
+    "individuals": individuals,
+    "king": np.array(king),
+    "niche": np.array(isinstance(population, NichePopulation)),
+    "world": world,
+    "worldShape": np.array(population.world.shape if isinstance(population, NichePopulation) else (0, 0)),
+    "geneSerial": np.array(Gene.globalSerial),
+    "runHistory": np.array(runHistory, dtype=np.float64).reshape(len(runHistory), 2),
+    "refinerSerials": np.array(list(population.refiner.steps.keys()), dtype=np.int64),
+    "refinerSteps": np.array(list(population.refiner.steps.values()), dtype=np.float64),
+    "refinerNecEvaluations": np.array(population.refiner.necEvaluations),
+    "refinerImprovements": np.array(population.refiner.improvements),
+    **({f"cmaes.{name}": value for name, value in population.strategyState().items()} if isinstance(population, CmaesPopulation) else {}),
+    **{name: np.array(getattr(population, name, np.nan)) for name in COUNTERS},
+    **packRandomState()
+  }
+
+  for i, statHistories in enumerate(histories):
+    for j, series in enumerate(statHistories):
+      for name, values in series.items():
+        arrays[f"stat{i}.{j}.{name}"] = np.array(values)
+
+  saveArrays(filename, arrays)
+
+def saveArrays(filename: str, arrays: Dict[str, np.ndarray]) -> None:
+  """
+  Atomically writes a compressed .npz: readers see either the previous file or this one
+  """
+  fd, tmpFilename = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(filename) or ".")
+  with os.fdopen(fd, "wb") as f:
+    np.savez_compressed(f, **arrays)
+    f.flush()
+    os.fsync(f.fileno())
+  os.replace(tmpFilename, filename)
+
+def readCheckpoint(filename: str) -> Dict[str, np.ndarray]:
+  """
+  Arrays of a checkpoint, nothing is rebuilt
+  """
+  with np.load(filename) as f:
+    arrays = {name: f[name] for name in f.files}
+
+  if int(arrays["version"]) != CHECKPOINT_VERSION:
+    raise ValueError(f"Unsupported checkpoint version {int(arrays['version'])} in {filename}")
+
+  return arrays
+
+def geneClassNamed(name: str) -> type:
+  if name not in GENE_CLASSES:
+    raise ValueError(f"Unknown gene class {name}, expected one of {list(GENE_CLASSES)}")
+  return GENE_CLASSES[name]
+
+def geneClassOf(arrays: Dict[str, np.ndarray]) -> type:
+  """
+  Gene class of a checkpoint's population, Gene for checkpoints written before it was kept
+  """
+  return geneClassNamed(str(arrays["geneClass"])) if "geneClass" in arrays else Gene
+
+def decodeGenes(arrays: Dict[str, np.ndarray]) -> Tuple[Config, List[Gene]]:
+  """
+  Configuration and distinct genes of a checkpoint, with what NEC computed for them
+  """
+  config = Config.fromDict(json.loads(str(arrays["config"])))
+  geneClasses = [geneClassNamed(str(name)) for name in arrays["geneClasses"]] if "geneClasses" in arrays else [Gene] * len(arrays["encodings"])
+  genes = [
+    decodeGene(config, encoding, gpDistance, geneClass)
+    for encoding, gpDistance, geneClass in zip(arrays["encodings"], arrays["gpDistances"], geneClasses)
+  ]
+  for gene, serial, parents in zip(genes, arrays["serials"], arrays["parents"]):
+    gene.serial = int(serial)
+    gene.parents = (int(parents[0]), int(parents[1]))
+
+  result = collectResult([])
+  evaluated = np.flatnonzero(arrays["evaluated"])
+  result.fitness = arrays["fitness"][evaluated]
+  result.gains = arrays["gains"][evaluated]
+  result.thetas, result.phis = arrays["thetas"], arrays["phis"]
+  result.solveTimes = arrays["solveTimes"][evaluated]
+  result.failures = arrays["failures"][evaluated]
+  applyResult([genes[i] for i in evaluated], result)
+
+  return config, genes
+
+def loadCheckpoint(filename: str, evaluator: IEvaluator = None) -> Tuple[Population, List[List[Dict[str, List]]], List[Tuple[float, float]]]:
+  """
+  Rebuilds the population of a checkpoint and restores random states.
+  Returns the population, the histories of stat services and the run controller's history.
+  """
+  arrays = readCheckpoint(filename)
+  config, genes = decodeGenes(arrays)
+
+  population = createPopulation(config, 0, evaluator=evaluator, gene_class=geneClassOf(arrays))
+  if isinstance(population, CmaesPopulation):
+    population.setStrategyState({name[len("cmaes."):]: value for name, value in arrays.items() if name.startswith("cmaes.")})
+  population.individuals = [genes[i] for i in arrays["individuals"]]
+  if bool(arrays["niche"]):
+    population.killedGenes = int(arrays["killedGenes"])
+    population = NichePopulation(config, evaluator=evaluator).fromPopulation(population)
+    population.world = np.empty(len(arrays["world"]), dtype=object)
+    population.world[:] = [genes[i] for i in arrays["world"]]
+    population.world = population.world.reshape(*arrays["worldShape"])
+    population.worldHeight, population.worldWidth = population.world.shape
+
+  population.king = genes[int(arrays["king"])]
+  for name in COUNTERS:
+    if name not in arrays:
+      continue    # Counters added after the checkpoint was written
+    value = arrays[name].item()
+    if not (isinstance(value, float) and np.isnan(value)):
+      setattr(population, name, value)
+
+  if "refinerSteps" in arrays:
+    population.refiner.steps = {int(serial): float(step) for serial, step in zip(arrays["refinerSerials"], arrays["refinerSteps"])}
+    population.refiner.necEvaluations = int(arrays["refinerNecEvaluations"])
+    population.refiner.improvements = int(arrays["refinerImprovements"])
+
+  Gene.globalSerial = int(arrays["geneSerial"])
+  unpackRandomState(arrays)    # Last: building the population above draws random numbers
+
+  histories: List[List[Dict[str, List]]] = []
+  for name, values in arrays.items():
+    if not name.startswith("stat"):
+      continue
+    statIndex, grapherIndex, seriesName = name[len("stat"):].split(".", 2)
+    statIndex, grapherIndex = int(statIndex), int(grapherIndex)
+    while len(histories) <= statIndex:
+      histories.append([])
+    while len(histories[statIndex]) <= grapherIndex:
+      histories[statIndex].append({})
+    histories[statIndex][grapherIndex][seriesName] = values.tolist() if values.ndim == 1 else list(values)
+
+  runHistory = [tuple(entry) for entry in arrays["runHistory"].tolist()] if "runHistory" in arrays else []
+
+  return population, histories, runHistory
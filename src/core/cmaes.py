@@ -0,0 +1,195 @@
+"""
+CMA-ES optimizer: an alternative to the genetic algorithm on the same genes.
+
+Genes are points of the unit cube, scaled from the box of angles, segment
+lengths and ground plane distance (see core.evaluation.searchBounds). Each
+generation draws lambda candidates from N(mean, sigma^2 C) as a single
+matrix, clips them to the box, repairs those violating the shape
+constraints (see core.repair) and evaluates them as one NEC batch. The mean
+moves to the weighted recombination of the best mu candidates, step size and
+covariance matrix are adapted with evolution paths, as in the
+(mu/mu_w, lambda)-CMA-ES of Hansen's tutorial. Updates use the clipped and
+repaired candidates; those that can't be repaired aren't evaluated and rank
+last.
+
+Individuals are the last valid candidates, fittest first: services, run
+control, memetic refinement and checkpoints work as with the genetic algorithm.
+"""
+import logging
+import numpy as np
+from math import log, sqrt
+from typing import Dict, List, Tuple
+from core.config import Config
+from core.gene import Gene
+from core.evaluation import IEvaluator, decodeGene, searchBounds, genesToVectors, vectorsToEncodings
+from core.population import Population
+from utils.profiling import PROFILER
+
+# Strategy state, as kept in checkpoints
+STRATEGY_STATE = ["mean", "sigma", "covariance", "sigmaPath", "covariancePath", "strategyGeneration"]
+
+def defaultOffspringSize(dimensions: int) -> int:
+  return 4 + int(3 * log(dimensions))
+
+class CmaesPopulation(Population):
+  def __init__(self, config: Config, pop_size: int = None, gene_class = Gene, evaluator: IEvaluator = None):
+    """
+    The initial population (pop_size genes, lambda by default) is drawn as the genetic algorithm's:
+    the first generation evaluates it and centers the distribution on its best genes
+    """
+    self.lowerBounds, self.upperBounds = searchBounds(config)
+    n = self.dimensions = len(self.lowerBounds)
+    tuning = config.GeneticAlgoTuning
+    self.offspringSize = tuning.cmaesOffspringSize if tuning.cmaesOffspringSize > 0 else defaultOffspringSize(n)
+    super().__init__(config, pop_size if pop_size is not None else self.offspringSize, gene_class, evaluator)
+    self.killedGenes, self.killedGenesRatio = 0, 0.0
+
+    # Strategy parameters, defaults of the (mu/mu_w, lambda)-CMA-ES
+    self.parentsNumber = self.offspringSize // 2
+    weights = log(self.parentsNumber + 0.5) - np.log(np.arange(1, self.parentsNumber + 1))
+    self.weights = weights / weights.sum()
+    self.effectiveParents = 1 / np.sum(self.weights ** 2)
+    mueff = self.effectiveParents
+    self.cSigma = (mueff + 2) / (n + mueff + 5)
+    self.dSigma = 1 + 2 * max(0, sqrt((mueff - 1) / (n + 1)) - 1) + self.cSigma
+    self.cCovariance = (4 + mueff / n) / (n + 4 + 2 * mueff / n)
+    self.cRankOne = 2 / ((n + 1.3) ** 2 + mueff)
+    self.cRankMu = min(1 - self.cRankOne, 2 * (mueff - 2 + 1 / mueff) / ((n + 2) ** 2 + mueff))
+    self.expectedNorm = sqrt(n) * (1 - 1 / (4 * n) + 1 / (21 * n ** 2))    # E||N(0, I)||
+
+    self.resetStrategy()
+
+  def resetStrategy(self) -> None:
+    """
+    Forgets the distribution: the next generation centers a new one on the individuals
+    """
+    n = self.dimensions
+    self.mean: np.ndarray = None
+    self.sigma = self.config.GeneticAlgoTuning.cmaesSigma
+    self.covariance = np.eye(n)
+    self.sigmaPath = np.zeros(n)
+    self.covariancePath = np.zeros(n)
+    self.strategyGeneration = 0
+    self.decompose()
+
+  def decompose(self) -> None:
+    """
+    C = B D^2 B^T, for sampling and for C^-1/2
+    """
+    eigenvalues, self.eigenvectors = np.linalg.eigh(self.covariance)
+    self.scales = np.sqrt(np.maximum(eigenvalues, 1e-20))
+
+  def strategyState(self) -> Dict[str, np.ndarray]:
+    state = {name: np.asarray(getattr(self, name)) for name in STRATEGY_STATE}
+    state["mean"] = state["mean"] if self.mean is not None else np.empty(0)
+    return state
+
+  def setStrategyState(self, state: Dict[str, np.ndarray]) -> None:
+    self.mean = state["mean"] if len(state["mean"]) > 0 else None
+    self.sigma = float(state["sigma"])
+    self.covariance, self.sigmaPath, self.covariancePath = state["covariance"], state["sigmaPath"], state["covariancePath"]
+    self.strategyGeneration = int(state["strategyGeneration"])
+    self.decompose()
+
+  def toUnitCube(self, genes: List[Gene]) -> np.ndarray:
+    return (genesToVectors(genes) - self.lowerBounds) / (self.upperBounds - self.lowerBounds)
+
+  def fromUnitCube(self, points: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    return vectorsToEncodings(self.lowerBounds + points * (self.upperBounds - self.lowerBounds))
+
+  def recombine(self, points: np.ndarray) -> np.ndarray:
+    """
+    Weighted mean of the best points, fittest first
+    """
+    weights = self.weights[:len(points)]
+    return weights @ points[:len(weights)] / weights.sum()
+
+  def sample(self) -> Tuple[List[Gene], np.ndarray]:
+    """
+    lambda candidates, clipped to the box and repaired, and the mask of the valid ones
+    """
+    normal = np.random.standard_normal((self.offspringSize, self.dimensions))
+    points = np.clip(self.mean + self.sigma * (normal * self.scales) @ self.eigenvectors.T, 0, 1)
+    encodings, gpDistances = self.fromUnitCube(points)
+    candidates = [decodeGene(self.config, encoding, gpDistance, self.geneClass) for encoding, gpDistance in zip(encodings, gpDistances)]
+
+    with PROFILER.phase("repair"):
+      valid = self.repair(candidates)
+    self.killedGenes = int((~valid).sum())
+    self.killedGenesRatio = 100 * self.killedGenes / len(candidates)
+    self.newbornsCounter += len(candidates)
+
+    return candidates, valid
+
+  def update(self, candidates: List[Gene], valid: np.ndarray) -> None:
+    """
+    Moves the distribution towards the best candidates
+    """
+    n, mueff = self.dimensions, self.effectiveParents
+    fitness = np.array([c.fitnessCached if isValid else float("-inf") for c, isValid in zip(candidates, valid)])
+    order = np.argsort(-fitness, kind="stable")[:self.parentsNumber]
+    steps = (self.toUnitCube([candidates[i] for i in order]) - self.mean) / self.sigma
+    meanStep = self.weights @ steps
+
+    self.mean = np.clip(self.mean + self.sigma * meanStep, 0, 1)
+    self.strategyGeneration += 1
+
+    # Step size: cumulation along the whitened path
+    whitened = self.eigenvectors @ ((self.eigenvectors.T @ meanStep) / self.scales)
+    self.sigmaPath = (1 - self.cSigma) * self.sigmaPath + sqrt(self.cSigma * (2 - self.cSigma) * mueff) * whitened
+    sigmaPathNorm = np.linalg.norm(self.sigmaPath)
+    steady = sigmaPathNorm / sqrt(1 - (1 - self.cSigma) ** (2 * self.strategyGeneration)) / self.expectedNorm < 1.4 + 2 / (n + 1)
+
+    # Covariance: rank-one update from the evolution path, rank-mu update from the selected steps
+    self.covariancePath = (1 - self.cCovariance) * self.covariancePath + \
+      steady * sqrt(self.cCovariance * (2 - self.cCovariance) * mueff) * meanStep
+    covariance = (1 - self.cRankOne - self.cRankMu + (1 - steady) * self.cRankOne * self.cCovariance * (2 - self.cCovariance)) * self.covariance \
+      + self.cRankOne * np.outer(self.covariancePath, self.covariancePath) \
+      + self.cRankMu * (steps.T * self.weights) @ steps
+    self.covariance = (covariance + covariance.T) / 2
+
+    self.sigma = min(1.0, self.sigma * np.exp(self.cSigma / self.dSigma * (sigmaPathNorm / self.expectedNorm - 1)))
+    self.decompose()
+
+  def generations(self) -> Tuple[List[Gene], int]:
+    for _ in range(self.config.GeneticAlgoTuning.iterationsNumber):
+      if self.mean is None:
+        with PROFILER.phase("evaluate"):
+          self.evaluate()
+        self.individuals = sorted(self.individuals, reverse=True)
+        self.mean = self.recombine(self.toUnitCube(self.individuals[:self.parentsNumber]))
+      else:
+        with PROFILER.phase("offspring"):
+          candidates, valid = self.sample()
+        newIndividuals = [c for c, isValid in zip(candidates, valid) if isValid]
+        with PROFILER.phase("evaluate"):
+          self.evaluate(newIndividuals)
+        with PROFILER.phase("fight"):
+          self.update(candidates, valid)
+        if len(newIndividuals) > 0:
+          self.individuals = sorted(newIndividuals, reverse=True)
+        else:
+          logging.warning("No valid candidate, individuals are kept")
+
+      self.fitnessMean = np.mean([g.fitnessCached for g in self.individuals])
+      self.fitnessStdDev = np.std([g.fitnessCached for g in self.individuals])
+      logging.info(
+        f"\nFitness:\n"
+        f"\tMean: {self.fitnessMean:.4f}\n"
+        f"\tSd: {self.fitnessStdDev:.4f}\n"
+        f"Population size: {len(self.individuals)}\n"
+        f"Step size: {self.sigma:.4f}"
+      )
+
+      self.king = \
+          self.individuals[0] if self.individuals[0].fitnessCached > self.king.fitnessCached else self.king
+
+      self.generationNumber += 1
+      yield self.individuals, self.generationNumber
+
+  def restart(self, survivors: int) -> None:
+    """
+    Keeps the best survivors individuals and draws a new distribution around them and new random genes
+    """
+    super().restart(survivors)
+    self.resetStrategy()
@@ -1,8 +1,16 @@
 import yaml
 import re
-from typing import TextIO
+from copy import deepcopy
+from dataclasses import dataclass
+from typing import TextIO, Dict, Any
 
 class Config:
+    """
+    Simulation configuration. Instances are passed explicitly to populations, genes
+    and services, so that differently configured simulations can share a process.
+    Sections are plain dataclasses: cheap to pickle and to send to workers.
+    """
+    @dataclass
     class ShapeConstraints:
         outerDiam: float
         innerDiam: float
@@ -10,7 +18,8 @@ class Config:
         targetFreq: float
         groundPlaneDistanceMin: float
         groundPlaneDistanceMax: float
-    
+
+    @dataclass
     class GeneticAlgoTuning:
         populationSize: int
         iterationsNumber: int
@@ -22,7 +31,25 @@ class Config:
         worldWidth: int
         worldHeight: int
         neighborhoodRadius: int
+        insideCirclePoints: float
+        notCrossingHolePoints: float
+        repairRounds: int = 80    # 0 disables repair: invalid genes are killed
+        stagnationWindow: int = 0    # Generations, 0 disables stagnation detection
+        stagnationTolerance: float = 1e-3
+        stagnationAction: str = "restart"    # or "stop"
+        restartSurvivors: int = 10
+        timeBudget: float = 0    # s, 0 for no limit
+        evaluationsBudget: int = 0    # NEC evaluations, 0 for no limit
+        refinementShare: float = 0.1    # Share of the budget spent refining the elite
+        memeticPeriod: int = 0    # Generations between local refinements, 0 disables them
+        memeticElite: int = 5
+        memeticEvaluations: int = 40    # NEC evaluations of each local refinement
+        memeticStep: float = 0.05    # Initial pattern search step, share of each variable's range
+        optimizer: str = "ga"    # or "cmaes", "pareto"
+        cmaesOffspringSize: int = 0    # Candidates per generation (lambda), 0 for 4 + 3 ln(dimensions)
+        cmaesSigma: float = 0.2    # Initial step size, share of each variable's range
 
+    @dataclass
     class GeneEncoding:
         segmentsNumber: int
         splineInterpolation: bool
@@ -30,36 +57,106 @@ class Config:
         maxSegmentLen: float
         minSegmentLen: float
 
-    def loadYaml(stream: TextIO):
-        d = yaml.safe_load(stream)
-        
-        Config.ShapeConstraints.outerDiam = d["shape_constraints"]["outer_diameter"]
-        Config.ShapeConstraints.innerDiam = d["shape_constraints"]["inner_diameter"]
-        Config.ShapeConstraints.centerShift = d["shape_constraints"]["center_shift"]
-        Config.ShapeConstraints.targetFreq = d["shape_constraints"]["target_frequency"]
-        Config.ShapeConstraints.groundPlaneDistanceMin = d["shape_constraints"]["gp_distance_min"]
-        Config.ShapeConstraints.groundPlaneDistanceMax = d["shape_constraints"]["gp_distance_max"]
+    # yaml key -> attribute name, for each section
+    YAML_KEYS = {
+        "shape_constraints": ("ShapeConstraints", {
+            "outer_diameter": "outerDiam",
+            "inner_diameter": "innerDiam",
+            "center_shift": "centerShift",
+            "target_frequency": "targetFreq",
+            "gp_distance_min": "groundPlaneDistanceMin",
+            "gp_distance_max": "groundPlaneDistanceMax",
+        }),
+        "genetic_algo_tuning": ("GeneticAlgoTuning", {
+            "population_size": "populationSize",
+            "iterations_number": "iterationsNumber",
+            "cut_points": "cutPoints",
+            "mutation_rate": "mutationRate",
+            "turnover_rate": "turnoverRate",
+            "use_niches": "useNiches",
+            "niches_activation_threshold": "nichesActivationThreshold",
+            "world_width": "worldWidth",
+            "world_height": "worldHeight",
+            "neighborhood_radius": "neighborhoodRadius",
+            "inside_circle_points": "insideCirclePoints",
+            "not_crossing_hole_points": "notCrossingHolePoints",
+            "repair_rounds": "repairRounds",
+            "stagnation_window": "stagnationWindow",
+            "stagnation_tolerance": "stagnationTolerance",
+            "stagnation_action": "stagnationAction",
+            "restart_survivors": "restartSurvivors",
+            "time_budget": "timeBudget",
+            "evaluations_budget": "evaluationsBudget",
+            "refinement_share": "refinementShare",
+            "memetic_period": "memeticPeriod",
+            "memetic_elite": "memeticElite",
+            "memetic_evaluations": "memeticEvaluations",
+            "memetic_step": "memeticStep",
+            "optimizer": "optimizer",
+            "cmaes_offspring_size": "cmaesOffspringSize",
+            "cmaes_sigma": "cmaesSigma",
+        }),
+        "gene_encoding": ("GeneEncoding", {
+            "segments_number": "segmentsNumber",
+            "spline_interpolation": "splineInterpolation",
+            "max_angle": "maxAngle",
+            "max_segment_length": "maxSegmentLen",
+            "min_segment_length": "minSegmentLen",
+        }),
+    }
+
+    def __init__(self, shapeConstraints: ShapeConstraints, geneticAlgoTuning: GeneticAlgoTuning, geneEncoding: GeneEncoding):
+        self.ShapeConstraints = shapeConstraints
+        self.GeneticAlgoTuning = geneticAlgoTuning
+        self.GeneEncoding = geneEncoding
+
+    def __repr__(self) -> str:
+        return f"Config({self.ShapeConstraints}, {self.GeneticAlgoTuning}, {self.GeneEncoding})"
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Config) and self.toDict() == other.toDict()
+
+    @staticmethod
+    def fromDict(d: Dict[str, Dict[str, Any]]) -> "Config":
+        """
+        Builds a configuration from a dictionary shaped as config.yaml.
+        Keys with a default value may be missing (e.g. in files of older runs).
+        """
+        sections = {}
+        for sectionKey, (sectionName, keys) in Config.YAML_KEYS.items():
+            sectionClass = getattr(Config, sectionName)
+            sections[sectionName] = sectionClass(**{attr: d[sectionKey][key] for key, attr in keys.items() if key in d[sectionKey]})
+
+        return Config(sections["ShapeConstraints"], sections["GeneticAlgoTuning"], sections["GeneEncoding"])
+
+    def toDict(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Dictionary shaped as config.yaml
+        """
+        return {
+            sectionKey: {key: getattr(getattr(self, sectionName), attr) for key, attr in keys.items()}
+            for sectionKey, (sectionName, keys) in Config.YAML_KEYS.items()
+        }
 
-        Config.GeneticAlgoTuning.populationSize = d["genetic_algo_tuning"]["population_size"]
-        Config.GeneticAlgoTuning.iterationsNumber = d["genetic_algo_tuning"]["iterations_number"]
-        Config.GeneticAlgoTuning.cutPoints = d["genetic_algo_tuning"]["cut_points"]
-        Config.GeneticAlgoTuning.mutationRate = d["genetic_algo_tuning"]["mutation_rate"]
-        Config.GeneticAlgoTuning.turnoverRate = d["genetic_algo_tuning"]["turnover_rate"]
-        Config.GeneticAlgoTuning.useNiches = d["genetic_algo_tuning"]["use_niches"]
-        Config.GeneticAlgoTuning.nichesActivationThreshold = d["genetic_algo_tuning"]["niches_activation_threshold"]
-        Config.GeneticAlgoTuning.worldWidth = d["genetic_algo_tuning"]["world_width"]
-        Config.GeneticAlgoTuning.worldHeight = d["genetic_algo_tuning"]["world_height"]
-        Config.GeneticAlgoTuning.neighborhoodRadius = d["genetic_algo_tuning"]["neighborhood_radius"]
-        Config.GeneticAlgoTuning.insideCirclePoints = d["genetic_algo_tuning"]["inside_circle_points"]
-        Config.GeneticAlgoTuning.notCrossingHolePoints = d["genetic_algo_tuning"]["not_crossing_hole_points"]
+    def withOverrides(self, overrides: Dict[str, Any]) -> "Config":
+        """
+        Returns a copy of this configuration where yaml keys are replaced,
+        e.g. {"population_size": 100, "segments_number": 30}
+        """
+        d = deepcopy(self.toDict())
+        for key, value in overrides.items():
+            sections = [s for s in d.values() if key in s]
+            if len(sections) == 0:
+                raise KeyError(f"Unknown configuration key {key}")
+            sections[0][key] = value
 
-        Config.GeneEncoding.segmentsNumber = d["gene_encoding"]["segments_number"]
-        Config.GeneEncoding.splineInterpolation = d["gene_encoding"]["spline_interpolation"]
-        Config.GeneEncoding.maxAngle = d["gene_encoding"]["max_angle"]
-        Config.GeneEncoding.maxSegmentLen = d["gene_encoding"]["max_segment_length"]
-        Config.GeneEncoding.minSegmentLen = d["gene_encoding"]["min_segment_length"]
+        return Config.fromDict(d)
 
-# TODO: fix the default configuration
+    @staticmethod
+    def loadYaml(stream: TextIO) -> "Config":
+        return Config.fromDict(yaml.safe_load(stream))
 
-with open("config.yaml") as f:
-    Config.loadYaml(f)
+    @staticmethod
+    def fromFile(filename: str = "config.yaml") -> "Config":
+        with open(filename) as f:
+            return Config.loadYaml(f)
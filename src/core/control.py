@@ -0,0 +1,89 @@
+"""
+Run control: when a run stops, restarts or spends what's left of its budget on the elite.
+
+Before each generation, the controller looks at the population's counters
+and decides the next action:
+ - STOP after iterationsNumber generations, when the wall-clock or NEC
+   evaluations budget is spent, or on stagnation (when configured so)
+ - RESTART on stagnation: the king and the best individuals are kept, the
+   rest of the population is drawn again
+ - REFINE when the share refinement_share of a budget is all that's left:
+   remaining evaluations go to the elite (see Population.refineElite)
+ - EVOLVE otherwise
+Stagnation is an improvement of the king's fitness and of the mean fitness
+smaller than stagnation_tolerance over the last stagnation_window generations.
+Budgets and counters (elapsed time, NEC evaluations) are kept by the
+population, so they survive checkpoints.
+"""
+import logging
+import numpy as np
+from collections import deque
+from typing import Deque, Tuple
+from core.config import Config
+from core.population import Population
+
+class RunController:
+  EVOLVE = "evolve"
+  REFINE = "refine"
+  RESTART = "restart"
+  STOP = "stop"
+
+  def __init__(self, config: Config):
+    self.tuning = config.GeneticAlgoTuning
+    self.history: Deque[Tuple[float, float]] = deque(maxlen=self.tuning.stagnationWindow + 1)
+    self.reason: str = None    # Why the run stopped, restarted or is refining
+
+  def usedShare(self, population: Population) -> float:
+    """
+    Largest used share of the configured budgets (0 if none is)
+    """
+    shares = [0.0]
+    if self.tuning.timeBudget > 0:
+      shares.append(population.elapsedTime / self.tuning.timeBudget)
+    if self.tuning.evaluationsBudget > 0:
+      shares.append(population.necEvaluations / self.tuning.evaluationsBudget)
+    return max(shares)
+
+  def isStagnating(self) -> bool:
+    if self.tuning.stagnationWindow <= 0 or len(self.history) < self.history.maxlen:
+      return False
+
+    (oldKing, oldMean), (king, mean) = self.history[0], self.history[-1]
+    return king - oldKing < self.tuning.stagnationTolerance and mean - oldMean < self.tuning.stagnationTolerance
+
+  def observe(self, population: Population) -> None:
+    """
+    Records the outcome of a generation
+    """
+    fitness = np.array([g.fitnessCached for g in population.members()])
+    fitness = fitness[np.isfinite(fitness)]    # Failed evaluations would make the mean -inf
+    self.history.append((
+      getattr(population.king, "fitnessCached", float("-inf")),    # Niches' king may be 0
+      fitness.mean() if len(fitness) > 0 else float("-inf")
+    ))
+
+  def action(self, population: Population) -> str:
+    """
+    What the next generation should do
+    """
+    usedShare = self.usedShare(population)
+    if population.generationNumber >= self.tuning.iterationsNumber:
+      self.reason = f"{self.tuning.iterationsNumber} generations done"
+      return RunController.STOP
+    if usedShare >= 1:
+      self.reason = f"budget spent ({population.elapsedTime:.0f} s, {population.necEvaluations} NEC evaluations)"
+      return RunController.STOP
+    if self.isStagnating():
+      self.reason = f"no improvement in {self.tuning.stagnationWindow} generations"
+      self.history.clear()
+      return RunController.STOP if self.tuning.stagnationAction == RunController.STOP else RunController.RESTART
+    if usedShare >= 1 - self.tuning.refinementShare:
+      self.reason = f"{100 * (1 - usedShare):.0f}% of the budget left"
+      return RunController.REFINE
+
+    self.reason = None
+    return RunController.EVOLVE
+
+  def log(self, action: str) -> None:
+    if action != RunController.EVOLVE:
+      logging.info(f"Run control: {action}, {self.reason}")
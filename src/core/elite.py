@@ -0,0 +1,169 @@
+"""
+Elite archive shared across runs: a bounded hall of fame kept on disk.
+
+Candidates (the king and the best individuals of a generation) compete with
+their nearest member, geometrically: the mean distance between
+corresponding vertices of their paths. A candidate farther than
+crowdingRadius from every member is added while there is room; otherwise
+it replaces its nearest member if it's fitter. The archive thus keeps good
+antennas of different shapes instead of many copies of the best one.
+
+Members keep what NEC computed (fitness, radiation patterns), so new runs
+can be seeded with them without evaluating them again.
+"""
+import json
+import logging
+import numpy as np
+from os.path import exists
+from typing import List
+from core.config import Config
+from core.gene import Gene
+from core.evaluation import EvaluationResult, encodeGenes, decodeGene, collectResult, applyResult
+from core.checkpoint import saveArrays
+from utils.geometry import rodToVertices
+from utils.stats import pathDistances
+
+# Sections fitness depends on: members of runs with different ones aren't comparable
+COMPATIBILITY_SECTIONS = ["shape_constraints", "gene_encoding"]
+
+class EliteArchive:
+  def __init__(self, config: Config, capacity: int = 50, crowdingRadius: float = 2.0):
+    """
+    crowdingRadius is a mean distance between corresponding vertices, in mm
+    """
+    self.config = config
+    self.capacity = capacity
+    self.crowdingRadius = crowdingRadius
+    self.startPoint = (-config.ShapeConstraints.outerDiam / 2, 0)
+
+    empty = collectResult([])
+    self.encodings = np.empty((0, config.GeneEncoding.segmentsNumber, 2))
+    self.gpDistances = np.empty(0)
+    self.fitness = empty.fitness
+    self.gains = empty.gains
+    self.thetas = empty.thetas
+    self.phis = empty.phis
+
+  def __len__(self) -> int:
+    return len(self.fitness)
+
+  def isCompatible(self, configDict: dict) -> bool:
+    ownDict = self.config.toDict()
+    return all(configDict.get(section) == ownDict[section] for section in COMPATIBILITY_SECTIONS)
+
+  def insert(self, encodings: np.ndarray, gpDistances: np.ndarray, fitness: np.ndarray, gains: np.ndarray) -> int:
+    """
+    Crowding insertion of a batch of candidates, fittest first. Returns how many entered.
+    """
+    accepted = 0
+    segmentsCount = encodings.shape[1] + 1
+    candidatesVertices = rodToVertices(encodings, self.startPoint)
+    membersVertices = rodToVertices(self.encodings, self.startPoint)
+
+    for i in np.argsort(-fitness, kind="stable"):
+      if not np.isfinite(fitness[i]):
+        continue
+
+      nearest, distance = -1, np.inf
+      if len(self) > 0:
+        distances = pathDistances(membersVertices, candidatesVertices[i][np.newaxis]) / segmentsCount
+        nearest = int(np.argmin(distances))
+        distance = distances[nearest]
+
+      if distance >= self.crowdingRadius and len(self) < self.capacity:
+        self.encodings = np.concatenate([self.encodings, encodings[i][np.newaxis]])
+        self.gpDistances = np.append(self.gpDistances, gpDistances[i])
+        self.fitness = np.append(self.fitness, fitness[i])
+        self.gains = np.concatenate([self.gains, gains[i][np.newaxis]])
+        membersVertices = np.concatenate([membersVertices, candidatesVertices[i][np.newaxis]])
+      elif fitness[i] > self.fitness[nearest]:
+        self.encodings[nearest] = encodings[i]
+        self.gpDistances[nearest] = gpDistances[i]
+        self.fitness[nearest] = fitness[i]
+        self.gains[nearest] = gains[i]
+        membersVertices[nearest] = candidatesVertices[i]
+      else:
+        continue
+
+      accepted += 1
+
+    return accepted
+
+  def update(self, genes: List[Gene]) -> int:
+    """
+    Offers evaluated genes to the archive. Returns how many entered.
+    """
+    genes = [g for g in {id(g): g for g in genes}.values() if g.evaluated and g.fitnessCached > float("-inf")]
+    if len(genes) == 0:
+      return 0
+
+    encodings, gpDistances = encodeGenes(genes)
+    result = collectResult(genes)
+    if np.isnan(self.thetas).all():
+      self.thetas, self.phis = result.thetas, result.phis
+
+    return self.insert(encodings, gpDistances, result.fitness, result.gains)
+
+  def genes(self, number: int = None) -> List[Gene]:
+    """
+    Members as genes, fittest first, with their fitness and radiation patterns
+    """
+    order = np.argsort(-self.fitness, kind="stable")[:number]
+    genes = [decodeGene(self.config, self.encodings[i], self.gpDistances[i]) for i in order]
+    applyResult(genes, EvaluationResult(self.fitness[order], self.gains[order], self.thetas, self.phis))
+
+    return genes
+
+  def seed(self, individuals: List[Gene], fraction: float) -> int:
+    """
+    Replaces up to fraction of individuals (in place) with members, fittest first. Returns how many were seeded.
+    """
+    elites = self.genes(int(round(fraction * len(individuals))))
+    individuals[:len(elites)] = elites
+
+    return len(elites)
+
+  def merge(self, filename: str) -> int:
+    """
+    Offers the members of the archive saved in filename (if compatible). Returns how many entered.
+    """
+    if not exists(filename):
+      return 0
+
+    with np.load(filename) as f:
+      if not self.isCompatible(json.loads(str(f["config"]))):
+        logging.warning(f"Elite archive {filename} comes from a different configuration, ignored")
+        return 0
+
+      if np.isnan(self.thetas).all():
+        self.thetas, self.phis = f["thetas"], f["phis"]
+      if len(self) == 0:
+        # Taken as is: replacements may have left members closer than crowdingRadius
+        self.encodings, self.gpDistances, self.fitness, self.gains = \
+          f["encodings"][:self.capacity], f["gpDistances"][:self.capacity], f["fitness"][:self.capacity], f["gains"][:self.capacity]
+        return len(self)
+      return self.insert(f["encodings"], f["gpDistances"], f["fitness"], f["gains"])
+
+  def save(self, filename: str) -> None:
+    """
+    Merges what other runs saved meanwhile, then writes atomically
+    """
+    self.merge(filename)
+    saveArrays(filename, {
+      "config": np.array(json.dumps(self.config.toDict())),
+      "encodings": self.encodings,
+      "gpDistances": self.gpDistances,
+      "fitness": self.fitness,
+      "gains": self.gains,
+      "thetas": self.thetas,
+      "phis": self.phis
+    })
+
+  @staticmethod
+  def load(filename: str, config: Config, capacity: int = 50, crowdingRadius: float = 2.0) -> "EliteArchive":
+    """
+    Archive saved in filename, empty if there's none (or it's incompatible with config)
+    """
+    archive = EliteArchive(config, capacity, crowdingRadius)
+    archive.merge(filename)
+    return archive
@@ -0,0 +1,180 @@
+import numpy as np
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import List, Tuple
+from core.config import Config
+from core.gene import Gene
+from rf.radiation import RadiationPattern
+from utils.geometry import PolarCoord
+
+@dataclass
+class EvaluationResult:
+  """
+  Compact, array-based outcome of a batch of NEC evaluations.
+  Failed evaluations have -inf fitness and NaN gains.
+  """
+  fitness: np.ndarray    # (P,)
+  gains: np.ndarray    # (P, 2, K) sagittal and frontal gains in mW
+  thetas: np.ndarray    # (2, T) in rad, shared by the whole batch
+  phis: np.ndarray    # (2, F) in rad, shared by the whole batch
+  solveTimes: np.ndarray = None    # (P,) NEC solve times in s
+  failures: np.ndarray = None    # (P,) NEC failure codes (see rf.nec_analysis)
+
+
+def encodeGenes(genes: List[Gene]) -> Tuple[np.ndarray, np.ndarray]:
+  """
+  Packs genes into a (P, N, 2) array of rod coordinates (angle, length)
+  and a (P,) array of ground plane distances
+  """
+  segmentsNumber = genes[0].config.GeneEncoding.segmentsNumber if len(genes) > 0 else 0
+  encodings = np.array(
+    [[(c.angle, c.distance) for c in g.rodEncoding] for g in genes],
+    dtype=np.float64
+  ).reshape(len(genes), segmentsNumber, 2)
+
+  gpDistances = np.array([g.groundPlaneDistance for g in genes], dtype=np.float64)
+
+  return encodings, gpDistances
+
+def radiationPatternSizes() -> Tuple[int, int, int]:
+  """
+  Number of gains, thetas and phis of each radiation pattern slice (sagittal or frontal)
+  """
+  evaluations = Gene.SAGITTAL_RP_EVALUATIONS
+  return (
+    int(sum(e.thetaNum * e.phiNum for e in evaluations)),
+    int(sum(e.thetaNum for e in evaluations)),
+    int(sum(e.phiNum for e in evaluations))
+  )
+
+def decodeGene(config: Config, encoding: np.ndarray, gpDistance: float, geneClass = Gene) -> Gene:
+  return geneClass(config, [PolarCoord(float(a), float(l)) for a, l in encoding], float(gpDistance))
+
+def searchBounds(config: Config) -> Tuple[np.ndarray, np.ndarray]:
+  """
+  Lower and upper bounds of flat gene vectors (see genesToVectors)
+  """
+  encoding, constraints = config.GeneEncoding, config.ShapeConstraints
+  lowerBounds = np.concatenate([
+    np.full(encoding.segmentsNumber, -encoding.maxAngle / 2),
+    np.full(encoding.segmentsNumber, encoding.minSegmentLen),
+    [constraints.groundPlaneDistanceMin]
+  ])
+  upperBounds = np.concatenate([
+    np.full(encoding.segmentsNumber, encoding.maxAngle / 2),
+    np.full(encoding.segmentsNumber, encoding.maxSegmentLen),
+    [constraints.groundPlaneDistanceMax]
+  ])
+
+  return lowerBounds, upperBounds
+
+def genesToVectors(genes: List[Gene]) -> np.ndarray:
+  """
+  Genes as a (P, 2N + 1) matrix of flat vectors: N angles, N lengths, ground plane distance
+  """
+  encodings, gpDistances = encodeGenes(genes)
+  return np.concatenate([encodings[..., 0], encodings[..., 1], gpDistances[:, np.newaxis]], axis=-1)
+
+def vectorsToEncodings(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+  """
+  (P, N, 2) rod encodings and (P,) ground plane distances of flat gene vectors
+  """
+  segmentsNumber = (vectors.shape[-1] - 1) // 2
+  encodings = np.stack([vectors[:, :segmentsNumber], vectors[:, segmentsNumber:2 * segmentsNumber]], axis=-1)
+  return encodings, vectors[:, -1]
+
+def evaluateEncodings(config: Config, encodings: np.ndarray, gpDistances: np.ndarray) -> EvaluationResult:
+  """
+  Runs NEC on every encoding of the batch. Meant to be called by evaluation workers,
+  it doesn't need any Gene from the caller. Fitness is NEC's alone, without the
+  bonus of Gene subclasses (see applyResult).
+  """
+  gainsSize, thetasSize, phisSize = radiationPatternSizes()
+  result = EvaluationResult(
+    np.full(len(encodings), float("-inf")),
+    np.full((len(encodings), 2, gainsSize), np.nan),
+    np.full((2, thetasSize), np.nan),
+    np.full((2, phisSize), np.nan),
+    np.zeros(len(encodings)),
+    np.zeros(len(encodings), dtype=np.int64)
+  )
+
+  for i, (encoding, gpDistance) in enumerate(zip(encodings, gpDistances)):
+    gene = decodeGene(config, encoding, gpDistance)
+    result.fitness[i] = gene.evaluate()
+    result.solveTimes[i] = gene.solveTime
+    result.failures[i] = gene.necFailure
+
+    if result.fitness[i] == float("-inf"):
+      continue
+
+    for j, pattern in enumerate((gene.getRadiationPatternSagittal(), gene.getRadiationPatternFrontal())):
+      result.gains[i, j] = pattern.gainsMw
+      result.thetas[j] = pattern.thetasRad
+      result.phis[j] = pattern.phisRad
+
+  return result
+
+def applyResult(genes: List[Gene], result: EvaluationResult, necFitness: bool = False) -> None:
+  """
+  Stores fitness and radiation patterns of a batch evaluation into the genes it was computed from.
+  With necFitness, result's fitness is NEC's alone (see evaluateEncodings): genes' bonus is added.
+  """
+  for i, (gene, fitness, gains) in enumerate(zip(genes, result.fitness, result.gains)):
+    gene.fitnessCached = float(fitness) + (gene.fitnessBonus() if necFitness else 0.0)
+    gene.evaluated = True
+    gene.objectives = None
+    if result.solveTimes is not None:
+      gene.solveTime = float(result.solveTimes[i])
+      gene.necFailure = int(result.failures[i])
+
+    if fitness == float("-inf"):
+      continue
+
+    gene.radiationPatternSagittal = RadiationPattern(list(gains[0]), list(result.thetas[0]), list(result.phis[0]))
+    gene.radiationPatternFrontal = RadiationPattern(list(gains[1]), list(result.thetas[1]), list(result.phis[1]))
+
+def collectResult(genes: List[Gene]) -> EvaluationResult:
+  """
+  Inverse of applyResult: packs what evaluated genes already know
+  """
+  gainsSize, thetasSize, phisSize = radiationPatternSizes()
+  result = EvaluationResult(
+    np.array([g.fitnessCached for g in genes], dtype=np.float64),
+    np.full((len(genes), 2, gainsSize), np.nan),
+    np.full((2, thetasSize), np.nan),
+    np.full((2, phisSize), np.nan),
+    np.array([g.solveTime for g in genes], dtype=np.float64),
+    np.array([g.necFailure for g in genes], dtype=np.int64)
+  )
+
+  for i, gene in enumerate(genes):
+    for j, pattern in enumerate((gene.getRadiationPatternSagittal(), gene.getRadiationPatternFrontal())):
+      if pattern is None:
+        continue
+      result.gains[i, j] = pattern.gainsMw
+      result.thetas[j] = pattern.thetasRad
+      result.phis[j] = pattern.phisRad
+
+  return result
+
+
+class IEvaluator(ABC):
+  @abstractmethod
+  def evaluate(self, genes: List[Gene]) -> None:
+    """
+    Computes (and caches) the fitness of every gene in the list
+    """
+    ...
+
+  def close(self) -> None:
+    pass
+
+
+class LocalEvaluator(IEvaluator):
+  """
+  In-process, sequential evaluation
+  """
+  def evaluate(self, genes: List[Gene]) -> None:
+    for gene in genes:
+      gene.fitness()
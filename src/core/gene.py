@@ -1,26 +1,42 @@
 import logging
+import time
 import numpy as np
 from necpp import *
 from core.config import Config
 from utils.geometry import *
 from rf.radiation import RadiationPattern, RpCardEvaluationInput
-from rf.nec_analysis import NecAnalysis
+from rf.nec_analysis import NecAnalysis, NEC_OK, NEC_GEOMETRY_ERROR, NEC_EXCITATION_ERROR, NEC_PATTERN_ERROR, NEC_NON_FINITE
+from utils.profiling import PROFILER
 
 class Gene:
   globalSerial = 0
   GAIN_K = 1
   STANDARD_DEVIATION_K = 0
   # STANDARD_DEVIATION_K = -1    # Penalize high sd
-
-  def __init__(self, rodEncodedGene: List[PolarCoord] = None, groundPlaneDist: float = 1):
-    self.FIRST_POINT = Point(- Config.ShapeConstraints.outerDiam / 2, 0)
+  SAGITTAL_RP_EVALUATIONS = [
+    RpCardEvaluationInput(60, 0, -15, 45, 45, 0, 0),    # sagittal plane (1)
+    RpCardEvaluationInput(15, 60, 15, 225, 225, 0, 1)    # sagittal plane (2)
+  ]
+  FRONTAL_RP_EVALUATIONS = [
+    RpCardEvaluationInput(60, 0, -15, 135, 135, 0, 2),    # frontal plane (1)
+    RpCardEvaluationInput(15, 60, 15, 315, 315, 0, 3)    # frontal plane (2)
+  ]
+
+  def __init__(self, config: Config, rodEncodedGene: List[PolarCoord] = None, groundPlaneDist: float = 1):
+    self.config = config
+    self.FIRST_POINT = Point(- self.config.ShapeConstraints.outerDiam / 2, 0)
 
     self.radiationPatternSagittal = None
     self.radiationPatternFrontal = None
     self.fitnessCached = float("-inf")
+    self.evaluated = False
+    self.solveTime = 0.0    # s, of the last NEC evaluation
+    self.necFailure = NEC_OK
+    self.objectives: np.ndarray = None    # Pareto mode's objective vector, see core.pareto
+    self.parents = (-1, -1)    # Serials of mother and father, for offspring
     self.groundPlaneDistance = np.random.uniform(
-      low = Config.ShapeConstraints.groundPlaneDistanceMin,
-      high = Config.ShapeConstraints.groundPlaneDistanceMax,
+      low = self.config.ShapeConstraints.groundPlaneDistanceMin,
+      high = self.config.ShapeConstraints.groundPlaneDistanceMax,
       size = 1
     )[0]
 
@@ -36,19 +52,15 @@ class Gene:
       self.groundPlaneDistance = groundPlaneDist
       return
 
-    revolutionAngles = np.random.uniform(
-      -Config.GeneEncoding.maxAngle/2,
-      +Config.GeneEncoding.maxAngle/2,
-      Config.GeneEncoding.segmentsNumber
-    )
-    
-    segmentLengths = np.random.uniform(
-      low = Config.GeneEncoding.minSegmentLen,
-      high = Config.GeneEncoding.maxSegmentLen,
-      size = Config.GeneEncoding.segmentsNumber
-    )
+    encoding = self.randomEncodings(self.config, 1)[0]
+    self.setEncoding(encoding[:, 0], encoding[:, 1])
 
-    self.setEncoding(revolutionAngles, segmentLengths)
+  @staticmethod
+  def randomEncodings(config: Config, size: int) -> np.ndarray:
+    """
+    (size, N, 2) rod encodings drawn as this class' genes are initialized
+    """
+    return randomRodEncodings(config.GeneEncoding, size, config.GeneEncoding.maxAngle / 2)
 
   def __lt__(self, other) -> bool:
     return self.fitness() < other.fitness()
@@ -107,6 +119,9 @@ class Gene:
 
     # Invalidate cached fitness
     self.fitnessCached = float("-inf")
+    self.evaluated = False
+    self.solveTime = 0.0
+    self.necFailure = NEC_OK
   
   def setGroundPlaneDistance(self, gpDist: float) -> None:
     self.groundPlaneDistance = gpDist
@@ -116,12 +131,13 @@ class Gene:
     Returns true if the path is not slef-intersecting, doesn't come
     across the inner hole and is inside the outer circle
     """
-    OUTER_RADIUS = Config.ShapeConstraints.outerDiam / 2
-    INNER_RADIUS = Config.ShapeConstraints.innerDiam / 2
+    PROFILER.count("isValid")
+    OUTER_RADIUS = self.config.ShapeConstraints.outerDiam / 2
+    INNER_RADIUS = self.config.ShapeConstraints.innerDiam / 2
     
     return (
       not isSelfIntersectingPath(self.polychainEncoding) and
-      not doesPathIntersectCircle(self.polychainEncoding, Point(Config.ShapeConstraints.centerShift, 0), INNER_RADIUS) and
+      not doesPathIntersectCircle(self.polychainEncoding, Point(self.config.ShapeConstraints.centerShift, 0), INNER_RADIUS) and
       isPathInCircle(self.polychainEncoding, Point(0, 0), OUTER_RADIUS)
     )
   
@@ -130,33 +146,43 @@ class Gene:
 
 
   def fitness(self) -> np.float16:
-    freqHz = Config.ShapeConstraints.targetFreq
-
-    if self.fitnessCached > float("-inf"):
+    if self.fitnessCached > float("-inf") or self.evaluated:
         return self.fitnessCached
 
+    return self.evaluate()
+
+  def fitnessBonus(self) -> float:
+    """
+    Points subclasses add to NEC's fitness (see NewGene). Batch evaluators add them too,
+    as evaluation workers only run NEC.
+    """
+    return 0.0
+
+  def evaluate(self) -> float:
+    """
+    Runs the NEC analysis, regardless of the cached value, and
+    refreshes fitness and radiation patterns
+    """
+    stage = NEC_GEOMETRY_ERROR
+    self.objectives = None
+    startTime = time.perf_counter()
     try:
-      with NecAnalysis(self, freqHz) as sim:
+      with PROFILER.phase("nec"), NecAnalysis(self, self.config.ShapeConstraints.targetFreq) as sim:
         context = sim.getNecContext()
 
+        stage = NEC_EXCITATION_ERROR
         sim.addInfiniteGroundPlane()
         sim.runExcitation()
             
-        self.radiationPatternSagittal = sim.computeRadiationPattern([
-            RpCardEvaluationInput(60, 0, -15, 45, 45, 0, 0),    # sagittal plane (1)
-            RpCardEvaluationInput(15, 60, 15, 225, 225, 0, 1)    # sagittal plane (2)
-        ])
-
-        self.radiationPatternFrontal = sim.computeRadiationPattern([
-            RpCardEvaluationInput(60, 0, -15, 135, 135, 0, 2),    # frontal plane (1)
-            RpCardEvaluationInput(15, 60, 15, 315, 315, 0, 3)    # frontal plane (2)
-        ])
-
+        stage = NEC_PATTERN_ERROR
+        self.radiationPatternSagittal = sim.computeRadiationPattern(self.SAGITTAL_RP_EVALUATIONS)
+        self.radiationPatternFrontal = sim.computeRadiationPattern(self.FRONTAL_RP_EVALUATIONS)
 
         min_gain = min([nec_gain_min(context, i) for i in range(4)])
         sd_gain = max([nec_gain_sd(context, i) for i in range(4)])
         max_gain = max([nec_gain_max(context, i) for i in range(4)])
         self.fitnessCached = self.GAIN_K * min_gain + self.STANDARD_DEVIATION_K * sd_gain
+        self.necFailure = NEC_OK
         
         logging.debug(
             f"Gain\n"
@@ -166,10 +192,17 @@ class Gene:
             # f"\tmean: {nec_gain_mean(context, 0)}\n"
         )
 
+        if not np.isfinite(self.fitnessCached):
+          self.necFailure = NEC_NON_FINITE
+          self.fitnessCached = float("-inf")    # Discarded as any other failure
+
     except AssertionError:
       logging.debug(nec_error_message())
+      self.necFailure = stage
       self.fitnessCached = float("-inf")    # This gene will be discarded at the next iteration
 
+    self.solveTime = time.perf_counter() - startTime
+    self.evaluated = True
     return self.fitnessCached
 
 class ValidInitGene(Gene):
@@ -177,92 +210,37 @@ class ValidInitGene(Gene):
   GAIN_K = 1
   STANDARD_DEVIATION_K = 0
 
-  def __init__(self, rodEncodedGene: List[PolarCoord] = None, groundPlaneDist: float = 1):
-    self.FIRST_POINT = Point(- Config.ShapeConstraints.outerDiam / 2, 0)
-
-    self.radiationPatternSagittal = None
-    self.radiationPatternFrontal = None
-    self.fitnessCached = float("-inf")
-    self.groundPlaneDistance = np.random.uniform(
-      low = Config.ShapeConstraints.groundPlaneDistanceMin,
-      high = Config.ShapeConstraints.groundPlaneDistanceMax,
-      size = 1
-    )[0]
-
-    self.serial = Gene.globalSerial
-    Gene.globalSerial += 1
-
-    if (rodEncodedGene is not None):
-      self.rodEncoding = rodEncodedGene
-      self.polychainEncoding = polarToPolychain(
-        self.FIRST_POINT,
-        rodToPolar(self.rodEncoding)
-      )
-      self.groundPlaneDistance = groundPlaneDist
-      return
-
-    revolutionAngles = np.random.uniform(-np.pi/Config.GeneEncoding.segmentsNumber, np.pi/Config.GeneEncoding.segmentsNumber, Config.GeneEncoding.segmentsNumber)
-    
-    segmentLengths = np.random.uniform(
-      low = Config.GeneEncoding.minSegmentLen,
-      high = Config.GeneEncoding.maxSegmentLen,
-      size = Config.GeneEncoding.segmentsNumber)
-
-    self.setEncoding(revolutionAngles, segmentLengths)
+  @staticmethod
+  def randomEncodings(config: Config, size: int) -> np.ndarray:
+    return randomRodEncodings(config.GeneEncoding, size, np.pi/config.GeneEncoding.segmentsNumber)
 
 class BiasedInitGene(Gene):
   globalSerial = 0
   GAIN_K = 1
   STANDARD_DEVIATION_K = 0
 
-  def __init__(self, rodEncodedGene: List[PolarCoord] = None, groundPlaneDist: float = 1):
-    self.FIRST_POINT = Point(- Config.ShapeConstraints.outerDiam / 2, 0)
-
-    self.radiationPatternSagittal = None
-    self.radiationPatternFrontal = None
-    self.fitnessCached = float("-inf")
-    self.groundPlaneDistance = np.random.uniform(
-      low = Config.ShapeConstraints.groundPlaneDistanceMin,
-      high = Config.ShapeConstraints.groundPlaneDistanceMax,
-      size = 1
-    )[0]
-
-    self.serial = Gene.globalSerial
-    Gene.globalSerial += 1
-
-    if (rodEncodedGene is not None):
-      self.rodEncoding = rodEncodedGene
-      self.polychainEncoding = polarToPolychain(
-        self.FIRST_POINT,
-        rodToPolar(self.rodEncoding)
-      )
-      self.groundPlaneDistance = groundPlaneDist
-      return
-
+  @staticmethod
+  def randomEncodings(config: Config, size: int) -> np.ndarray:
     biasAngle = np.deg2rad(20)
-    revolutionAngles = np.random.uniform(-np.pi/Config.GeneEncoding.segmentsNumber + biasAngle, np.pi/Config.GeneEncoding.segmentsNumber + biasAngle, Config.GeneEncoding.segmentsNumber)
-    
-    segmentLengths = np.random.uniform(
-      low = Config.GeneEncoding.minSegmentLen,
-      high = Config.GeneEncoding.maxSegmentLen,
-      size = Config.GeneEncoding.segmentsNumber)
-
-    self.setEncoding(revolutionAngles, segmentLengths)
+    return randomRodEncodings(config.GeneEncoding, size, np.pi/config.GeneEncoding.segmentsNumber, biasAngle)
 
 class NewGene(Gene):
   def fitness(self) -> float:
-    if self.fitnessCached > float("-inf"):
+    if self.fitnessCached > float("-inf") or self.evaluated:
       return self.fitnessCached
     
-    self.fitnessCached = super().fitness()
+    self.fitnessCached = super().fitness() + self.fitnessBonus()
+    return self.fitnessCached
+
+  def fitnessBonus(self) -> float:
+    OUTER_RADIUS = self.config.ShapeConstraints.outerDiam / 2
+    INNER_RADIUS = self.config.ShapeConstraints.innerDiam / 2
+    bonus = 0.0
 
-    OUTER_RADIUS = Config.ShapeConstraints.outerDiam / 2
-    INNER_RADIUS = Config.ShapeConstraints.innerDiam / 2
-    
     if isPathInCircle(self.polychainEncoding, Point(0, 0), OUTER_RADIUS):
-      self.fitnessCached += Config.GeneticAlgoTuning.insideCirclePoints
+      bonus += self.config.GeneticAlgoTuning.insideCirclePoints
 
-    if not doesPathIntersectCircle(self.polychainEncoding, Point(Config.ShapeConstraints.centerShift, 0), INNER_RADIUS):
-      self.fitnessCached += Config.GeneticAlgoTuning.notCrossingHolePoints
-    
-    return self.fitnessCached
\ No newline at end of file
+    if not doesPathIntersectCircle(self.polychainEncoding, Point(self.config.ShapeConstraints.centerShift, 0), INNER_RADIUS):
+      bonus += self.config.GeneticAlgoTuning.notCrossingHolePoints
+
+    return bonus
\ No newline at end of file
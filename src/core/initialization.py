@@ -0,0 +1,72 @@
+"""
+Bulk initialization of valid populations.
+
+Candidate encodings are drawn in batches, as the gene class draws them
+(Gene.randomEncodings), and filtered with the vectorized validity checks:
+accepted genes are independent draws conditioned on being valid, hence as
+diverse as the gene class allows. Batches are sized on the acceptance rate
+seen so far. Distributions that hardly ever produce valid paths (e.g.
+ValidInitGene's, too long to fit the outer circle) are completed by
+repairing their candidates (see core.repair).
+"""
+import numpy as np
+from math import ceil
+from typing import List
+from core.config import Config
+from core.gene import Gene
+from core.repair import repairEncodings
+from utils.geometry import PolarCoord, rodToVertices, validPathsMask
+
+MAX_BATCH_SIZE = 20000
+MIN_ACCEPTANCE_RATE = 0.005    # Below this, candidates are repaired rather than drawn again
+MAX_FRUITLESS_BATCHES = 10    # Consecutive batches without any valid candidate, drawn or repaired, before giving up
+
+def randomValidEncodings(config: Config, size: int, geneClass = Gene) -> np.ndarray:
+  """
+  Exactly size valid (size, N, 2) rod encodings, drawn as geneClass draws them.
+  Raises ValueError when neither drawing nor repair yields valid ones.
+  """
+  startPoint = (-config.ShapeConstraints.outerDiam / 2, 0)
+  accepted = [np.empty((0, config.GeneEncoding.segmentsNumber, 2))]
+  acceptedNumber, drawnNumber = 0, 0
+  fruitlessBatches = 0
+  acceptanceRate = 0.05    # Rough guess for the first batch
+
+  while acceptedNumber < size:
+    missing = size - acceptedNumber
+    batchSize = min(MAX_BATCH_SIZE, ceil(1.2 * missing / max(acceptanceRate, MIN_ACCEPTANCE_RATE)))
+    candidates = geneClass.randomEncodings(config, batchSize)
+    valid = validPathsMask(rodToVertices(candidates, startPoint), config.ShapeConstraints)
+
+    drawnNumber += batchSize
+    acceptanceRate = (acceptedNumber + valid.sum()) / drawnNumber
+    if acceptanceRate < MIN_ACCEPTANCE_RATE:
+      if config.GeneticAlgoTuning.repairRounds == 0 and acceptedNumber + valid.sum() == 0:
+        raise ValueError(f"{geneClass.__name__} draws no valid gene in {drawnNumber} and repair is disabled")
+      elif config.GeneticAlgoTuning.repairRounds > 0:
+        candidates, valid = repairEncodings(config, candidates[:ceil(1.2 * missing)], config.GeneticAlgoTuning.repairRounds)
+
+    accepted.append(candidates[valid][:missing])
+    acceptedNumber += len(accepted[-1])
+
+    fruitlessBatches = fruitlessBatches + 1 if len(accepted[-1]) == 0 else 0
+    if fruitlessBatches == MAX_FRUITLESS_BATCHES:
+      raise ValueError(
+        f"No valid {geneClass.__name__} drawn or repaired in the last {MAX_FRUITLESS_BATCHES} batches "
+        f"({drawnNumber} candidates drawn, {acceptedNumber} of {size} valid): shape constraints may be unsatisfiable"
+      )
+
+  return np.concatenate(accepted)
+
+def randomValidGenes(config: Config, size: int, geneClass = Gene) -> List[Gene]:
+  """
+  Exactly size valid genes of geneClass, ground plane distances are drawn as in Gene
+  """
+  encodings = randomValidEncodings(config, size, geneClass)
+  gpDistances = np.random.uniform(config.ShapeConstraints.groundPlaneDistanceMin, config.ShapeConstraints.groundPlaneDistanceMax, size)
+
+  # Python floats: building genes from NumPy scalars is several times slower
+  return [
+    geneClass(config, [PolarCoord(a, l) for a, l in encoding], gpDistance)
+    for encoding, gpDistance in zip(encodings.tolist(), gpDistances.tolist())
+  ]
@@ -0,0 +1,110 @@
+"""
+Memetic local refinement: pattern search around the best genes.
+
+A gene is a point of the box [-maxAngle/2, maxAngle/2]^N x [minSegmentLen,
+maxSegmentLen]^N x [gpDistanceMin, gpDistanceMax], scaled to the unit cube.
+Each refinement polls, for every elite gene, both directions of random
+coordinates at its current step (compass search); the probes of all genes
+are evaluated as a single batch. A gene moves to its best probe when it's
+fitter, and its step grows; otherwise its step shrinks. Steps are kept per
+gene across refinements. Invalid probes are dropped before evaluation: they
+cost no NEC run.
+"""
+import logging
+import numpy as np
+from typing import Dict, List, Tuple
+from core.config import Config
+from core.gene import Gene
+from core.evaluation import decodeGene, searchBounds, genesToVectors, vectorsToEncodings
+from utils.geometry import rodToVertices, validPathsMask
+from utils.profiling import PROFILER
+
+EXPANSION = 1.5
+CONTRACTION = 0.5
+MIN_STEP = 1e-3
+
+class LocalRefiner:
+  def __init__(self, config: Config, eliteSize: int, evaluations: int, initialStep: float):
+    """
+    evaluations is the budget of each refinement, shared by the eliteSize best genes
+    """
+    self.config = config
+    self.eliteSize = eliteSize
+    self.evaluations = evaluations
+    self.initialStep = initialStep
+    self.steps: Dict[int, float] = {}    # serial -> step, in unit cube's units
+    self.necEvaluations = 0
+    self.improvements = 0
+
+    self.lowerBounds, self.upperBounds = searchBounds(config)
+
+  def toUnitCube(self, genes: List[Gene]) -> np.ndarray:
+    return (genesToVectors(genes) - self.lowerBounds) / (self.upperBounds - self.lowerBounds)
+
+  def fromUnitCube(self, points: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    return vectorsToEncodings(self.lowerBounds + points * (self.upperBounds - self.lowerBounds))
+
+  def probes(self, points: np.ndarray, steps: np.ndarray, probesNumber: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    probesNumber points around each of points (+- step along random coordinates), and the index of their origin
+    """
+    dimensions = points.shape[1]
+    coordinatesNumber = min(dimensions, max(1, probesNumber // 2))
+    coordinates = np.argsort(np.random.random((len(points), dimensions)), axis=-1)[:, :coordinatesNumber]
+
+    origins = np.repeat(np.arange(len(points)), 2 * coordinatesNumber)
+    probes = points[origins].copy()
+    rows = np.arange(len(probes))
+    signs = np.tile(np.repeat([1.0, -1.0], coordinatesNumber), len(points))
+    probes[rows, coordinates.repeat(2, axis=0).reshape(-1)] += signs * steps[origins]
+
+    return np.clip(probes, 0, 1), origins
+
+  def refine(self, population: "Population", evaluations: int = None) -> int:
+    """
+    One pattern search iteration on the population's elite, within evaluations
+    NEC evaluations (the refiner's budget by default). Returns the number of genes improved.
+    """
+    evaluations = evaluations if evaluations is not None else self.evaluations
+    elite = [g for g in population.elite(self.eliteSize) if g.evaluated and g.fitnessCached > float("-inf")]
+    if len(elite) == 0:
+      return 0
+
+    points = self.toUnitCube(elite)
+    steps = np.array([self.steps.get(g.serial, self.initialStep) for g in elite])
+    probes, origins = self.probes(points, steps, max(2, evaluations // len(elite)))
+
+    encodings, gpDistances = self.fromUnitCube(probes)
+    startPoint = (-self.config.ShapeConstraints.outerDiam / 2, 0)
+    valid = validPathsMask(rodToVertices(encodings, startPoint), self.config.ShapeConstraints)
+    candidates = [decodeGene(self.config, encodings[i], gpDistances[i], population.geneClass) for i in np.flatnonzero(valid)]
+    origins = origins[valid]
+
+    necEvaluations = population.necEvaluations
+    with PROFILER.phase("evaluate"):
+      population.evaluate(candidates)
+    self.necEvaluations += population.necEvaluations - necEvaluations    # Probes already known don't run NEC
+
+    improved = 0
+    fitness = np.array([c.fitnessCached for c in candidates])
+    for i, gene in enumerate(elite):
+      tried = np.flatnonzero(origins == i)
+      best = tried[np.argmax(fitness[tried])] if len(tried) > 0 else None
+      if best is not None and fitness[best] > gene.fitnessCached:
+        newGene = candidates[best]
+        newGene.serial, newGene.parents = gene.serial, gene.parents    # Same gene, a step further
+        population.replaceMember(gene, newGene)
+        if gene is population.king:
+          population.king = newGene
+        self.steps[gene.serial] = min(1.0, steps[i] * EXPANSION)
+        improved += 1
+      else:
+        self.steps[gene.serial] = max(MIN_STEP, steps[i] * CONTRACTION)
+
+    # Forget genes that left the population
+    serials = {g.serial for g in population.members()}
+    self.steps = {serial: step for serial, step in self.steps.items() if serial in serials}
+
+    self.improvements += improved
+    logging.info(f"Local refinement: {improved} of {len(elite)} elite genes improved with {population.necEvaluations - necEvaluations} NEC evaluations")
+    return improved
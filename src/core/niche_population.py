@@ -1,19 +1,22 @@
 import logging
 import numpy as np
-from typing import List
+from typing import List, Tuple
 from core.population import Population
 from core.gene import Gene, NewGene
+from core.initialization import randomValidGenes
 from random import choice, choices, randrange, random
 from core.config import Config
+from utils.profiling import PROFILER
 from operator import itemgetter
 from math import sqrt, floor, ceil
 
 class NichePopulation(Population):
-    def __init__(self, *args, **kwargs):
-        self.worldHeight = Config.GeneticAlgoTuning.worldHeight
-        self.worldWidth = Config.GeneticAlgoTuning.worldWidth
+    def __init__(self, config: Config, *args, **kwargs):
+        self.worldHeight = config.GeneticAlgoTuning.worldHeight
+        self.worldWidth = config.GeneticAlgoTuning.worldWidth
 
         super().__init__(
+            config,
             self.worldHeight * self.worldWidth,
             Gene,
             *args, **kwargs
@@ -28,7 +31,7 @@ class NichePopulation(Population):
             self.worldWidth
         )
 
-        self.mutationRate = Config.GeneticAlgoTuning.mutationRate
+        self.mutationRate = self.config.GeneticAlgoTuning.mutationRate
 
     def fromPopulation(self, population: Population):
         self.individuals = population.individuals.copy()
@@ -38,7 +41,12 @@ class NichePopulation(Population):
         self.generationNumber = population.generationNumber
         self.newbornsCounter = population.newbornsCounter
         self.killedGenes = population.killedGenes
+        self.necEvaluations = population.necEvaluations
+        self.elapsedTime = population.elapsedTime
+        self.refiner = population.refiner
         self.king = population.king
+        self.evaluator = population.evaluator
+        self.geneClass = population.geneClass
 
         self.__post_init__()
 
@@ -48,6 +56,27 @@ class NichePopulation(Population):
         # TODO: unify this property with superclass population attribute
         return self.world.reshape(self.world.size)
     
+    def members(self) -> List[Gene]:
+        return self.populationSet().tolist()
+
+    def replaceMember(self, gene: Gene, newGene: Gene) -> None:
+        for (i, j), member in np.ndenumerate(self.world):
+            if member is gene:
+                self.world[i][j] = newGene
+
+    def restart(self, survivors: int) -> None:
+        """
+        Keeps the king and the best survivors genes, scattered over a newly drawn world
+        """
+        kept = [g for g in self.elite(survivors) if g.fitnessCached > float("-inf")]
+        if isinstance(self.king, Gene) and self.king not in kept and self.king.fitnessCached > float("-inf"):
+            kept = [self.king] + kept[:-1]
+
+        genes = np.empty(self.world.size, dtype=object)
+        genes[:] = randomValidGenes(self.config, self.world.size, self.geneClass)
+        genes[np.random.choice(self.world.size, len(kept), replace=False)] = kept
+        self.world = genes.reshape(self.worldHeight, self.worldWidth)
+
     def nicheToSet(self, niche: np.ndarray) -> np.ndarray:
         return niche.reshape(niche.size)
 
@@ -68,7 +97,10 @@ class NichePopulation(Population):
             return choices(neigh, k=2)
 
 
-    def sampleNiche(self) -> np.ndarray:
+    def sampleNiche(self) -> Tuple[np.ndarray, Tuple[np.ndarray, np.ndarray]]:
+        """
+        A niche (a copy of a submatrix of world) and the world cells it was taken from, as np.ix_ indices
+        """
         rows, cols = self.world.shape
 
         x = randrange(rows)
@@ -77,10 +109,11 @@ class NichePopulation(Population):
         sliceX = np.array(range(x-5, x+5)) % self.worldHeight
         sliceY = np.array(range(y-5, y+5)) % self.worldWidth
 
-        return self.world[sliceX, :][:, sliceY]
+        cells = np.ix_(sliceX, sliceY)
+        return self.world[cells], cells
 
     def generateOffspring(self, niche: np.ndarray):
-        for _ in range(ceil(Config.GeneticAlgoTuning.turnoverRate*niche.size)):
+        for _ in range(ceil(self.config.GeneticAlgoTuning.turnoverRate*niche.size)):
             mother, father = self.extractParents(niche)
             childA, childB = self.crossover(mother, father)
 
@@ -107,69 +140,81 @@ class NichePopulation(Population):
 
     def mutate(self, niche):
         for gene in self.nicheToSet(niche):
-            if random() > Config.GeneticAlgoTuning.mutationRate:
+            if random() > self.config.GeneticAlgoTuning.mutationRate:
                 continue    # Because of uniform probability
 
             mutationAngles = np.random.uniform(
-                -Config.GeneEncoding.maxAngle / Config.GeneEncoding.segmentsNumber,
-                +Config.GeneEncoding.maxAngle / Config.GeneEncoding.segmentsNumber,
-                Config.GeneEncoding.segmentsNumber
+                -self.config.GeneEncoding.maxAngle / self.config.GeneEncoding.segmentsNumber,
+                +self.config.GeneEncoding.maxAngle / self.config.GeneEncoding.segmentsNumber,
+                self.config.GeneEncoding.segmentsNumber
             )
 
             mutationLengths = np.random.uniform(
-                low = - (Config.GeneEncoding.maxSegmentLen - Config.GeneEncoding.minSegmentLen) / Config.GeneEncoding.segmentsNumber,
-                high = (Config.GeneEncoding.maxSegmentLen - Config.GeneEncoding.minSegmentLen) / Config.GeneEncoding.segmentsNumber,
-                size = Config.GeneEncoding.segmentsNumber
+                low = - (self.config.GeneEncoding.maxSegmentLen - self.config.GeneEncoding.minSegmentLen) / self.config.GeneEncoding.segmentsNumber,
+                high = (self.config.GeneEncoding.maxSegmentLen - self.config.GeneEncoding.minSegmentLen) / self.config.GeneEncoding.segmentsNumber,
+                size = self.config.GeneEncoding.segmentsNumber
             )
 
             mutationGpDistance = np.random.uniform(
-                low = Config.ShapeConstraints.groundPlaneDistanceMin,
-                high = Config.ShapeConstraints.groundPlaneDistanceMax,
+                low = self.config.ShapeConstraints.groundPlaneDistanceMin,
+                high = self.config.ShapeConstraints.groundPlaneDistanceMax,
                 size = 1
             )[0]
 
             newAngles = np.clip(
                 gene.getAngleArray() + mutationAngles,
-                - Config.GeneEncoding.maxAngle / 2,
-                + Config.GeneEncoding.maxAngle / 2
+                - self.config.GeneEncoding.maxAngle / 2,
+                + self.config.GeneEncoding.maxAngle / 2
             )
 
             newLengths = np.clip(
                 gene.getLengthArray() + mutationLengths,
-                Config.GeneEncoding.minSegmentLen,
-                Config.GeneEncoding.maxSegmentLen
+                self.config.GeneEncoding.minSegmentLen,
+                self.config.GeneEncoding.maxSegmentLen
             )
 
             gene.setEncoding(newAngles, newLengths)
             gene.setGroundPlaneDistance((mutationGpDistance + gene.groundPlaneDistance) / 2)            
 
-    def cleanup(self, niche: np.ndarray):
+    def cleanup(self, niche: np.ndarray, cells: Tuple[np.ndarray, np.ndarray]):
         """
-        This step filters out non-valid individuals
+        This step repairs non-valid individuals and replaces those that can't be repaired with valid random ones,
+        both in the niche and in the world cells it was taken from
         """
-        self.killedGenes = 0
+        with PROFILER.phase("repair"):
+            valid = self.repair(self.nicheToSet(niche).tolist()).reshape(niche.shape)
 
-        for (i, j), gene in np.ndenumerate(niche):
-            if not gene.isValid():
-                self.killedGenes += 1
-                niche[i][j] = Gene()
+        self.killedGenes = int((~valid).sum())
+        if self.killedGenes > 0:
+            replacements = np.empty(self.killedGenes, dtype=object)
+            replacements[:] = randomValidGenes(self.config, self.killedGenes, self.geneClass)
+            niche[~valid] = replacements
+            rows, cols = np.broadcast_arrays(*cells)
+            self.world[rows[~valid], cols[~valid]] = replacements
 
         self.killedGenesRatio = 100 * self.killedGenes / niche.size
                 
 
     def generations(self) -> List[Gene]:
-        for _ in range(Config.GeneticAlgoTuning.iterationsNumber):
-            niche = self.sampleNiche()
-            self.generateOffspring(niche)
-            self.mutate(niche)
-            self.cleanup(niche)
-
-            validPop = list(
-                filter(
-                    lambda x: x.isValid(),
-                    self.populationSet().tolist()
+        for _ in range(self.config.GeneticAlgoTuning.iterationsNumber):
+            niche, cells = self.sampleNiche()
+            with PROFILER.phase("evaluate"):
+                self.evaluate(self.nicheToSet(niche))
+            with PROFILER.phase("offspring"):
+                self.generateOffspring(niche)
+            with PROFILER.phase("mutate"):
+                self.mutate(niche)
+            with PROFILER.phase("cleanup"):
+                self.cleanup(niche, cells)
+
+                validPop = list(
+                    filter(
+                        lambda x: x.isValid(),
+                        self.populationSet().tolist()
+                    )
                 )
-            )
+            with PROFILER.phase("evaluate"):
+                self.evaluate(validPop)
 
             self.fitnessMean = np.mean([g.fitness() for g in validPop])
             self.fitnessStdDev = np.std([g.fitness() for g in validPop])
@@ -190,5 +235,5 @@ class NichePopulation(Population):
 
 
 if __name__ == '__main__':
-    p = NichePopulation()
+    p = NichePopulation(Config.fromFile())
     p.generateOffspring()
\ No newline at end of file
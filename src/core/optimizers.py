@@ -0,0 +1,27 @@
+"""
+Optimizers selectable with optimizer in config.yaml. They're all populations:
+genes, evaluators, services, run control and checkpoints are shared.
+"""
+from core.config import Config
+from core.gene import Gene
+from core.evaluation import IEvaluator
+from core.population import Population
+from core.cmaes import CmaesPopulation
+from core.pareto import ParetoPopulation
+
+OPTIMIZERS = {
+  "ga": Population,    # Genetic algorithm, turned into niches if enabled (see Simulation)
+  "cmaes": CmaesPopulation,
+  "pareto": ParetoPopulation
+}
+
+def populationClass(config: Config) -> type:
+  if config.GeneticAlgoTuning.optimizer not in OPTIMIZERS:
+    raise ValueError(f"Unknown optimizer {config.GeneticAlgoTuning.optimizer}, expected one of {list(OPTIMIZERS)}")
+  return OPTIMIZERS[config.GeneticAlgoTuning.optimizer]
+
+def createPopulation(config: Config, pop_size: int = None, evaluator: IEvaluator = None, gene_class = Gene) -> Population:
+  """
+  Initial population of the configured optimizer
+  """
+  return populationClass(config)(config, pop_size, gene_class, evaluator)
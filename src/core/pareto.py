@@ -0,0 +1,162 @@
+"""
+Multi-objective (Pareto) mode, NSGA-II style.
+
+Gene.fitness collapses gains into a single number (GAIN_K,
+STANDARD_DEVIATION_K). Here every gene keeps its objective vector instead:
+min gain (maximized), worst gain standard deviation of an RP card
+(minimized) and max gain (maximized), in dB. Objectives are computed from
+the radiation patterns genes keep, so every evaluator and checkpoint
+provides them; standard deviations are the patterns' own, close to NEC's.
+
+Survivors of parents and offspring are chosen by non-dominated front, then
+by crowding distance; parents by binary tournament in the same order. Both
+are computed on NumPy matrices for the whole population at once: a (P, P)
+domination matrix, fronts peeled off by domination counts, crowding
+distances sorted per objective across all fronts.
+
+Fitness is still computed: king, statistics and plots keep their meaning.
+The first front of every generation can be exported with
+services.persistence.ParetoFrontPersistenceService.
+"""
+import numpy as np
+from math import ceil
+from random import randrange
+from typing import List
+from core.config import Config
+from core.gene import Gene
+from core.evaluation import IEvaluator, collectResult
+from core.population import Population
+from utils.profiling import PROFILER
+
+OBJECTIVES = ["minGain", "gainSd", "maxGain"]
+SIGNS = np.array([-1.0, 1.0, -1.0])    # Objectives as minimized internally
+
+def gainObjectives(gains: np.ndarray) -> np.ndarray:
+  """
+  (P, 3) objective vectors of (P, 2, K) gains in mW (see EvaluationResult), in dB.
+  Failed evaluations (NaN gains) have NaN objectives.
+  """
+  with np.errstate(divide="ignore", invalid="ignore"):
+    gainsDb = 10 * np.log10(gains)
+
+  # Sagittal and frontal slices are made of RP cards of the same sizes
+  bounds = np.cumsum([0] + [int(e.thetaNum * e.phiNum) for e in Gene.SAGITTAL_RP_EVALUATIONS])
+  cardSds = np.stack([gainsDb[..., start:end].std(axis=-1) for start, end in zip(bounds[:-1], bounds[1:])], axis=-1)
+  gainsDb = gainsDb.reshape(len(gains), -1)
+
+  return np.stack([gainsDb.min(axis=-1), cardSds.reshape(len(gains), -1).max(axis=-1), gainsDb.max(axis=-1)], axis=-1)
+
+def dominationMatrix(objectives: np.ndarray) -> np.ndarray:
+  """
+  (P, P) mask of (P, M) minimized objectives, [i, j] when i dominates j
+  """
+  noWorse = np.ones((len(objectives), len(objectives)), dtype=bool)
+  better = np.zeros((len(objectives), len(objectives)), dtype=bool)
+  for column in objectives.T:
+    noWorse &= column[:, np.newaxis] <= column[np.newaxis, :]
+    better |= column[:, np.newaxis] < column[np.newaxis, :]
+
+  return noWorse & better
+
+def nonDominatedRanks(objectives: np.ndarray) -> np.ndarray:
+  """
+  (P,) front of each of (P, M) minimized objectives, 0 for the non-dominated ones
+  """
+  dominates = dominationMatrix(objectives)
+  dominatedBy = dominates.sum(axis=0)
+  ranks = np.full(len(objectives), -1)
+
+  rank, front = 0, np.flatnonzero(dominatedBy == 0)
+  while len(front) > 0:
+    ranks[front] = rank
+    dominatedBy -= dominates[front].sum(axis=0)
+    dominatedBy[front] = -1    # Done, not a candidate for the next front
+    rank, front = rank + 1, np.flatnonzero(dominatedBy == 0)
+
+  return ranks
+
+def crowdingDistances(objectives: np.ndarray, ranks: np.ndarray) -> np.ndarray:
+  """
+  (P,) crowding distance of each of (P, M) objectives within its front, inf at the front's boundaries
+  """
+  distances = np.zeros(len(objectives))
+  if len(objectives) == 0:
+    return distances
+
+  for column in objectives.T:
+    order = np.lexsort((column, ranks))
+    values, fronts = column[order], ranks[order]
+    first = np.r_[True, fronts[1:] != fronts[:-1]]
+    last = np.r_[fronts[1:] != fronts[:-1], True]
+    spans = (values[last] - values[first])[np.cumsum(first) - 1]
+
+    gaps = np.zeros(len(values))
+    gaps[1:-1] = values[2:] - values[:-2]
+    with np.errstate(divide="ignore", invalid="ignore"):
+      contributions = np.where(first | last, np.inf, np.where(spans > 0, gaps / spans, 0))
+    distances[order] += np.nan_to_num(contributions, nan=0, posinf=np.inf)
+
+  return distances
+
+class ParetoPopulation(Population):
+  def __init__(self, config: Config, pop_size: int = None, gene_class = Gene, evaluator: IEvaluator = None):
+    super().__init__(config, pop_size, gene_class, evaluator)
+    self.ranks = np.zeros(len(self.individuals), dtype=int)
+    self.crowding = np.zeros(len(self.individuals))
+
+  def objectives(self, genes: List[Gene]) -> np.ndarray:
+    """
+    (P, 3) objective vectors of evaluated genes, computed once per gene
+    """
+    missing = [g for g in genes if g.objectives is None]
+    if len(missing) > 0:
+      for gene, objectives in zip(missing, gainObjectives(collectResult(missing).gains)):
+        gene.objectives = objectives
+
+    return np.array([g.objectives for g in genes]).reshape(len(genes), len(OBJECTIVES))
+
+  def rank(self) -> None:
+    """
+    Sorts individuals by front, then by decreasing crowding distance
+    """
+    objectives = SIGNS * self.objectives(self.individuals)
+    objectives[~np.isfinite(objectives).all(axis=-1)] = np.inf    # Failed evaluations: last front
+
+    ranks = nonDominatedRanks(objectives)
+    crowding = crowdingDistances(objectives, ranks)
+    crowding[~np.isfinite(objectives).all(axis=-1)] = 0
+    order = np.lexsort((-crowding, ranks))
+
+    self.individuals = [self.individuals[i] for i in order]
+    self.ranks, self.crowding = ranks[order], crowding[order]
+
+  def front(self) -> List[Gene]:
+    """
+    Non-dominated individuals, as of the last ranking
+    """
+    return [g for g, rank in zip(self.individuals, self.ranks) if rank == 0]
+
+  def extractParent(self) -> Gene:
+    """
+    Binary tournament: lower front wins, then larger crowding distance. Individuals are sorted so, lower index wins.
+    """
+    return self.individuals[min(randrange(len(self.individuals)), randrange(len(self.individuals)))]
+
+  def generateOffspring(self):
+    with PROFILER.phase("rank"):
+      self.rank()    # Operators, restarts and refinements may have changed individuals since fight
+    super().generateOffspring()
+
+  def fight(self):
+    """
+    Keeps the best individuals by front and crowding distance (according to turnover rate)
+    """
+    with PROFILER.phase("rank"):
+      self.rank()
+    survivedGenesNumber = ceil((1 - self.config.GeneticAlgoTuning.turnoverRate) * self.config.GeneticAlgoTuning.populationSize)
+    self.individuals = self.individuals[:survivedGenesNumber]
+    self.ranks, self.crowding = self.ranks[:survivedGenesNumber], self.crowding[:survivedGenesNumber]
+
+    # Individuals aren't sorted by fitness, the king may be anywhere
+    best = max(self.individuals, key=lambda g: g.fitnessCached)
+    self.king = best if best.fitnessCached > self.king.fitnessCached else self.king
@@ -2,19 +2,39 @@ import logging
 import numpy as np
 from math import ceil, floor
 from random import randrange, sample, choice, choices
-from typing import List, Tuple
+from typing import Dict, List, Tuple
 from core.config import Config
 from core.gene import Gene, ValidInitGene, BiasedInitGene
+from core.evaluation import IEvaluator, LocalEvaluator, encodeGenes, applyResult, collectResult
+from core.repair import repairEncodings
+from core.initialization import randomValidGenes
+from core.memetic import LocalRefiner
+from core.telemetry import NEC_TELEMETRY, emptyRecords
+from utils.geometry import rodToVertices, validPathsMask
+from utils.profiling import PROFILER, PhaseStats
 
 
 class Population:
-  def __init__(self, pop_size: int = Config.GeneticAlgoTuning.populationSize, gene_class = Gene):
-    self.individuals = [gene_class() for _ in range(pop_size)]
+  def __init__(self, config: Config, pop_size: int = None, gene_class = Gene, evaluator: IEvaluator = None):
+    self.config = config
+    pop_size = pop_size if pop_size is not None else config.GeneticAlgoTuning.populationSize
+    self.evaluator = evaluator if evaluator is not None else LocalEvaluator()
+    self.geneClass = gene_class
+    self.individuals = randomValidGenes(config, pop_size, gene_class)
     self.generationNumber = 0
     self.newbornsCounter = 0
     self.fitnessStdDev = float("-inf")
     self.fitnessMean = float("-inf")
-    self.king = gene_class()
+    self.repairedGenes = 0
+    self.repairedGenesRatio = 100.0
+    self.necEvaluations = 0
+    self.elapsedTime = 0.0    # s, wall time of the run, see Simulation.evolve
+    self.phaseStats: Dict[str, PhaseStats] = {}    # Profiled during the last generation, see Simulation.collectInstrumentation
+    self.necRecords: Dict[str, np.ndarray] = emptyRecords()    # NEC telemetry of the last generation, likewise
+    self.refiner = LocalRefiner(
+      config, config.GeneticAlgoTuning.memeticElite, config.GeneticAlgoTuning.memeticEvaluations, config.GeneticAlgoTuning.memeticStep
+    )
+    self.king = gene_class(config)
 
   def extractParent(self) -> Gene:
     """
@@ -49,12 +69,49 @@ class Population:
     return choices(self.individuals, weights=fitness)[0]
 
 
+  def evaluate(self, genes: List[Gene] = None) -> None:
+    """
+    Evaluates, as a single batch, every gene whose fitness has not been computed yet.
+    Genes whose encoding is already known (e.g. clones) take the known result instead.
+    """
+    genes = self.individuals if genes is None else genes
+    toEvaluate = [g for g in genes if not g.evaluated]
+    if len(toEvaluate) == 0:
+      return
+
+    evaluated = [g for g in self.individuals + genes if g.evaluated]
+    encodings, gpDistances = encodeGenes(evaluated + toEvaluate)
+    keys = [encoding.tobytes() + gpDistance.tobytes() for encoding, gpDistance in zip(encodings, gpDistances)]
+    known = dict(zip(keys[:len(evaluated)], evaluated))
+
+    misses, hits, sources = [], [], []
+    for gene, key in zip(toEvaluate, keys[len(evaluated):]):
+      if key in known:
+        hits.append(gene)
+        sources.append(known[key])
+      else:
+        known[key] = gene
+        misses.append(gene)
+
+    self.evaluator.evaluate(misses)
+    applyResult(hits, collectResult(sources))
+    self.necEvaluations += len(misses)
+    NEC_TELEMETRY.record(self.generationNumber + 1, misses, hits)
+
   def generations(self) -> Tuple[List[Gene], int]:
-    for _ in range(Config.GeneticAlgoTuning.iterationsNumber):
-      self.generateOffspring()
-      self.mutate()
-      self.cleanup()
-      self.fight()
+    for _ in range(self.config.GeneticAlgoTuning.iterationsNumber):
+      with PROFILER.phase("evaluate"):
+        self.evaluate()
+      with PROFILER.phase("offspring"):
+        self.generateOffspring()
+      with PROFILER.phase("mutate"):
+        self.mutate()
+      with PROFILER.phase("cleanup"):
+        self.cleanup()
+      with PROFILER.phase("evaluate"):
+        self.evaluate()
+      with PROFILER.phase("fight"):
+        self.fight()
       
       self.fitnessMean = np.mean([g.fitnessCached for g in self.individuals])
       self.fitnessStdDev = np.std([g.fitnessCached for g in self.individuals])
@@ -75,55 +132,129 @@ class Population:
       yield self.individuals, self.generationNumber
     
   
+  def members(self) -> List[Gene]:
+    """
+    Genes currently in the population
+    """
+    return self.individuals
+
+  def replaceMember(self, gene: Gene, newGene: Gene) -> None:
+    self.individuals[self.individuals.index(gene)] = newGene
+
+  def elite(self, size: int) -> List[Gene]:
+    return sorted(self.members(), key=lambda g: g.fitnessCached, reverse=True)[:size]
+
+  def restart(self, survivors: int) -> None:
+    """
+    Keeps the king and the best survivors individuals, the others are drawn again
+    """
+    kept = self.elite(survivors)
+    if self.king not in kept and self.king.fitnessCached > float("-inf"):
+      kept = [self.king] + kept[:-1]
+    self.individuals = kept + randomValidGenes(self.config, len(self.individuals) - len(kept), self.geneClass)
+
+  def updateFitnessStats(self) -> None:
+    fitness = [g.fitnessCached for g in self.members()]
+    self.fitnessMean, self.fitnessStdDev = np.mean(fitness), np.std(fitness)
+    best = max(self.members(), key=lambda g: g.fitnessCached)
+    self.king = best if best.fitnessCached > getattr(self.king, "fitnessCached", float("-inf")) else self.king    # Niches' king may be 0
+
+  def refineLocally(self, evaluations: int = None) -> int:
+    """
+    Local refinement of the elite (see core.memetic), within evaluations NEC evaluations
+    (memetic_evaluations by default). Returns the number of genes improved.
+    """
+    improved = self.refiner.refine(self, evaluations)
+    self.updateFitnessStats()
+    return improved
+
+  def refineElite(self) -> Tuple[List[Gene], int]:
+    """
+    A generation spent on the elite only: local refinement with the evaluations of a regular generation
+    """
+    if not any(g.fitnessCached > float("-inf") for g in self.members()):
+      return next(self.generations())
+
+    self.refineLocally(floor((1.0 - self.config.GeneticAlgoTuning.turnoverRate) * self.config.GeneticAlgoTuning.populationSize))
+
+    self.generationNumber += 1
+    return sorted(self.members(), key=lambda g: g.fitnessCached, reverse=True), self.generationNumber
+
+  def repair(self, genes: List[Gene]) -> np.ndarray:
+    """
+    Repairs invalid genes in place (see core.repair). Returns the mask of valid genes,
+    repaired or not, and counts repaired ones and their share of invalid ones.
+    """
+    if len(genes) == 0:
+      return np.zeros(0, dtype=bool)
+
+    encodings, _ = encodeGenes(genes)
+    startPoint = (-self.config.ShapeConstraints.outerDiam / 2, 0)
+    valid = validPathsMask(rodToVertices(encodings, startPoint), self.config.ShapeConstraints)
+    invalid = np.flatnonzero(~valid)
+
+    self.repairedGenes = 0
+    if len(invalid) > 0 and self.config.GeneticAlgoTuning.repairRounds > 0:
+      repaired, repairedValid = repairEncodings(self.config, encodings[invalid], self.config.GeneticAlgoTuning.repairRounds)
+      for i, encoding in zip(invalid[repairedValid], repaired[repairedValid]):
+        genes[i].setEncoding(encoding[:, 0], encoding[:, 1])
+      valid[invalid] = repairedValid
+      self.repairedGenes = int(repairedValid.sum())
+
+    self.repairedGenesRatio = 100 * self.repairedGenes / len(invalid) if len(invalid) > 0 else 100.0
+    return valid
+
   def cleanup(self):
     """
-    This step filters out non-valid individuals
+    This step repairs non-valid individuals and filters out those that can't be repaired
     """
     oldGenerationSize = len(self.individuals)
 
-    self.individuals = list(
-      filter(
-        lambda x: x.isValid(),
-        self.individuals
-      )
-    )
+    with PROFILER.phase("repair"):
+      valid = self.repair(self.individuals)
+    self.individuals = [g for g, isValid in zip(self.individuals, valid) if isValid]
 
     self.killedGenes = oldGenerationSize - len(self.individuals)
     self.killedGenesRatio = self.killedGenes / oldGenerationSize * 100
-    logging.warning(f"Killed {self.killedGenes} ({self.killedGenesRatio:.1f}%) genes")
+    logging.warning(f"Repaired {self.repairedGenes} ({self.repairedGenesRatio:.1f}% of invalid ones), killed {self.killedGenes} ({self.killedGenesRatio:.1f}%) genes")
 
   def fight(self):
     """
     This step puts evolutive pressure on the system by pruning
     the worst individuals (according to turnover rate)
     """
-    survivorshipRate = 1 - Config.GeneticAlgoTuning.turnoverRate;
-    survivedGenesNumber = ceil(survivorshipRate * Config.GeneticAlgoTuning.populationSize)
+    survivorshipRate = 1 - self.config.GeneticAlgoTuning.turnoverRate;
+    survivedGenesNumber = ceil(survivorshipRate * self.config.GeneticAlgoTuning.populationSize)
     self.individuals = sorted(self.individuals, reverse=True)[ : survivedGenesNumber]
   
   def crossover(self, mother: Gene, father: Gene):
-    cutpointIdx = randrange(Config.GeneEncoding.segmentsNumber)
+    cutpointIdx = randrange(self.config.GeneEncoding.segmentsNumber)
     newGene1 = Gene(
+      self.config,
       mother[:cutpointIdx] + father[cutpointIdx:],
       np.average([father.groundPlaneDistance, mother.groundPlaneDistance])
     )
     newGene2 = Gene(
+      self.config,
       father[:cutpointIdx] + mother[cutpointIdx:],
       np.average([father.groundPlaneDistance, mother.groundPlaneDistance])
     )
+    newGene1.parents = newGene2.parents = (mother.serial, father.serial)
 
     return newGene1, newGene2
 
   def generateOffspring(self):
-    newGenerationSize = floor((1.0 - Config.GeneticAlgoTuning.turnoverRate) * Config.GeneticAlgoTuning.populationSize)
+    newGenerationSize = floor((1.0 - self.config.GeneticAlgoTuning.turnoverRate) * self.config.GeneticAlgoTuning.populationSize)
     oldGenerationSize = len(self.individuals)
     newborns = []
 
     for _ in range(newGenerationSize // 2):
-      momGene = self.extractParent()
-      dadGene = self.extractParent()
+      with PROFILER.phase("selection"):
+        momGene = self.extractParent()
+        dadGene = self.extractParent()
       
-      newGene1, newGene2 = self.crossover(momGene, dadGene)
+      with PROFILER.phase("crossover"):
+        newGene1, newGene2 = self.crossover(momGene, dadGene)
       
       newborns.append(newGene1)
       newborns.append(newGene2)
@@ -133,42 +264,42 @@ class Population:
 
     
   def mutate(self):
-    toMutateSize = ceil(Config.GeneticAlgoTuning.mutationRate * len(self.individuals))
+    toMutateSize = ceil(self.config.GeneticAlgoTuning.mutationRate * len(self.individuals))
     genesToMutate = sample(self.individuals, k = toMutateSize)
 
   def mutate(self):
-    toMutateSize = ceil(Config.GeneticAlgoTuning.mutationRate * len(self.individuals))
+    toMutateSize = ceil(self.config.GeneticAlgoTuning.mutationRate * len(self.individuals))
     genesToMutate = sample(self.individuals, k = toMutateSize)
 
     for gene in genesToMutate:
       mutationAngles = np.random.uniform(
-        -Config.GeneEncoding.maxAngle / Config.GeneEncoding.segmentsNumber,
-        +Config.GeneEncoding.maxAngle / Config.GeneEncoding.segmentsNumber,
-        Config.GeneEncoding.segmentsNumber
+        -self.config.GeneEncoding.maxAngle / self.config.GeneEncoding.segmentsNumber,
+        +self.config.GeneEncoding.maxAngle / self.config.GeneEncoding.segmentsNumber,
+        self.config.GeneEncoding.segmentsNumber
       )
 
       mutationLengths = np.random.uniform(
-        low = - (Config.GeneEncoding.maxSegmentLen - Config.GeneEncoding.minSegmentLen) / Config.GeneEncoding.segmentsNumber,
-        high = (Config.GeneEncoding.maxSegmentLen - Config.GeneEncoding.minSegmentLen) / Config.GeneEncoding.segmentsNumber,
-        size = Config.GeneEncoding.segmentsNumber
+        low = - (self.config.GeneEncoding.maxSegmentLen - self.config.GeneEncoding.minSegmentLen) / self.config.GeneEncoding.segmentsNumber,
+        high = (self.config.GeneEncoding.maxSegmentLen - self.config.GeneEncoding.minSegmentLen) / self.config.GeneEncoding.segmentsNumber,
+        size = self.config.GeneEncoding.segmentsNumber
       )
 
       mutationGpDistance = np.random.uniform(
-        low = Config.ShapeConstraints.groundPlaneDistanceMin,
-        high = Config.ShapeConstraints.groundPlaneDistanceMax,
+        low = self.config.ShapeConstraints.groundPlaneDistanceMin,
+        high = self.config.ShapeConstraints.groundPlaneDistanceMax,
         size = 1
       )[0]
 
       newAngles = np.clip(
         gene.getAngleArray() + mutationAngles,
-        - Config.GeneEncoding.maxAngle / 2,
-        + Config.GeneEncoding.maxAngle / 2
+        - self.config.GeneEncoding.maxAngle / 2,
+        + self.config.GeneEncoding.maxAngle / 2
       )
 
       newLengths = np.clip(
         gene.getLengthArray() + mutationLengths,
-        Config.GeneEncoding.minSegmentLen,
-        Config.GeneEncoding.maxSegmentLen
+        self.config.GeneEncoding.minSegmentLen,
+        self.config.GeneEncoding.maxSegmentLen
       )
 
       gene.setEncoding(newAngles, newLengths)
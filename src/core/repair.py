@@ -0,0 +1,78 @@
+"""
+Repair operator: bends constraint-violating paths until they're valid.
+
+Works on (P, N, 2) rod encodings, a batch at a time. Each round, every
+invalid path gets one small turn at a random joint before its first
+violating segment (rod angles are relative: the rest of the path rotates
+around the joint's vertex), in the direction that moves the segment:
+ - towards the center, when it ends out of the outer circle (the segment is
+   also shortened)
+ - away from the camera hole at centerShift, when it crosses it
+ - away from the earlier segment it intersects (turning a joint between the
+   two, to open the loop)
+Random joints and turn sizes keep fixes from undoing each other forever.
+Angles and lengths stay within the gene encoding's bounds. Paths still
+invalid after maxRounds can't be repaired.
+"""
+import numpy as np
+from typing import Tuple
+from core.config import Config
+from utils.geometry import rodToVertices, intersectingSegmentPairs, segmentsCrossingCircle, segmentsOutOfCircle
+
+TURN_STEP_SEGMENTS = 2    # Turn step, in mutation's angle steps (maxAngle / segmentsNumber)
+SHRINK_FACTOR = 0.8    # Length of out of circle segments after each round
+
+def repairEncodings(config: Config, encodings: np.ndarray, maxRounds: int = None) -> Tuple[np.ndarray, np.ndarray]:
+  """
+  Repaired copy of (P, N, 2) encodings and (P,) mask of the valid ones (repaired or already valid)
+  """
+  constraints, encoding = config.ShapeConstraints, config.GeneEncoding
+  maxRounds = maxRounds if maxRounds is not None else 4 * encoding.segmentsNumber
+  startPoint = (-constraints.outerDiam / 2, 0)
+  holeCenter = np.array([constraints.centerShift, 0])
+  turnStep = TURN_STEP_SEGMENTS * encoding.maxAngle / encoding.segmentsNumber
+
+  encodings = encodings.copy()
+  valid = np.zeros(len(encodings), dtype=bool)
+  active = np.arange(len(encodings))
+
+  for repairRound in range(maxRounds + 1):
+    vertices = rodToVertices(encodings[active], startPoint)
+    outside = segmentsOutOfCircle(vertices, constraints.outerDiam / 2)
+    hole = segmentsCrossingCircle(vertices, (constraints.centerShift, 0), constraints.innerDiam / 2)
+    pairs = intersectingSegmentPairs(vertices)
+    crossing = pairs.any(axis=-2)    # Segments intersecting an earlier one
+
+    violations = outside | hole | crossing
+    isValid = ~violations.any(axis=-1)
+    valid[active[isValid]] = True
+    active, vertices = active[~isValid], vertices[~isValid]
+    outside, hole, pairs, violations = outside[~isValid], hole[~isValid], pairs[~isValid], violations[~isValid]
+    if len(active) == 0 or repairRound == maxRounds:
+      break
+
+    # One fix per path, for its first violating segment: which point of it has to move, and where
+    rows = np.arange(len(active))
+    first = violations.argmax(axis=-1)
+    isOutside, isHole = outside[rows, first], hole[rows, first]
+    earlier = pairs[rows, :, first].argmax(axis=-1)
+    ends = vertices[rows, first + 1]
+    midpoints = (vertices[rows, first] + ends) / 2
+    earlierMidpoints = (vertices[rows, earlier] + vertices[rows, earlier + 1]) / 2
+    moved, displacements = np.where(isOutside[:, np.newaxis], (ends, -ends), np.where(
+      isHole[:, np.newaxis], (midpoints, midpoints - holeCenter), (midpoints, midpoints - earlierMidpoints)
+    ))
+
+    # Loops are opened after the earlier segment, other violations anywhere before
+    lowest = np.where(isOutside | isHole, 0, earlier + 1)
+    joints = lowest + (np.random.random(len(active)) * (first - lowest + 1)).astype(int)
+    levers = moved - vertices[rows, joints]
+    directions = np.sign(levers[:, 0] * displacements[:, 1] - levers[:, 1] * displacements[:, 0])
+    turns = directions * turnStep * np.random.uniform(0.5, 1.5, len(active))
+
+    encodings[active, joints, 0] = np.clip(encodings[active, joints, 0] + turns, -encoding.maxAngle / 2, encoding.maxAngle / 2)
+    encodings[active[isOutside], first[isOutside], 1] = np.maximum(
+      encodings[active[isOutside], first[isOutside], 1] * SHRINK_FACTOR, encoding.minSegmentLen
+    )
+
+  return encodings, valid
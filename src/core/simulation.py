@@ -1,23 +1,148 @@
+import copy
 import logging
-from typing import List
+import threading
+import time
+import numpy as np
+from collections import deque
+from typing import List, Any, Callable, Deque
+from core.population import Population
 from core.niche_population import NichePopulation
-from services.service import *
-from services.plotters import *
-from services.persistence import *
-from services.statistics import *
+from core.checkpoint import saveCheckpoint, loadCheckpoint
+from core.control import RunController
+from core.telemetry import NEC_TELEMETRY
+from services.service import Service, ServiceNotDispatched
+from services.plotters import IPlotterService, ILiveViewService
+from services.persistence import IPersistenceService
+from services.statistics import IStatService
+from utils.profiling import PROFILER, servicePhaseName
+
+def snapshot(population: Population) -> Population:
+  """
+  Cheap, immutable copy of a population for background services. Genes are
+  shallow-copied: operators replace encodings, fitness and radiation patterns,
+  they never modify them in place.
+  """
+  population.king.fitness()    # NEC isn't thread safe, nothing must be left to evaluate
+
+  populationCopy = copy.copy(population)
+  populationCopy.individuals = [copy.copy(g) for g in population.individuals]
+  populationCopy.king = copy.copy(population.king)
+  if hasattr(population, "world"):
+    populationCopy.world = np.vectorize(copy.copy, otypes=[object])(population.world)
+
+  return populationCopy
+
+
+class ServiceWorker(threading.Thread):
+  """
+  Background consumer of population snapshots for a single service.
+  When maxQueued snapshots are already waiting, a new one is handled according to policy:
+   - BLOCK waits for room (no snapshot is lost)
+   - DROP discards the new snapshot
+   - COALESCE discards the oldest waiting snapshot (only the latest matters)
+  """
+  BLOCK = "block"
+  DROP = "drop"
+  COALESCE = "coalesce"
+
+  def __init__(self, service: Service, call: Callable[[Population], Any], policy: str, maxQueued: int):
+    super().__init__(name=f"{type(service).__name__}Worker", daemon=True)
+    self.service = service
+    self.call = call
+    self.policy = policy
+    self.maxQueued = maxQueued
+    self.queue: Deque[Population] = deque()
+    self.condition = threading.Condition()
+    self.busy = False
+    self.stopped = False
+    self.droppedNumber = 0
+
+  def submit(self, population: Population) -> None:
+    with self.condition:
+      if len(self.queue) >= self.maxQueued:
+        if self.policy == ServiceWorker.DROP:
+          self.droppedNumber += 1
+          return
+        elif self.policy == ServiceWorker.COALESCE:
+          self.queue.popleft()
+          self.droppedNumber += 1
+        else:
+          self.condition.wait_for(lambda: len(self.queue) < self.maxQueued)
+
+      self.queue.append(population)
+      self.condition.notify_all()
+
+  def run(self) -> None:
+    while True:
+      with self.condition:
+        self.condition.wait_for(lambda: len(self.queue) > 0 or self.stopped)
+        if len(self.queue) == 0:
+          return
+        population = self.queue.popleft()
+        self.busy = True
+        self.condition.notify_all()
+
+      try:
+        with PROFILER.phase(servicePhaseName(self.service)):
+          self.call(population)
+      except Exception:
+        logging.exception(f"{type(self.service).__name__} failed on generation {population.generationNumber}")
+
+      with self.condition:
+        self.busy = False
+        self.condition.notify_all()
+
+  def flush(self) -> None:
+    with self.condition:
+      self.condition.wait_for(lambda: len(self.queue) == 0 and not self.busy)
+
+  def stop(self) -> None:
+    with self.condition:
+      self.stopped = True
+      self.condition.notify_all()
+    self.join()
+
+    if self.droppedNumber > 0:
+      logging.warning(f"{type(self.service).__name__} skipped {self.droppedNumber} generations")
+
 
 class Simulation:
-  def __init__(self, population: Population, useNiches: bool = False, nichesActivationTh: float = 1):
+  # Background services: (queue policy, max queued snapshots) by service kind
+  PIPELINE_POLICIES = {
+    IPlotterService: (ServiceWorker.COALESCE, 1),
+    ILiveViewService: (ServiceWorker.COALESCE, 1),
+    IPersistenceService: (ServiceWorker.DROP, 16),
+    IStatService: (ServiceWorker.BLOCK, 64),
+  }
+
+  def __init__(self, population: Population, useNiches: bool = False, nichesActivationTh: float = 1, background: bool = False):
+    """
+    With background enabled, services run on their own threads and receive population snapshots,
+    so that the genetic algorithm doesn't wait for them. Not for services drawing on interactive figures:
+    GUI toolkits must be driven by the main thread.
+    """
     self.population = population
+    self.background = background
+    self.workers: List[ServiceWorker] = list()
     self.plotterServices: List[IPlotterService] = list()
     self.persistenceServices: List[IPersistenceService] = list()
     self.statServices: List[IStatService] = list()
     self.liveViewers: List[ILiveViewService] = list()
-    self.useNiches = useNiches
+    self.useNiches = useNiches and population.config.GeneticAlgoTuning.optimizer == "ga"    # Niches are the genetic algorithm's
+    if useNiches and not self.useNiches:
+      logging.warning(f"Niches are ignored with the {population.config.GeneticAlgoTuning.optimizer} optimizer")
     self.nichesActivationTh = nichesActivationTh
     self.nicheEn = False
+    self.checkpointFilename: str = None
+    self.checkpointPeriod = 0
+    self.controller = RunController(population.config)
+    self.lastGenerationTime: float = None
 
-  def withService(self, service: Service) -> Any:
+  def withService(self, service: Service, policy: str = None, maxQueued: int = None) -> Any:
+    """
+    policy and maxQueued override PIPELINE_POLICIES for background services
+    """
+    target = None
     if isinstance(service, IPlotterService):
       target = self.plotterServices
     elif isinstance(service, IPersistenceService):
@@ -32,30 +157,189 @@ class Simulation:
     
     target.append(service)
 
+    if self.background:
+      kind = next(k for k in Simulation.PIPELINE_POLICIES if isinstance(service, k))
+      defaultPolicy, defaultMaxQueued = Simulation.PIPELINE_POLICIES[kind]
+      worker = ServiceWorker(service, Simulation.serviceCall(service), policy or defaultPolicy, maxQueued or defaultMaxQueued)
+      worker.start()
+      self.workers.append(worker)
+
     return self
+
+  @staticmethod
+  def serviceCall(service: Service) -> Callable[[Population], Any]:
+    if isinstance(service, IPlotterService):
+      return service.plot
+    elif isinstance(service, IPersistenceService):
+      return service.save
+    elif isinstance(service, IStatService):
+      return service.stat
+
+    return service.update
   
+  def withCheckpoints(self, filename: str, period: int) -> Any:
+    """
+    Saves a checkpoint to filename every period generations (overwriting the previous one)
+    """
+    self.checkpointFilename = filename
+    self.checkpointPeriod = period
+    return self
+
+  def checkpoint(self, filename: str) -> None:
+    """
+    Waits for background services, so that stat histories match the population, and saves
+    """
+    self.flushServices()
+    saveCheckpoint(filename, self.population, [s.histories() for s in self.statServices], list(self.controller.history))
+
+  def resume(self, filename: str) -> Any:
+    """
+    Continues from a checkpoint: population, random states, stat histories and run control.
+    Services must be attached already.
+    """
+    self.population, histories, runHistory = loadCheckpoint(filename, self.population.evaluator)
+    self.controller.history.clear()
+    self.controller.history.extend(runHistory)
+    self.nicheEn = isinstance(self.population, NichePopulation)
+    for stater, statHistories in zip(self.statServices, histories):
+      stater.restore(statHistories)
+
+    logging.info(f"Resumed from {filename} at generation {self.population.generationNumber}")
+    return self
+
+  def checkpointIfDue(self) -> None:
+    if self.checkpointPeriod > 0 and self.population.generationNumber % self.checkpointPeriod == 0:
+      self.checkpoint(self.checkpointFilename)
+
+  def services(self) -> List[Service]:
+    return self.plotterServices + self.persistenceServices + self.statServices + self.liveViewers
+
+  def close(self) -> None:
+    """
+    Closes services (flushing what they buffered) and the population's evaluator
+    """
+    for worker in self.workers:
+      worker.stop()    # Pending snapshots are consumed first
+    self.workers.clear()
+
+    for service in self.services():
+      service.close()
+
+    self.population.evaluator.close()
+
+  def flushServices(self) -> None:
+    """
+    Waits for background services to consume every pending snapshot
+    """
+    for worker in self.workers:
+      worker.flush()
+
   def runServices(self) -> None:
-    for plotter in self.plotterServices:
-      plotter.plot(self.population)
-    
+    if self.background:
+      self.submit(lambda _: True)    # A single snapshot for every service
+      return
+
+    self.runDataServices()
+    self.runVisualServices()
+
+  def runDataServices(self) -> None:
+    """
+    Persistence and statistics, which must see every generation
+    """
+    if self.background:
+      self.submit(lambda worker: isinstance(worker.service, (IPersistenceService, IStatService)))
+      return
+
     for saver in self.persistenceServices:
-      saver.save(self.population)
+      with PROFILER.phase(servicePhaseName(saver)):
+        saver.save(self.population)
     
     for stater in self.statServices:
-      stater.stat(self.population)
+      with PROFILER.phase(servicePhaseName(stater)):
+        stater.stat(self.population)
+
+  def runVisualServices(self) -> None:
+    """
+    Plotters and live viewers, which may run at a lower rate than generations
+    """
+    if self.background:
+      self.submit(lambda worker: isinstance(worker.service, (IPlotterService, ILiveViewService)))
+      return
+
+    for plotter in self.plotterServices:
+      with PROFILER.phase(servicePhaseName(plotter)):
+        plotter.plot(self.population)
 
     for viewer in self.liveViewers:
-      viewer.update(self.population)
-  
-  def run(self, *_) -> None:
+      with PROFILER.phase(servicePhaseName(viewer)):
+        viewer.update(self.population)
+
+  def submit(self, selector: Callable[[ServiceWorker], bool]) -> None:
+    workers = [w for w in self.workers if selector(w)]
+    if len(workers) == 0:
+      return
+
+    populationSnapshot = snapshot(self.population)
+    for worker in workers:
+      worker.submit(populationSnapshot)
+
+  def evolve(self) -> None:
+    """
+    Runs a single generation, without services. Raises StopIteration when the run controller stops the run.
+    """
+    # Wall time is counted between generations, services and checkpoints included
+    now = time.perf_counter()
+    if self.lastGenerationTime is not None:
+      self.population.elapsedTime += now - self.lastGenerationTime
+    self.lastGenerationTime = now
+
+    action = self.controller.action(self.population)
+    self.controller.log(action)
+    if action == RunController.STOP:
+      raise StopIteration(self.controller.reason)
+
     if self.useNiches and not self.nicheEn and self.population.fitnessMean > self.nichesActivationTh:
-      self.population = NichePopulation().fromPopulation(self.population)
+      self.population = NichePopulation(self.population.config).fromPopulation(self.population)
       self.nicheEn = True
-    
-    generation, epoch = next(self.population.generations())
+
+    if action == RunController.RESTART:
+      self.population.restart(self.population.config.GeneticAlgoTuning.restartSurvivors)
+
+    memeticPeriod = self.population.config.GeneticAlgoTuning.memeticPeriod
+    if action == RunController.REFINE:
+      generation, epoch = self.population.refineElite()
+    else:
+      generation, epoch = next(self.population.generations())
+      if memeticPeriod > 0 and epoch % memeticPeriod == 0:
+        with PROFILER.phase("memetic"):
+          self.population.refineLocally()
+    self.controller.observe(self.population)
 
     logging.info(f"Epoch: {epoch}")
     logging.debug(generation)
     logging.info(f"Best gene (fitness={generation[0].fitness():.2f}):\n{generation[0]}")
 
-    self.runServices()
\ No newline at end of file
+  def collectInstrumentation(self) -> None:
+    """
+    Attaches what was profiled and NEC telemetry since the previous generation to the population.
+    Collected here, on the main thread, so that every snapshot carries its own generation's data.
+    """
+    self.population.phaseStats = PROFILER.collect()
+    self.population.necRecords = NEC_TELEMETRY.collect()
+
+  def step(self) -> None:
+    """
+    Runs a single generation and the services that must see every generation
+    """
+    with PROFILER.generation(self.population.generationNumber + 1):
+      self.evolve()
+      self.collectInstrumentation()
+      self.runDataServices()
+    self.checkpointIfDue()
+
+  def run(self, *_) -> None:
+    with PROFILER.generation(self.population.generationNumber + 1):
+      self.evolve()
+      self.collectInstrumentation()
+      self.runServices()
+    self.checkpointIfDue()
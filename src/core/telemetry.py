@@ -0,0 +1,125 @@
+"""
+NEC evaluation telemetry.
+
+Population.evaluate reports every gene it had to evaluate: genes that ran NEC
+(solve time, failure code) and genes whose encoding was already known, such
+as clones, which took its result (cache hits). Genes that were already
+evaluated aren't reported. Records are kept until collect() (once per
+generation, see Simulation.collectInstrumentation)
+and, when a path is given, appended to a column store as well, one row per
+evaluation, so that slow geometries can be looked up afterwards.
+"""
+import threading
+import numpy as np
+from typing import Dict, List, Any
+from core.gene import Gene
+from rf.nec_analysis import NEC_OK, NEC_FAILURE_NAMES
+from utils.columns import ColumnStore
+
+RECORD_FIELDS = {
+  "generation": np.int64,
+  "serial": np.int64,
+  "solveTime": np.float64,    # s, 0 for cache hits
+  "wires": np.int64,
+  "gpDistance": np.float64,
+  "failure": np.int64,    # NEC_* codes
+  "cached": np.bool_
+}
+
+# Solve time histogram bins (s), log spaced
+SOLVE_TIME_BINS = np.concatenate([[0], np.logspace(-3, 1, 13), [np.inf]])
+SOLVE_TIME_PERCENTILES = [50, 90, 99]
+
+
+class NecTelemetry:
+  def __init__(self):
+    self.enabled = False
+    self.store: ColumnStore = None
+    self.records: List[Dict[str, np.ndarray]] = []
+    self.lock = threading.Lock()
+
+  def enable(self, recordsPath: str = None) -> None:
+    self.enabled = True
+    if recordsPath is not None:
+      self.store = ColumnStore(recordsPath, "w")
+
+  def record(self, generation: int, evaluated: List[Gene], cached: List[Gene]) -> None:
+    if not self.enabled:
+      return
+
+    genes = evaluated + cached
+    records = {
+      "generation": np.full(len(genes), generation, dtype=np.int64),
+      "serial": np.array([g.serial for g in genes], dtype=np.int64),
+      "solveTime": np.array([g.solveTime for g in evaluated] + [0.0] * len(cached)),
+      "wires": np.array([len(g.polychainEncoding) for g in genes], dtype=np.int64),
+      "gpDistance": np.array([g.groundPlaneDistance for g in genes], dtype=np.float64),
+      "failure": np.array([g.necFailure for g in genes], dtype=np.int64),
+      "cached": np.array([False] * len(evaluated) + [True] * len(cached))
+    }
+
+    with self.lock:
+      self.records.append(records)
+      if self.store is not None and len(genes) > 0:
+        self.store.appendMany(**records)
+
+  def collect(self) -> Dict[str, np.ndarray]:
+    """
+    Records since the previous call, as arrays of RECORD_FIELDS
+    """
+    with self.lock:
+      records, self.records = self.records, []
+      if self.store is not None:
+        self.store.flush()
+
+    if len(records) == 0:
+      return emptyRecords()
+
+    return {name: np.concatenate([r[name] for r in records]) for name in RECORD_FIELDS}
+
+  def close(self) -> None:
+    with self.lock:
+      if self.store is not None:
+        self.store.close()
+        self.store = None
+
+
+NEC_TELEMETRY = NecTelemetry()
+
+def emptyRecords() -> Dict[str, np.ndarray]:
+  return {name: np.empty(0, dtype=dtype) for name, dtype in RECORD_FIELDS.items()}
+
+def summarize(records: Dict[str, np.ndarray]) -> Dict[str, Any]:
+  """
+  Counts, failure and cache hit rates, solve time percentiles and histogram of a batch of records
+  """
+  solved = ~records["cached"]
+  solveTimes = records["solveTime"][solved]
+  failures = records["failure"][solved]
+  requests = len(records["cached"])
+
+  summary = {
+    "necEvaluations": int(solved.sum()),
+    "necCacheHits": requests - int(solved.sum()),
+    "necCacheHitRate": (requests - int(solved.sum())) / requests if requests > 0 else 0.0,
+    "necFailures": int(np.sum(failures != NEC_OK)),
+    "necFailureRate": float(np.mean(failures != NEC_OK)) if len(failures) > 0 else 0.0,
+  }
+  for code, name in NEC_FAILURE_NAMES.items():
+    summary[f"nec{name}Errors"] = int(np.sum(failures == code))
+
+  summary["necTime"] = float(solveTimes.sum())
+  summary["necTimeMax"] = float(solveTimes.max()) if len(solveTimes) > 0 else 0.0
+  for p in SOLVE_TIME_PERCENTILES:
+    summary[f"necTimeP{p}"] = float(np.percentile(solveTimes, p)) if len(solveTimes) > 0 else 0.0
+
+  # Share of NEC time spent on the slowest 10% of the geometries
+  if len(solveTimes) > 0 and solveTimes.sum() > 0:
+    slowest = np.sort(solveTimes)[-max(len(solveTimes) // 10, 1):]
+    summary["necTimeTopDecileShare"] = float(slowest.sum() / solveTimes.sum())
+  else:
+    summary["necTimeTopDecileShare"] = 0.0
+
+  summary["necTimeHistogram"] = np.histogram(solveTimes, SOLVE_TIME_BINS)[0]
+
+  return summary
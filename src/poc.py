@@ -1,23 +1,30 @@
 import argparse, logging
 import signal, os
-from typing import Callable
-import matplotlib.pyplot as plt
-import matplotlib.animation as animation
+from os.path import join, exists
+from typing import Callable, List, Tuple, Dict, Any
+from threading import Thread
 from rf.radiation import RadiationPattern
 from services.plotters import *
 from services.persistence import *
 from services.statistics import *
 from core.config import Config
+from core.gene import Gene
 from core.population import Population
 from core.niche_population import NichePopulation
-from core.simulation import Simulation
+from core.elite import EliteArchive
+from core.simulation import Simulation, ServiceWorker
+from core.optimizers import createPopulation
+from core.telemetry import NEC_TELEMETRY
+from utils.profiling import PROFILER, GENERATION_PHASES, servicePhaseName
+from workers.remote import RemoteEvaluator, spawnLocalWorkers
+from workers.shared import SharedMemoryEvaluator
 from multiprocessing import Pool
+from multiprocessing.managers import SyncManager
 from functools import partial
-from scipy.io import savemat
 
 CONFIG_FILENAME = "config.yaml"
 
-def main(doPlot: bool, doPlotWorld: bool, graphicsOutdir: str, withBoundaries: bool, statService: IStatService, instanceNumber: int = 0):
+def main(config: Config, doPlot: bool, doPlotWorld: bool, graphicsOutdir: str, withBoundaries: bool, compressGraphics: bool, workersAddresses: List[str], evalProcesses: int, profilerOptions: Dict[str, Any], necTelemetry: bool, checkpointPeriod: int, resume: bool, archive: bool, eliteFilename: str, eliteSeedFraction: float, statService: IStatService, instanceNumber: int = 0):
   signal.signal(signal.SIGINT, lambda *_: quit())
 
   logging.basicConfig(
@@ -26,31 +33,36 @@ def main(doPlot: bool, doPlotWorld: bool, graphicsOutdir: str, withBoundaries: b
     datefmt="%H:%M:%S"
   )
 
-  with open(CONFIG_FILENAME, "r") as f:
-    Config.loadYaml(f)
+  # matplotlib is loaded only if something has to be shown: headless instances
+  # (e.g. benchmark ones) start faster and use less memory
+  if doPlot or doPlotWorld:
+    import matplotlib.pyplot as plt
+    from services.dashboard import Dashboard
 
-  
-  PLOT_ROWS = 2
-  PLOT_COLS = 3
-  mainFig = plt.figure(f"Simulation {instanceNumber}")
-  shape = mainFig.add_subplot(PLOT_ROWS, PLOT_COLS, 1)
-  radPatternSag = mainFig.add_subplot(PLOT_ROWS, PLOT_COLS, 2, projection='polar')
-  radPatternFront = mainFig.add_subplot(PLOT_ROWS, PLOT_COLS, 3, projection='polar')
-  fitnessGraph = mainFig.add_subplot(PLOT_ROWS, PLOT_COLS, 4)
-  killedGraph = mainFig.add_subplot(PLOT_ROWS, PLOT_COLS, 5)
-  distanceGraph = mainFig.add_subplot(PLOT_ROWS, PLOT_COLS, 6)
-  mainFig.tight_layout()
-
-  PersistenceServiceClass = StubPersistenceService
+  if doPlot:
+    PLOT_ROWS = 2
+    PLOT_COLS = 3
+    mainFig = plt.figure(f"Simulation {instanceNumber}")
+    shape = mainFig.add_subplot(PLOT_ROWS, PLOT_COLS, 1)
+    radPatternSag = mainFig.add_subplot(PLOT_ROWS, PLOT_COLS, 2, projection='polar')
+    radPatternFront = mainFig.add_subplot(PLOT_ROWS, PLOT_COLS, 3, projection='polar')
+    fitnessGraph = mainFig.add_subplot(PLOT_ROWS, PLOT_COLS, 4)
+    killedGraph = mainFig.add_subplot(PLOT_ROWS, PLOT_COLS, 5)
+    distanceGraph = mainFig.add_subplot(PLOT_ROWS, PLOT_COLS, 6)
+    mainFig.tight_layout()
+  else:
+    fitnessGraph, killedGraph, distanceGraph = AxesStub(), AxesStub(), AxesStub()
+
+  persistenceService = StubPersistenceService(graphicsOutdir)
   if graphicsOutdir:
     if withBoundaries:
-      PersistenceServiceClass = MiniatureWithBoundariesPersistenceService
+      persistenceService = MiniatureWithBoundariesPersistenceService(graphicsOutdir, compressGraphics)
     else:
-      PersistenceServiceClass = MiniaturePersistenceService
+      persistenceService = MiniaturePersistenceService(graphicsOutdir, compressGraphics)
   
   worldView = StubLiveViewService(None)
   if doPlotWorld:
-    worldView = WorldLiveViewer(plt.figure(f"World Live View {instanceNumber}"), 20)
+    worldView = WorldLiveViewer(plt.figure(f"World Live View {instanceNumber}"))
 
   statService.withGraphers(
     FitnessPlotter(fitnessGraph),
@@ -58,28 +70,96 @@ def main(doPlot: bool, doPlotWorld: bool, graphicsOutdir: str, withBoundaries: b
     EuclideanDistancePlotter(distanceGraph)
   )
 
-  pop = Population()
-  sim = Simulation(pop, Config.GeneticAlgoTuning.useNiches, Config.GeneticAlgoTuning.nichesActivationThreshold) \
-    .withService(PlanarShapePlotter(shape)) \
-    .withService(RadiationPatternPlotter(radPatternFront, Gene.getRadiationPatternFrontal)) \
-    .withService(RadiationPatternPlotter(radPatternSag, Gene.getRadiationPatternSagittal)) \
-    .withService(PersistenceServiceClass(graphicsOutdir)) \
+  evaluator = None
+  if workersAddresses:
+    evaluator = RemoteEvaluator(workersAddresses)
+  elif evalProcesses > 0:
+    evaluator = SharedMemoryEvaluator(evalProcesses)
+
+  if profilerOptions is not None:
+    PROFILER.enable(
+      **profilerOptions,
+      captureDir=os.path.dirname(statService.filename) or ".",
+      capturePrefix=f"instance{instanceNumber}_"
+    )
+
+  if necTelemetry:
+    # Per-evaluation records are kept next to the stats, if saved
+    statsDir = os.path.dirname(statService.filename)
+    NEC_TELEMETRY.enable(join(statsDir, f"nec{instanceNumber}.cols") if statsDir else None)
+    statService.withGrapher(NecTelemetryPlotter(AxesStub()))
+
+  pop = createPopulation(config, evaluator=evaluator)
+  if eliteFilename and eliteSeedFraction > 0:
+    # Seeded elites carry their fitness: they aren't evaluated again
+    seeded = EliteArchive.load(eliteFilename, config).seed(pop.individuals, eliteSeedFraction)
+    logging.info(f"{seeded} individuals seeded from {eliteFilename}")
+  # GUI toolkits must be driven by the main thread, services run in background only when headless
+  sim = Simulation(pop, config.GeneticAlgoTuning.useNiches, config.GeneticAlgoTuning.nichesActivationThreshold, background=not (doPlot or doPlotWorld)) \
+    .withService(persistenceService) \
     .withService(statService) \
     .withService(worldView)
 
+  if archive:
+    # Every generation must be archived, even when it has to wait
+    archiveFolder = join(os.path.dirname(statService.filename) or "results", f"archive{instanceNumber}")
+    sim.withService(ArchivePersistenceService(archiveFolder), ServiceWorker.BLOCK)
+
+  if eliteFilename:
+    sim.withService(EliteArchivePersistenceService(eliteFilename))
+
+  if config.GeneticAlgoTuning.optimizer == "pareto":
+    # Fronts of every generation, next to the stats
+    paretoFolder = join(os.path.dirname(statService.filename) or "results", f"pareto{instanceNumber}")
+    sim.withService(ParetoFrontPersistenceService(paretoFolder), ServiceWorker.BLOCK)
+
+  if profilerOptions is not None:
+    statService.withGrapher(PhaseProfilePlotter(AxesStub(), GENERATION_PHASES + [servicePhaseName(s) for s in sim.services()]))
+
+  if doPlot:
+    sim.withService(PlanarShapePlotter(shape)) \
+      .withService(RadiationPatternPlotter(radPatternFront, Gene.getRadiationPatternFrontal)) \
+      .withService(RadiationPatternPlotter(radPatternSag, Gene.getRadiationPatternSagittal))
+
+  # One checkpoint per instance, next to the stats
+  checkpointFilename = join(os.path.dirname(statService.filename) or "results", f"checkpoint{instanceNumber}.npz")
+  if resume and exists(checkpointFilename):
+    sim.resume(checkpointFilename)
+  elif resume:
+    logging.warning(f"No checkpoint in {checkpointFilename}, starting over")
+  if checkpointPeriod > 0:
+    sim.withCheckpoints(checkpointFilename, checkpointPeriod)
+
   try:
-    if doPlot:
-      anim = animation.FuncAnimation(mainFig, sim.run, interval = 10, cache_frame_data = False)
+    if doPlot or doPlotWorld:
+      # Generations run within the main figure's frames (or the world view's, if alone),
+      # the world view is redrawn at a lower rate
+      animations = []
+      if doPlot:
+        dashboard = Dashboard(mainFig, sim.plotterServices + statService.graphers, sim)
+        animations.append(dashboard.animate())
+      if doPlotWorld:
+        worldDashboard = Dashboard(worldView.figure, [worldView], None if doPlot else sim, frameInterval=500)
+        animations.append(worldDashboard.animate())
       plt.show()
     else:
       while True:
         sim.run()
-  except StopIteration:
+  except StopIteration as e:
+    logging.info(f"Run over: {e}")
     return statService.valuesDict
+  finally:
+    sim.close()
+    NEC_TELEMETRY.close()
   
   return statService.valuesDict
 
 
+def runInstance(mainFunction: Callable, indexedStatService: Tuple[int, IStatService]):
+  instanceNumber, statService = indexedStatService
+  return mainFunction(statService, instanceNumber)
+
+
 if __name__ == "__main__":
   parser = argparse.ArgumentParser(
       description = "Planar evolved antenna proof-of-concept"
@@ -105,42 +185,142 @@ if __name__ == "__main__":
     default=False, action="store_true"
   )
 
+  parser.add_argument(
+    "-gz", "--gzip-graphics", help="Save each generation to a gzip compressed svgz file.",
+    default=False, action="store_true"
+  )
+
   parser.add_argument(
     "-so", "--stats-outdir", help="Specify stats output folder.",
     type=str, default=None
   )
 
+  parser.add_argument(
+    "-ag", "--aggregate-file", help="Aggregate stats output file. Defaults to aggregate_stats.mat inside the stats folder (or results).",
+    type=str, default=None
+  )
+
   parser.add_argument(
     "-bm", "--benchmark-instances", help="Number of benchmark's paralell simulations",
     type=int, default=1
   )
 
+  parser.add_argument(
+    "-rw", "--remote-workers", help="Addresses (host:port or unix:/path) of evaluation workers started with `python3 -m workers.remote`",
+    type=str, nargs="+", default=[]
+  )
+
+  parser.add_argument(
+    "-lw", "--local-workers", help="Number of evaluation workers to spawn on localhost",
+    type=int, default=0
+  )
+
+  parser.add_argument(
+    "-ep", "--eval-processes", help="Number of local processes evaluating genes through shared memory",
+    type=int, default=0
+  )
+
+  parser.add_argument(
+    "-pf", "--profile", help="Record wall time and calls of each phase of the generation loop and of each service, exported with the stats",
+    default=False, action="store_true"
+  )
+
+  parser.add_argument(
+    "-pm", "--profile-memory", help="Also record peak memory of each phase (tracemalloc, slow). Implies --profile.",
+    default=False, action="store_true"
+  )
+
+  parser.add_argument(
+    "-pg", "--profile-generation", help="Capture a generation with cProfile and tracemalloc (files saved in the stats folder). Implies --profile.",
+    type=int, default=None
+  )
+
+  parser.add_argument(
+    "-nt", "--nec-telemetry", help="Record solve time, failures and cache hits of every NEC evaluation; per-generation summaries are exported with the stats",
+    default=False, action="store_true"
+  )
+
+  parser.add_argument(
+    "-cp", "--checkpoint-period", help="Save a checkpoint (checkpointX.npz in the stats folder, or results) every CHECKPOINT_PERIOD generations",
+    type=int, default=0
+  )
+
+  parser.add_argument(
+    "-rs", "--resume", help="Continue each instance from its last checkpoint, if any",
+    default=False, action="store_true"
+  )
+
+  parser.add_argument(
+    "-ar", "--archive", help="Archive every individual of every generation (archiveX folder in the stats folder, or results), see utils.archive",
+    default=False, action="store_true"
+  )
+
+  parser.add_argument(
+    "-hf", "--hall-of-fame", help="Elite archive file (.npz) shared across runs and instances: updated with the best individuals, see core.elite",
+    type=str, default=None
+  )
+
+  parser.add_argument(
+    "-hs", "--hall-of-fame-seed", help="Fraction of the initial population seeded from the elite archive",
+    type=float, default=0.2
+  )
+
   args = parser.parse_args()
 
+  if args.eval_processes > 0 and args.benchmark_instances > 1:
+    parser.error("--eval-processes can't be used with more than one benchmark instance")
+
+  workersAddresses = args.remote_workers
+  if args.local_workers > 0:
+    _, localAddresses = spawnLocalWorkers(args.local_workers)
+    workersAddresses += localAddresses
+
   statsOutdir = args.stats_outdir
   if statsOutdir:
-    StatServiceClass = StatService
+    StatServiceClass = StreamingStatService
   else:
     StatServiceClass = StubStatService
     statsOutdir = ""
 
-  statServices = [StatServiceClass(join(statsOutdir, f"stats{i}.mat")) for i in range(args.benchmark_instances)]
+  config = Config.fromFile(CONFIG_FILENAME)    # Parsed once, instances receive a copy
+  aggregator = AggregateStatService(args.aggregate_file or join(statsOutdir or "results", "aggregate_stats.mat"))
+
+  manager = SyncManager()
+  manager.start(signal.signal, (signal.SIGINT, signal.SIG_IGN))    # Ctrl+C must not break the reports queue
+  with manager:
+    # Instances report each generation as soon as it's over, partial aggregates are saved along the way
+    reports = manager.Queue()
+    statServices = [
+      StatServiceClass(join(statsOutdir, f"stats{i}.mat")).withCollector(QueueCollector(reports, i))
+      for i in range(args.benchmark_instances)
+    ]
+
+    def consumeReports():
+      while (report := reports.get()) is not None:
+        _, generation, record = report
+        aggregator.addRecord(generation, record)
 
-  parallelMain = partial(main, args.plot, args.view_world, args.graphics_outdir, args.with_boundaries)
-  with Pool(args.benchmark_instances) as p:
-    statsDicts = p.starmap(parallelMain, [(statService, i) for i, statService in enumerate(statServices)])
+    consumer = Thread(target=consumeReports)
+    consumer.start()
 
-  outStats = {}
-  minLength = min([len(d['timeline']) for d in statsDicts])
-  for statName in statsDicts[0].keys():
-    rawValues = None
+    profilerOptions = None
+    if args.profile or args.profile_memory or args.profile_generation is not None:
+      profilerOptions = {"trackMemory": args.profile_memory, "captureGeneration": args.profile_generation}
 
-    for d in statsDicts:
-      if rawValues is not None:
-        rawValues = np.vstack((rawValues, d[statName][:minLength]))
+    parallelMain = partial(main, config, args.plot, args.view_world, args.graphics_outdir, args.with_boundaries, args.gzip_graphics, workersAddresses, args.eval_processes, profilerOptions, args.nec_telemetry, args.checkpoint_period, args.resume, args.archive, args.hall_of_fame, args.hall_of_fame_seed)
+    try:
+      if args.benchmark_instances == 1:
+        parallelMain(statServices[0], 0)    # Pool's daemonic processes can't spawn evaluation processes
       else:
-        rawValues = np.array(d[statName][:minLength])
-    
-    outStats[statName] = np.mean(rawValues, axis=0)
+        with Pool(args.benchmark_instances) as p:
+          for i, _ in enumerate(p.imap_unordered(partial(runInstance, parallelMain), enumerate(statServices))):
+            logging.info(f"{i + 1}/{args.benchmark_instances} instances done")
+    finally:
+      reports.put(None)
+      consumer.join()
+      aggregator.save()
 
-  savemat(join("results", "aggregate_stats.mat"), outStats)
+      # Instances killed while exporting (e.g. by Ctrl+C) leave their streamed stats behind
+      for statService in statServices:
+        if isinstance(statService, StreamingStatService) and not exists(statService.filename) and exists(statService.columnsPath):
+          statService.export()
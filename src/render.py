@@ -0,0 +1,206 @@
+"""
+Offline renderer of saved generations.
+
+Reads generations from a history archive (see utils.archive, poc.py -ar) or
+from checkpoints (poc.py -cp) and renders, for each generation:
+ - gen<n>.svg (or .svgz): miniatures of every individual, as -go does
+ - king<n>.png: geometry and sagittal and frontal radiation patterns of
+   the best individual, as -p does
+
+Generations are split in one chunk per process. Frames already on disk are
+skipped, so a render can be stopped and resumed, or run again on a growing
+archive. Archives don't hold radiation patterns: NEC is run on kings only.
+"""
+import argparse, logging
+import gzip, json, math, os
+import numpy as np
+from os.path import join, exists, isdir
+from types import SimpleNamespace
+from typing import List, Tuple, Dict, Any
+from multiprocessing import Pool
+from core.config import Config
+from core.gene import Gene
+from core.evaluation import decodeGene
+from core.checkpoint import readCheckpoint, decodeGenes
+from utils import svg
+from utils.archive import HistoryArchive
+from utils.geometry import rodToVertices
+
+CONFIG_FILENAME = "config.yaml"
+
+def framePaths(outdir: str, generation: int, compress: bool) -> Tuple[str, str]:
+  return (
+    join(outdir, f"gen{generation}.{'svgz' if compress else 'svg'}"),
+    join(outdir, f"king{generation}.png")
+  )
+
+def archiveGenerations(archivePath: str) -> Tuple[Config, List[Tuple[int, Any]]]:
+  """
+  Configuration and (generation, source) frames of an archive
+  """
+  archive = HistoryArchive(archivePath)
+  configDict = archive.config()
+  config = Config.fromDict(configDict) if configDict is not None else Config.fromFile(CONFIG_FILENAME)
+  return config, [(int(generation), archivePath) for generation in archive.generations()]
+
+def checkpointGenerations(filenames: List[str]) -> Tuple[Config, List[Tuple[int, Any]]]:
+  frames = []
+  for filename in filenames:
+    arrays = readCheckpoint(filename)
+    frames.append((int(arrays["generationNumber"]), filename))
+
+  return Config.fromDict(json.loads(str(arrays["config"]))), frames
+
+def archiveFrame(config: Config, archive: HistoryArchive, generation: int) -> Tuple[np.ndarray, Gene]:
+  """
+  Encodings of every individual and the king (evaluated, radiation patterns included)
+  """
+  values = archive.generation(generation)
+  best = int(np.argmax(values["fitness"]))
+  king = decodeGene(config, values["encoding"][best].astype(np.float64), values["gpDistance"][best])
+  king.evaluate()
+
+  return values["encoding"], king
+
+def checkpointFrame(filename: str) -> Tuple[np.ndarray, Gene]:
+  arrays = readCheckpoint(filename)
+  _, genes = decodeGenes(arrays)
+  layout = arrays["world"] if bool(arrays["niche"]) else arrays["individuals"]
+  individuals = [genes[i] for i in layout]
+  king = max(individuals, key=lambda g: g.fitnessCached)
+
+  return arrays["encodings"][layout], king
+
+def renderChunk(task: Tuple[Config, List[Tuple[int, Any]], str, Dict[str, Any]]) -> int:
+  """
+  Renders a chunk of frames in a single process, reusing the same figure. Returns the number of frames rendered.
+  """
+  config, frames, outdir, options = task
+
+  import matplotlib
+  matplotlib.use("Agg")
+  import matplotlib.pyplot as plt
+  from services.plotters import PlanarShapePlotter, RadiationPatternPlotter
+
+  figure = plt.figure(figsize=(12, 4))
+  shape = figure.add_subplot(1, 3, 1)
+  plotters = [
+    PlanarShapePlotter(shape),
+    RadiationPatternPlotter(figure.add_subplot(1, 3, 2, projection="polar"), Gene.getRadiationPatternSagittal),
+    RadiationPatternPlotter(figure.add_subplot(1, 3, 3, projection="polar"), Gene.getRadiationPatternFrontal)
+  ]
+
+  archives: Dict[str, HistoryArchive] = {}
+  startPoint = (-config.ShapeConstraints.outerDiam / 2, 0)
+  rendered = 0
+
+  for generation, source in frames:
+    miniaturesPath, kingPath = framePaths(outdir, generation, options["compress"])
+    if exists(miniaturesPath) and exists(kingPath):
+      continue
+
+    if isdir(source):
+      archive = archives.setdefault(source, HistoryArchive(source))
+      encodings, king = archiveFrame(config, archive, generation)
+    else:
+      encodings, king = checkpointFrame(source)
+
+    if not exists(miniaturesPath):
+      vertices = rodToVertices(encodings.astype(np.float64), startPoint)
+      opener = gzip.open if options["compress"] else open
+      with opener(miniaturesPath, "wt") as f:
+        svg.writeMiniaturesSvg(f, list(vertices), config, options["withBoundaries"])
+
+    if not exists(kingPath) and king.fitnessCached > float("-inf"):
+      population = SimpleNamespace(config=config, individuals=[king])    # Plotters only look at these
+      for plotter in plotters:
+        plotter.plot(population)
+        plotter.artists()
+      shape.set_title(f"Generation {generation}, fitness {king.fitnessCached:.3f}")
+      figure.savefig(kingPath)
+
+    rendered += 1
+
+  plt.close(figure)
+  return rendered
+
+def assembleAnimation(outdir: str, generations: List[int], filename: str, frameDuration: int) -> None:
+  """
+  Animated gif of king frames, in generation order
+  """
+  from PIL import Image
+
+  paths = [join(outdir, f"king{g}.png") for g in sorted(generations)]
+  frames = [Image.open(path) for path in paths if exists(path)]
+  if len(frames) == 0:
+    return
+
+  frames[0].save(join(outdir, filename), save_all=True, append_images=frames[1:], duration=frameDuration, loop=0)
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(
+    description = "Planar evolved antenna offline renderer"
+  )
+
+  parser.add_argument(
+    "sources", help="A history archive folder, or one or more checkpoint files",
+    type=str, nargs="+"
+  )
+
+  parser.add_argument(
+    "-o", "--outdir", help="Output folder",
+    type=str, default="render"
+  )
+
+  parser.add_argument(
+    "-j", "--jobs", help="Number of processes (one chunk of generations each)",
+    type=int, default=None
+  )
+
+  parser.add_argument(
+    "-b", "--with-boundaries", help="Draw boundaries under each miniature",
+    default=False, action="store_true"
+  )
+
+  parser.add_argument(
+    "-gz", "--gzip-graphics", help="Save miniatures as gzip compressed svgz files",
+    default=False, action="store_true"
+  )
+
+  parser.add_argument(
+    "-a", "--animate", help="Assemble king frames into an animated gif (kings.gif)",
+    default=False, action="store_true"
+  )
+
+  parser.add_argument(
+    "-fd", "--frame-duration", help="Animation frame duration (ms)",
+    type=int, default=100
+  )
+
+  args = parser.parse_args()
+
+  logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(levelname)s: %(message)s",
+    datefmt="%H:%M:%S"
+  )
+
+  os.makedirs(args.outdir, exist_ok=True)
+
+  if len(args.sources) == 1 and isdir(args.sources[0]):
+    config, frames = archiveGenerations(args.sources[0])
+  else:
+    config, frames = checkpointGenerations(args.sources)
+
+  options = {"compress": args.gzip_graphics, "withBoundaries": args.with_boundaries}
+  jobs = args.jobs or os.cpu_count()
+  chunkSize = math.ceil(len(frames) / jobs) if frames else 1
+  tasks = [(config, frames[i:i + chunkSize], args.outdir, options) for i in range(0, len(frames), chunkSize)]
+
+  with Pool(jobs) as pool:
+    rendered = sum(pool.imap_unordered(renderChunk, tasks))
+  logging.info(f"{rendered} of {len(frames)} generations rendered, the others were already on disk")
+
+  if args.animate:
+    assembleAnimation(args.outdir, [g for g, _ in frames], "kings.gif", args.frame_duration)
@@ -2,6 +2,20 @@ from necpp import *
 from typing import List, Any
 from rf.radiation import RadiationPattern, RpCardEvaluationInput
 
+# Outcome of an evaluation: the NEC stage that failed, if any
+NEC_OK = 0
+NEC_GEOMETRY_ERROR = 1    # Wires or geometry rejected
+NEC_EXCITATION_ERROR = 2    # Ground plane, frequency or excitation cards rejected
+NEC_PATTERN_ERROR = 3    # Radiation pattern or gains computation failed
+NEC_NON_FINITE = 4    # Solved, but fitness isn't a finite number
+
+NEC_FAILURE_NAMES = {
+    NEC_GEOMETRY_ERROR: "Geometry",
+    NEC_EXCITATION_ERROR: "Excitation",
+    NEC_PATTERN_ERROR: "Pattern",
+    NEC_NON_FINITE: "NonFinite",
+}
+
 class NecAnalysis:
     def __init__(self, gene, frequencyHz: float):
         self.context = None
@@ -76,26 +90,30 @@ class NecAnalysis:
                 0,    # Normalization factor
             ) == 0
 
-        return RadiationPattern.fromNecContext(
-            self.context,
-            [
-                RpCardEvaluationInput(
-                    90 - evaluations[0].thetaStart,
-                    90 - evaluations[0].thetaEnd,
-                    evaluations[0].thetaIncrement,
-                    evaluations[0].phiStart,
-                    evaluations[0].phiEnd,
-                    evaluations[0].phiIncrement,
-                    evaluations[0].index
-                ),
-                RpCardEvaluationInput(
-                    90 + evaluations[1].thetaStart,
-                    90 + evaluations[1].thetaEnd,
-                    evaluations[1].thetaIncrement,
-                    evaluations[1].phiStart,
-                    evaluations[1].phiEnd,
-                    evaluations[1].phiIncrement,
-                    evaluations[1].index
-                )
-            ]
-        )
\ No newline at end of file
+        return RadiationPattern.fromNecContext(self.context, NecAnalysis.patternEvaluations(evaluations))
+
+    @staticmethod
+    def patternEvaluations(evaluations: List[RpCardEvaluationInput]) -> List[RpCardEvaluationInput]:
+        """
+        Gains to read back from the context for the given RP cards, with elevation turned into theta
+        """
+        return [
+            RpCardEvaluationInput(
+                90 - evaluations[0].thetaStart,
+                90 - evaluations[0].thetaEnd,
+                evaluations[0].thetaIncrement,
+                evaluations[0].phiStart,
+                evaluations[0].phiEnd,
+                evaluations[0].phiIncrement,
+                evaluations[0].index
+            ),
+            RpCardEvaluationInput(
+                90 + evaluations[1].thetaStart,
+                90 + evaluations[1].thetaEnd,
+                evaluations[1].thetaIncrement,
+                evaluations[1].phiStart,
+                evaluations[1].phiEnd,
+                evaluations[1].phiIncrement,
+                evaluations[1].index
+            )
+        ]
\ No newline at end of file
@@ -0,0 +1,233 @@
+"""
+End-to-end scaling benchmark.
+
+Runs seeded, headless simulations for every combination of evaluation
+workers, population size and segments number described in a spec file (see
+scaling.yaml), with the evaluators poc.py uses for -ep and -lw. Each run
+measures generations per second, NEC evaluations per second, and the wall
+time and NEC evaluations the king takes to reach a target fitness. Runs are
+executed one after another, so that they don't compete for CPUs.
+
+Strong scaling: the same population on more workers. Weak scaling: the
+population grows with workers (weak_population_per_worker individuals each).
+Efficiency is relative to the point with the fewest workers (in-process
+evaluation counts as one worker).
+"""
+import argparse, logging
+import json, time, random
+import itertools
+import numpy as np
+import yaml
+from dataclasses import dataclass
+from typing import Dict, List, Any, Tuple
+from multiprocessing import Process
+from core.config import Config
+from core.evaluation import IEvaluator
+from core.simulation import Simulation
+from core.optimizers import createPopulation
+from core.telemetry import NEC_TELEMETRY, summarize
+from utils.benchmark import machineMetadata
+from workers.remote import RemoteEvaluator, spawnLocalWorkers
+from workers.shared import SharedMemoryEvaluator
+
+CONFIG_FILENAME = "config.yaml"
+
+@dataclass
+class ScalingJob:
+  mode: str    # strong or weak
+  workers: int
+  populationSize: int
+  segmentsNumber: int
+  seed: int
+  config: Config
+
+  def point(self) -> Dict[str, Any]:
+    return {"mode": self.mode, "workers": self.workers, "populationSize": self.populationSize, "segmentsNumber": self.segmentsNumber}
+
+
+def buildJobs(spec: Dict[str, Any], baseConfig: Config) -> List[ScalingJob]:
+  points = [
+    ("strong", workers, populationSize, segmentsNumber)
+    for workers, populationSize, segmentsNumber in itertools.product(spec["workers"], spec["population_size"], spec["segments_number"])
+  ]
+  if spec.get("weak_population_per_worker"):
+    points += [
+      ("weak", workers, spec["weak_population_per_worker"] * max(workers, 1), segmentsNumber)
+      for workers, segmentsNumber in itertools.product(spec["workers"], spec["segments_number"])
+    ]
+
+  return [
+    ScalingJob(mode, workers, populationSize, segmentsNumber, seed, baseConfig.withOverrides({
+      "population_size": populationSize, "segments_number": segmentsNumber
+    }))
+    for mode, workers, populationSize, segmentsNumber in points
+    for seed in range(spec.get("seeds", 1))
+  ]
+
+def createEvaluator(kind: str, workers: int, config: Config) -> Tuple[IEvaluator, List[Process]]:
+  """
+  The evaluator, None (in-process evaluation) for 0 workers, and the worker daemons
+  it uses, which closing it doesn't stop
+  """
+  if workers == 0:
+    return None, []
+  if kind == "workers":
+    processes, addresses = spawnLocalWorkers(workers)
+    return RemoteEvaluator(addresses), processes
+
+  return SharedMemoryEvaluator(workers, segmentsNumber=config.GeneEncoding.segmentsNumber), []
+
+def runJob(job: ScalingJob, evaluatorKind: str, generations: int, targetFitness: float) -> Dict[str, Any]:
+  random.seed(job.seed)
+  np.random.seed(job.seed)
+
+  evaluator, workerProcesses = createEvaluator(evaluatorKind, job.workers, job.config)    # Startup isn't timed
+  sim = Simulation(createPopulation(job.config, evaluator=evaluator))
+  NEC_TELEMETRY.collect()    # Initial population isn't evaluated yet, nothing to keep
+
+  row = {**job.point(), "seed": job.seed, "generations": 0, "timeToTarget": None, "generationToTarget": None, "evaluationsToTarget": None}
+  startTime = time.perf_counter()
+  try:
+    for generation in range(1, generations + 1):
+      try:
+        sim.evolve()
+      except StopIteration:
+        break    # Stopped by run control (iterations_number, budgets, stagnation)
+      row["generations"] = generation
+      if row["timeToTarget"] is None and sim.population.king.fitnessCached >= targetFitness:
+        row["timeToTarget"] = time.perf_counter() - startTime
+        row["generationToTarget"] = generation
+        row["evaluationsToTarget"] = sim.population.necEvaluations
+  finally:
+    wallTime = time.perf_counter() - startTime
+    sim.close()
+    for process in workerProcesses:
+      process.terminate()
+      process.join()
+
+  necEvaluations = summarize(NEC_TELEMETRY.collect())["necEvaluations"]
+  row.update(
+    wallTime=wallTime,
+    necEvaluations=necEvaluations,
+    generationsPerSecond=row["generations"] / wallTime,
+    necEvaluationsPerSecond=necEvaluations / wallTime,
+    kingFitness=float(sim.population.king.fitnessCached)
+  )
+
+  return row
+
+def summarizePoints(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+  """
+  One line per point: throughput means over seeds, median time to target of the seeds that reached it
+  """
+  groups: Dict[tuple, List[Dict[str, Any]]] = {}
+  for row in rows:
+    groups.setdefault((row["mode"], row["workers"], row["populationSize"], row["segmentsNumber"]), []).append(row)
+
+  points = []
+  for (mode, workers, populationSize, segmentsNumber), group in groups.items():
+    reached = [r for r in group if r["timeToTarget"] is not None]
+    points.append({
+      "mode": mode,
+      "workers": workers,
+      "populationSize": populationSize,
+      "segmentsNumber": segmentsNumber,
+      "runs": len(group),
+      "generationsPerSecond": float(np.mean([r["generationsPerSecond"] for r in group])),
+      "necEvaluationsPerSecond": float(np.mean([r["necEvaluationsPerSecond"] for r in group])),
+      "reachedTarget": len(reached),
+      "timeToTarget": float(np.median([r["timeToTarget"] for r in reached])) if reached else None,
+      "evaluationsToTarget": float(np.median([r["evaluationsToTarget"] for r in reached])) if reached else None
+    })
+
+  return points
+
+def scalingEfficiency(points: List[Dict[str, Any]], mode: str) -> List[Dict[str, Any]]:
+  """
+  Speedup and efficiency of each point against the one with the fewest workers and the
+  same problem: NEC evaluations per second for strong scaling, generations per second
+  (work per worker is constant) for weak scaling
+  """
+  key = "necEvaluationsPerSecond" if mode == "strong" else "generationsPerSecond"
+  groups: Dict[tuple, List[Dict[str, Any]]] = {}
+  for point in points:
+    if point["mode"] == mode:
+      problem = (point["populationSize"], point["segmentsNumber"]) if mode == "strong" else (point["segmentsNumber"],)
+      groups.setdefault(problem, []).append(point)
+
+  curves = []
+  for group in groups.values():
+    group = sorted(group, key=lambda p: p["workers"])
+    reference = group[0]
+    for point in group:
+      speedup = point[key] / reference[key] if reference[key] > 0 else float("nan")
+      scale = max(point["workers"], 1) / max(reference["workers"], 1)
+      curves.append({
+        "workers": point["workers"],
+        "populationSize": point["populationSize"],
+        "segmentsNumber": point["segmentsNumber"],
+        "speedup": speedup,
+        "efficiency": speedup / scale if mode == "strong" else speedup
+      })
+
+  return curves
+
+def formatTable(points: List[Dict[str, Any]], curves: Dict[str, List[Dict[str, Any]]]) -> str:
+  efficiencies = {
+    (mode, c["workers"], c["populationSize"], c["segmentsNumber"]): c["efficiency"]
+    for mode, modeCurves in curves.items() for c in modeCurves
+  }
+
+  lines = [f"{'mode':6s} {'workers':>7s} {'pop':>6s} {'segs':>5s} {'gen/s':>8s} {'nec/s':>9s} {'target (s)':>11s} {'efficiency':>10s}"]
+  for p in points:
+    timeToTarget = f"{p['timeToTarget']:11.2f}" if p["timeToTarget"] is not None else f"{'-':>11s}"
+    efficiency = efficiencies[(p["mode"], p["workers"], p["populationSize"], p["segmentsNumber"])]
+    lines.append(
+      f"{p['mode']:6s} {p['workers']:7d} {p['populationSize']:6d} {p['segmentsNumber']:5d} "
+      f"{p['generationsPerSecond']:8.3f} {p['necEvaluationsPerSecond']:9.1f} {timeToTarget} {efficiency:10.2f}"
+    )
+
+  return "\n".join(lines)
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(
+    description = "Planar evolved antenna scaling benchmark"
+  )
+
+  parser.add_argument(
+    "spec", help="Scaling benchmark specification (yaml)",
+    type=str
+  )
+
+  parser.add_argument(
+    "-o", "--output", help="Output file (json): runs, points and scaling curves",
+    type=str, default="scaling.json"
+  )
+
+  args = parser.parse_args()
+
+  logging.basicConfig(
+    level=logging.ERROR,    # Generation logs would be unreadable
+    format="%(asctime)s - %(levelname)s: %(message)s",
+    datefmt="%H:%M:%S"
+  )
+
+  with open(args.spec) as f:
+    spec = yaml.safe_load(f)
+
+  jobs = buildJobs(spec, Config.fromFile(CONFIG_FILENAME))
+  NEC_TELEMETRY.enable()
+
+  rows = []
+  for i, job in enumerate(jobs):
+    rows.append(runJob(job, spec.get("evaluator", "processes"), spec["generations"], spec["target_fitness"]))
+    print(f"[{i + 1}/{len(jobs)}] {job.point()} seed {job.seed}: {rows[-1]['generationsPerSecond']:.3f} gen/s", flush=True)
+
+  points = summarizePoints(rows)
+  curves = {mode: scalingEfficiency(points, mode) for mode in ("strong", "weak")}
+
+  with open(args.output, "w") as f:
+    json.dump({"metadata": machineMetadata(), "spec": spec, "runs": rows, "points": points, "scaling": curves}, f, indent=2)
+
+  print(formatTable(points, curves))
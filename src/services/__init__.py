@@ -1 +1 @@
-__all__ = ["persistence", "plotters"]
\ No newline at end of file
+__all__ = ["persistence", "plotters", "dashboard"]
\ No newline at end of file
@@ -0,0 +1,74 @@
+import logging
+import time
+from typing import List, Dict, Tuple, Union, TYPE_CHECKING
+from core.simulation import Simulation
+from services.plotters import IPlotterService, ILiveViewService
+
+if TYPE_CHECKING:
+  from matplotlib.axes import Axes
+  from matplotlib.figure import Figure
+  from matplotlib.artist import Artist
+  from matplotlib.animation import FuncAnimation
+
+class Dashboard:
+  """
+  Renders plotters (or live viewers) of a figure with blitting, from matplotlib's
+  event loop. Render rate is decoupled from generation rate: when a simulation is
+  given, each frame runs as many generations as fit in generationsBudget seconds
+  (at least one) and only then refreshes visual services.
+  """
+  def __init__(
+      self,
+      figure: "Figure",
+      services: List[Union[IPlotterService, ILiveViewService]],
+      simulation: Simulation = None,
+      frameInterval: int = 50,
+      generationsBudget: float = 0.05
+    ):
+    self.figure = figure
+    self.services = services
+    self.simulation = simulation
+    self.frameInterval = frameInterval
+    self.generationsBudget = generationsBudget
+    self.views: Dict["Axes", Tuple] = {}
+    self.animation: "FuncAnimation" = None
+
+  def animate(self) -> "FuncAnimation":
+    from matplotlib.animation import FuncAnimation
+
+    self.animation = FuncAnimation(
+      self.figure, self.frame,
+      interval=self.frameInterval, blit=True, cache_frame_data=False
+    )
+    return self.animation
+
+  def step(self) -> None:
+    deadline = time.perf_counter() + self.generationsBudget
+    simulation = self.simulation
+
+    while True:
+      try:
+        simulation.step()
+      except StopIteration as e:
+        logging.info(f"Run over: {e}")
+        self.simulation = None    # Figures stay open, views aren't updated anymore
+        break
+      if time.perf_counter() > deadline:
+        break
+
+    simulation.runVisualServices()
+
+  def frame(self, *_) -> List["Artist"]:
+    if self.simulation is not None:
+      self.step()
+
+    artists = [a for service in self.services for a in service.artists()]
+
+    # Blitting only redraws artists: when limits change, ticks and grid (the
+    # cached background) are redrawn with a full, synchronous draw
+    views = {a.axes: (a.axes.get_xlim(), a.axes.get_ylim()) for a in artists}
+    if any(self.views.get(axes) != view for axes, view in views.items()):
+      self.figure.canvas.draw()
+    self.views = views
+
+    return artists
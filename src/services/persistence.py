@@ -1,10 +1,20 @@
-from fileinput import filename
-from os.path import join
-from typing import Any
+import gzip
+import numpy as np
+from os.path import join, dirname
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Any, List, Deque
 from abc import ABC, abstractmethod
+from core.config import Config
+from core.gene import Gene
 from core.population import Population
+from core.evaluation import encodeGenes
+from core.elite import EliteArchive
+from core.pareto import ParetoPopulation
+from utils import svg
+from utils.archive import HistoryArchiveWriter
+from utils.columns import ColumnStore
 from services.service import Service
-from utils.amenities import *
 
 class IPersistenceService(Service):
   def __init__(self, persistenceFolder: str):
@@ -20,27 +30,143 @@ class StubPersistenceService(IPersistenceService):
 
 
 class MiniaturePersistenceService(IPersistenceService):
+  """
+  Writes gen<n>.svg (or .svgz when compressed) miniatures of every generation.
+  Vertices are extracted on the caller's thread, text is written by a worker thread.
+  """
+  doPlotConstraints = False
+
+  def __init__(self, persistenceFolder: str, compress: bool = False, maxPending: int = 4):
+    super().__init__(persistenceFolder)
+    self.compress = compress
+    self.maxPending = maxPending
+    self.writer = ThreadPoolExecutor(max_workers=1)
+    self.pending: Deque[Future] = deque()
+
   def save(self, population: Population) -> None:
-    fileName = f"gen{population.generationNumber}.svg"
+    extension = "svgz" if self.compress else "svg"
     filePath = join(
       self.persistenceFolder,
-      fileName
+      f"gen{population.generationNumber}.{extension}"
     )
 
-    with open(filePath, "w") as outFile:
-      saveMiniaturesSvg(outFile, population.individuals, False)
+    vertices = [svg.polychainVertices(g.getCartesianCoords()) for g in population.individuals]
+    config = population.config
+
+    while len(self.pending) >= self.maxPending:
+      self.pending.popleft().result()
+    self.pending.append(self.writer.submit(self.write, filePath, vertices, config))
+
+  def write(self, filePath: str, vertices: List[np.ndarray], config: Config) -> None:
+    opener = gzip.open if self.compress else open
+    with opener(filePath, "wt") as outFile:
+      svg.writeMiniaturesSvg(outFile, vertices, config, self.doPlotConstraints)
+
+  def close(self) -> None:
+    self.writer.shutdown(wait=True)
+    while len(self.pending) > 0:
+      self.pending.popleft().result()    # Surfaces write errors
+
+
+class MiniatureWithBoundariesPersistenceService(MiniaturePersistenceService):
+  doPlotConstraints = True
 
+class ArchivePersistenceService(IPersistenceService):
+  """
+  Appends every individual of every generation to a history archive in
+  persistenceFolder (see utils.archive), in batches of batchGenerations.
+  Must see every generation: attach it with the BLOCK policy when services run in background.
+  """
+  def __init__(self, persistenceFolder: str, batchGenerations: int = 10):
+    super().__init__(persistenceFolder)
+    self.batchGenerations = batchGenerations
+    self.writer: HistoryArchiveWriter = None    # Opened lazily, as stat services' stores
 
-class MiniatureWithBoundariesPersistenceService(IPersistenceService):
   def save(self, population: Population) -> None:
-    fileName = f"gen{population.generationNumber}.svg"
-    filePath = join(
-      self.persistenceFolder,
-      fileName
+    if self.writer is None:
+      self.writer = HistoryArchiveWriter(self.persistenceFolder, "w", self.batchGenerations, population.config.toDict())
+
+    genes = population.populationSet().tolist() if hasattr(population, "world") else population.individuals
+    encodings, gpDistances = encodeGenes(genes)
+    self.writer.append(
+      population.generationNumber,
+      np.array([g.serial for g in genes], dtype=np.int64),
+      np.array([g.parents for g in genes], dtype=np.int64).reshape(len(genes), 2),
+      encodings,
+      gpDistances,
+      np.array([g.fitnessCached for g in genes])
     )
 
-    with open(filePath, "w") as outFile:
-      saveMiniaturesSvg(outFile, population.individuals, True)
+  def close(self) -> None:
+    if self.writer is not None:
+      self.writer.close()
+      self.writer = None
+
+
+class EliteArchivePersistenceService(IPersistenceService):
+  """
+  Offers the king and the topIndividuals best individuals of every generation
+  to an elite archive (see core.elite), saved to filename every savePeriod
+  generations and when closed. Instances sharing the file merge their elites.
+  """
+  def __init__(self, filename: str, topIndividuals: int = 10, savePeriod: int = 10, capacity: int = 50, crowdingRadius: float = 2.0):
+    super().__init__(dirname(filename))
+    self.filename = filename
+    self.topIndividuals = topIndividuals
+    self.savePeriod = savePeriod
+    self.capacity = capacity
+    self.crowdingRadius = crowdingRadius
+    self.archive: EliteArchive = None    # Created lazily, with the population's config
+
+  def save(self, population: Population) -> None:
+    if self.archive is None:
+      self.archive = EliteArchive.load(self.filename, population.config, self.capacity, self.crowdingRadius)
+
+    genes = population.populationSet().tolist() if hasattr(population, "world") else population.individuals
+    best = sorted(genes, key=lambda g: g.fitnessCached, reverse=True)[:self.topIndividuals]
+    kings = [population.king] if isinstance(population.king, Gene) else []    # Niches' king is 0 until a valid gene appears
+    self.archive.update(best + kings)
+
+    if population.generationNumber % self.savePeriod == 0:
+      self.archive.save(self.filename)
+
+  def close(self) -> None:
+    if self.archive is not None:
+      self.archive.save(self.filename)
+
+
+class ParetoFrontPersistenceService(IPersistenceService):
+  """
+  Appends the first front of every generation of a Pareto population (see
+  core.pareto) to a column store in persistenceFolder (see utils.columns):
+  generation, serial, encoding, ground plane distance, objectives and fitness.
+  Must see every generation: attach it with the BLOCK policy when services run in background.
+  """
+  def __init__(self, persistenceFolder: str):
+    super().__init__(persistenceFolder)
+    self.store: ColumnStore = None    # Opened lazily, as the history archive
+
+  def save(self, population: ParetoPopulation) -> None:
+    if self.store is None:
+      self.store = ColumnStore(self.persistenceFolder, "w")
+
+    front = population.front()
+    encodings, gpDistances = encodeGenes(front)
+    self.store.appendMany(
+      generation=np.full(len(front), population.generationNumber, dtype=np.int64),
+      serial=np.array([g.serial for g in front], dtype=np.int64),
+      encoding=encodings,
+      gpDistance=gpDistances,
+      objectives=population.objectives(front),
+      fitness=np.array([g.fitnessCached for g in front])
+    )
+    self.store.flush()
+
+  def close(self) -> None:
+    if self.store is not None:
+      self.store.close()
+      self.store = None
+
 
 class PicklePersistenceService(IPersistenceService):
   def save(self, population: Population) -> None:
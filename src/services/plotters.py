@@ -1,13 +1,56 @@
-from typing import Dict, Any, Callable
+import math
+import numpy as np
+from typing import Dict, Any, Callable, List, TYPE_CHECKING
 from abc import ABC, abstractmethod
 from core.population import Population
+from core.evaluation import encodeGenes
+from core.telemetry import summarize
+from rf.radiation import RadiationPattern
 from services.service import Service
-from matplotlib.axes import Axes
-from matplotlib.figure import Figure
-from utils.amenities import *
+from utils.geometry import rodToVertices
+from utils.stats import meanDistanceFrom, meanPairwiseDistance, angleEntropy
+from utils.profiling import flattenStats
+
+# matplotlib (and utils.amenities, which is built on it) is imported lazily,
+# so that headless simulations never load the plotting stack
+if TYPE_CHECKING:
+  from matplotlib.axes import Axes
+  from matplotlib.figure import Figure
+  from matplotlib.artist import Artist
+
+# Plotters only record what they're given at generation rate (plot/update), their
+# artists are created once and refreshed at render rate by artists(), see services.dashboard
+
+def fitLimits(axes: "Axes", xs: List[float] = None, ys: List[float] = None, headroom: float = 0.25) -> None:
+  """
+  Widens axes limits, with headroom, only when data falls outside them, so that
+  blitted backgrounds (ticks, grid) rarely need a full redraw
+  """
+  limits = []
+  if xs is not None:
+    limits.append((xs, axes.get_xlim, axes.set_xlim))
+  if ys is not None:
+    limits.append((ys, axes.get_ylim, axes.set_ylim))
+
+  for values, getLimits, setLimits in limits:
+    values = np.asarray(values, dtype=np.float64)
+    values = values[np.isfinite(values)]
+    if len(values) == 0:
+      continue
+
+    low, high = values.min(), values.max()
+    currentLow, currentHigh = getLimits()
+    if low >= currentLow and high <= currentHigh:
+      continue
+
+    margin = headroom * max(high - low, abs(high), 1e-9)
+    setLimits(
+      low - margin if low < currentLow else currentLow,
+      high + margin if high > currentHigh else currentHigh
+    )
 
 class IPlotterService(Service):
-  def __init__(self, axes: Axes):
+  def __init__(self, axes: "Axes"):
     self.axes = axes
     self.__post_init__()
 
@@ -18,10 +61,17 @@ class IPlotterService(Service):
   def plot(self, population: Population) -> Any:
     ...
 
+  def artists(self) -> List["Artist"]:
+    """
+    Brings artists up to date with what was last plotted and returns those that changed
+    """
+    return []
+
 
 class IGrapherService(IPlotterService):
-  def __init__(self, axes: Axes):
+  def __init__(self, axes: "Axes"):
     self.axes = axes
+    self.lines = None
     self.__post_init__()
 
   def __post_init__(self) -> Any:
@@ -35,10 +85,41 @@ class IGrapherService(IPlotterService):
     """
     ...
 
+  def series(self) -> Dict[str, List]:
+    """
+    Histories by name, the grapher's own lists (what plot returns)
+    """
+    return {}
+
+  def restore(self, values: Dict[str, List]) -> None:
+    """
+    Refills histories with values of a previous run (e.g. from a checkpoint)
+    """
+    series = self.series()
+    for name, history in values.items():
+      series.setdefault(name, [])[:] = list(history)
+
+  def updateLines(self, title: str, timeline: List, series: List[List], legend: List[str] = None) -> List["Artist"]:
+    """
+    One line per series against timeline, created on first call
+    """
+    if self.lines is None:
+      self.axes.set_title(title)
+      self.axes.grid(True)
+      self.lines = [self.axes.plot([], [])[0] for _ in series]
+      if legend is not None:
+        self.axes.legend(self.lines, legend)
+
+    for line, values in zip(self.lines, series):
+      line.set_data(timeline, values)
+    fitLimits(self.axes, timeline, [v for values in series for v in values])
+
+    return self.lines
+
 
 class ILiveViewService(Service):
-  def __init__(self, figure: Figure, updatePeriod: int = 1):
-    self.figure: Figure = figure
+  def __init__(self, figure: "Figure", updatePeriod: int = 1):
+    self.figure: "Figure" = figure
     self.updatePeriod = updatePeriod
     self.itCounter = 0
     self.__post_init__()
@@ -50,6 +131,12 @@ class ILiveViewService(Service):
   def update(self, population: Population) -> None:
     ...
 
+  def artists(self) -> List["Artist"]:
+    """
+    Brings artists up to date with the last update and returns those that changed
+    """
+    return []
+
 
 class StubPlotterService(IPlotterService):
   def plot(self, population: Population) -> None:
@@ -65,34 +152,63 @@ class PlanarShapePlotter(IPlotterService):
   """
   2D geometry and constraints plotter
   """
+  def __post_init__(self):
+    self.population: Population = None
+    self.path = None
+
   def plot(self, population: Population) -> None:
-    self.axes.axis("equal")
-    self.axes.clear()
-    plotCansatBottomProfile(self.axes)
-    plotAntennaPath(self.axes, population.individuals[0].getCartesianCoords())
+    self.population = population
+
+  def artists(self) -> List["Artist"]:
+    if self.population is None:
+      return []
+
+    if self.path is None:
+      from matplotlib.collections import LineCollection
+      from utils.amenities import plotCansatBottomProfile
+
+      self.axes.axis("equal")
+      plotCansatBottomProfile(self.axes, self.population.config)
+      self.path = LineCollection([], linewidths=3, color="#4caf50")
+      self.axes.add_collection(self.path, autolim=False)
+
+    self.path.set_segments([line.toList() for line in self.population.individuals[0].getCartesianCoords()])
+    return [self.path]
 
 
 class RadiationPatternPlotter(IPlotterService):
   """
   Frontal and sagittal radiation pattern plotter
   """
-  def __init__(self, axes: Axes, rpGetter: Callable[[], RadiationPattern]):
+  def __init__(self, axes: "Axes", rpGetter: Callable[[], RadiationPattern]):
     self.axes = axes
     self.rpGetter = rpGetter
+    self.population: Population = None
+    self.profile = None
+    self.pattern = None
   
   def plot(self, population: Population) -> None:
-    self.axes.clear()
-    
-    plotCansatProfile(
-      self.axes,
-      max(self.rpGetter(population.individuals[0]).gainsMw),
-      -population.individuals[0].groundPlaneDistance/30
-    )
+    self.population = population
 
-    plotRadiationPatternSlice(
-        self.axes,
-        self.rpGetter(population.individuals[0])
-    )
+  def artists(self) -> List["Artist"]:
+    if self.population is None:
+      return []
+
+    from utils.amenities import cansatProfileData, CANSAT_RED
+
+    if self.profile is None:
+      self.profile, = self.axes.plot([], [], color=CANSAT_RED, linewidth=5)
+      self.pattern, = self.axes.plot([], [])
+
+    king = self.population.individuals[0]
+    radiation = self.rpGetter(king)
+    maxGain = max(radiation.gainsMw)
+
+    self.profile.set_data(*cansatProfileData(maxGain, -king.groundPlaneDistance/30))
+    self.pattern.set_data(radiation.thetasRad, radiation.gainsMw)
+    fitLimits(self.axes, ys=[0, maxGain], headroom=0.1)
+
+    return [self.profile, self.pattern]
 
 
 class FitnessPlotter(IGrapherService):
@@ -111,16 +227,9 @@ class FitnessPlotter(IGrapherService):
     self.maxValues.append(population.king.fitness())
     self.sdValues.append(population.fitnessStdDev)
 
-    self.axes.clear()
-    self.axes.set_title("Fitness")
-    self.axes.grid(True)
-    self.axes.plot(
-      self.timeline, self.meanValues,
-      self.timeline, self.maxValues,
-      self.timeline, self.sdValues
-    )
-    self.axes.legend(["mean", "max", "sd"])
+    return self.series()
 
+  def series(self) -> Dict[str, List]:
     return {
       "timeline": self.timeline,
       "meanFitness": self.meanValues,
@@ -128,74 +237,181 @@ class FitnessPlotter(IGrapherService):
       "sdFitness": self.sdValues
     }
 
+  def artists(self) -> List["Artist"]:
+    return self.updateLines("Fitness", self.timeline, [self.meanValues, self.maxValues, self.sdValues], ["mean", "max", "sd"])
+
 
 class EuclideanDistancePlotter(IGrapherService):
   """
-  Mean hamming distance between population's genes plotter
+  Population diversity plotter: mean distance from the king and mean pairwise distance
+  between genes' paths (sum of their vertices' distances), entropy of rod angles
   """
+  MAX_PAIRS = 50000    # Pairwise distance is estimated on random pairs above this
+
   def __post_init__(self):
     self.timeline = []
     self.euclideanDistanceValues = []
+    self.pairwiseDistanceValues = []
+    self.angleEntropyValues = []
+    self.rng = np.random.default_rng()
   
   def plot(self, population: Population) -> Dict[str, List]:
+    config = population.config
+    startPoint = (-config.ShapeConstraints.outerDiam / 2, 0)
+    encodings, _ = encodeGenes(population.individuals + [population.king])
+    vertices = rodToVertices(encodings, startPoint)
+
     self.timeline.append(population.newbornsCounter)
-    kingX = np.array(list(map(lambda seg: seg.start.x, population.king.polychainEncoding)))
-    kingY = np.array(list(map(lambda seg: seg.start.y, population.king.polychainEncoding)))
-
-    for individual in population.individuals:
-      othersX = np.array(list(map(lambda seg: seg.start.x, individual.polychainEncoding)))
-      othersY = np.array(list(map(lambda seg: seg.start.y, individual.polychainEncoding)))
-    
-    kingNodes = np.array(list(zip(kingX, kingY)))
-    othersNodes = np.array(list(zip(othersX, othersY)))
-
-    self.euclideanDistanceValues.append(
-      np.sum(np.linalg.norm(kingNodes - othersNodes, axis=1)) / len(population.individuals)
-    )
+    self.euclideanDistanceValues.append(meanDistanceFrom(vertices[:-1], vertices[-1]))
+    self.pairwiseDistanceValues.append(meanPairwiseDistance(vertices[:-1], EuclideanDistancePlotter.MAX_PAIRS, self.rng))
+    self.angleEntropyValues.append(angleEntropy(encodings[:-1, :, 0], config.GeneEncoding.maxAngle / 2))
 
-    self.axes.clear()
-    self.axes.set_title("Distance from king")
-    self.axes.grid(True)
-    self.axes.plot(
-      self.timeline, self.euclideanDistanceValues,
-    )
+    return self.series()
 
+  def series(self) -> Dict[str, List]:
     return {
       "timeline": self.timeline,
-      "kingDistance": self.euclideanDistanceValues
+      "kingDistance": self.euclideanDistanceValues,
+      "pairwiseDistance": self.pairwiseDistanceValues,
+      "angleEntropy": self.angleEntropyValues
     }
 
+  def artists(self) -> List["Artist"]:
+    return self.updateLines(
+      "Diversity", self.timeline,
+      [self.euclideanDistanceValues, self.pairwiseDistanceValues],
+      ["from king", "pairwise"]
+    )
+
+
+class PhaseProfilePlotter(IGrapherService):
+  """
+  Exports, for every generation, wall time, calls and peak memory of the given phases
+  as recorded by the profiler (see utils.profiling) since the previous generation.
+  Values only, it doesn't draw.
+  """
+  def __init__(self, axes: "Axes", phases: List[str]):
+    self.phases = phases
+    super().__init__(axes)
+
+  def __post_init__(self):
+    self.values: Dict[str, List] = {}
+
+  def plot(self, population: Population) -> Dict[str, List]:
+    for name, value in flattenStats(population.phaseStats, self.phases).items():
+      self.values.setdefault(name, []).append(value)
+
+    return self.values
+
+  def series(self) -> Dict[str, List]:
+    return self.values
+
+
+class NecTelemetryPlotter(IGrapherService):
+  """
+  Exports, for every generation, NEC evaluation counts, failures by kind, cache
+  hits and solve time percentiles and histogram (see core.telemetry).
+  Values only, it doesn't draw.
+  """
+  def __post_init__(self):
+    self.values: Dict[str, List] = {}
+
+  def plot(self, population: Population) -> Dict[str, List]:
+    for name, value in summarize(population.necRecords).items():
+      self.values.setdefault(name, []).append(value)
+
+    return self.values
+
+  def series(self) -> Dict[str, List]:
+    return self.values
+
 
 class KilledGenesPlotter(IGrapherService):
   """
-  Number of killed  genes plotter
+  Killed genes ratio and repaired share of invalid genes plotter
   """
   def __post_init__(self):
     self.timeline = []
     self.killedGenes = []
+    self.repairedGenes = []
 
   def plot(self, population: Population) -> Dict[str, List]:
     self.timeline.append(population.newbornsCounter)
     self.killedGenes.append(population.killedGenesRatio)
+    self.repairedGenes.append(getattr(population, "repairedGenesRatio", 100.0))
 
-    self.axes.clear()
-    self.axes.set_title("Killed genes ratio")
-    self.axes.grid(True)
-    self.axes.plot(
-      self.timeline, self.killedGenes,
-    )
+    return self.series()
 
+  def series(self) -> Dict[str, List]:
     return {
       "timeline": self.timeline,
-      "killedGenes": self.killedGenes
+      "killedGenes": self.killedGenes,
+      "repairedGenes": self.repairedGenes
     }
 
+  def artists(self) -> List["Artist"]:
+    return self.updateLines("Killed and repaired genes ratio", self.timeline, [self.killedGenes, self.repairedGenes], ["killed", "repaired"])
+
 
 class WorldLiveViewer(ILiveViewService):
+  """
+  Miniatures of the whole population over their constraints, as a single
+  line collection on a grid (the constraints are drawn once)
+  """
+  PITCH = 1.2    # Cell size, in outer diameters
+
+  def __post_init__(self):
+    self.population: Population = None
+    self.edgeLen = 0
+    self.paths = None
+
   def update(self, population: Population) -> None:
     if self.itCounter % self.updatePeriod == 0:
-      self.figure.clear()
-      plotMiniatures(self.figure, population.individuals, True)
-      self.figure.show()
-
-    self.itCounter += 1
\ No newline at end of file
+      self.population = population
+
+    self.itCounter += 1
+
+  def cellCenters(self, edgeLen: int, outerDiam: float) -> np.ndarray:
+    i, j = np.divmod(np.arange(edgeLen * edgeLen), edgeLen)
+    return np.stack([j, -i], axis=1) * WorldLiveViewer.PITCH * outerDiam
+
+  def createArtists(self, edgeLen: int) -> None:
+    from matplotlib.collections import LineCollection, PatchCollection
+    from matplotlib.patches import Circle
+    from utils.amenities import CANSAT_RED
+
+    shape = self.population.config.ShapeConstraints
+    centers = self.cellCenters(edgeLen, shape.outerDiam)
+
+    self.figure.clear()
+    axes = self.figure.add_subplot()
+    axes.axis("off")
+    axes.set_aspect("equal")
+    axes.add_collection(PatchCollection([Circle(c, shape.outerDiam / 2) for c in centers], color=CANSAT_RED))
+    axes.add_collection(PatchCollection([Circle(c + [shape.centerShift, 0], shape.innerDiam / 2) for c in centers], color="#000000"))
+    self.paths = LineCollection([], linewidths=1, color="#4caf50")
+    axes.add_collection(self.paths, autolim=False)
+
+    margin = WorldLiveViewer.PITCH * shape.outerDiam / 2
+    axes.set_xlim(-margin, centers[-1][0] + margin)
+    axes.set_ylim(centers[-1][1] - margin, margin)
+    self.edgeLen = edgeLen
+
+  def artists(self) -> List["Artist"]:
+    if self.population is None:
+      return []
+
+    from utils.svg import polychainVertices
+
+    individuals = self.population.individuals
+    edgeLen = math.floor(math.sqrt(len(individuals)))
+    if edgeLen != self.edgeLen:
+      self.createArtists(edgeLen)
+
+    centers = self.cellCenters(edgeLen, self.population.config.ShapeConstraints.outerDiam)
+    self.paths.set_segments([
+      polychainVertices(gene.getCartesianCoords()) + center
+      for gene, center in zip(individuals, centers)
+    ])
+
+    return [self.paths]
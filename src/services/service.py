@@ -1,7 +1,11 @@
 from abc import ABC, abstractmethod
 
 class Service(ABC):
-  ...
+  def close(self) -> None:
+    """
+    Called once, when the simulation is over. Flush and release resources here.
+    """
+    pass
 
 
 class ServiceNotDispatched(Exception):
@@ -1,15 +1,23 @@
+import argparse
+import time
+import numpy as np
 from abc import abstractclassmethod, abstractmethod
 from heapq import merge
 from sre_constants import ANY_ALL
-from typing import List, Dict, Any
+from os.path import splitext
+from typing import List, Dict, Any, Tuple
 from services.service import Service
 from services.plotters import IGrapherService
 from core.population import Population
-from matplotlib.axes import Axes
+from utils.columns import ColumnStore
 from scipy.io import savemat
 from collections import defaultdict
 
-class AxesStub(Axes):
+class AxesStub:
+  """
+  Drop-in replacement for matplotlib's Axes, lets graphers collect their values
+  in headless runs without loading matplotlib
+  """
   def clear(self, *_):
     pass
 
@@ -19,6 +27,12 @@ class AxesStub(Axes):
   def plot(self, *_):
     pass
 
+  def set_title(self, *_):
+    pass
+
+  def legend(self, *_):
+    pass
+
 class ICollectorService(Service):
   def __init__(self, filename: str):
     self.filename = filename
@@ -42,15 +56,55 @@ class IStatService(Service):
     self.graphers.append(grapher)
     return self
 
+  def withCollector(self, collector: ICollectorService) -> Any:
+    self.collectors.append(collector)
+    return self
+
+  def collect(self, dataDict: Dict[str, List]) -> None:
+    for collector in self.collectors:
+      collector.updateData(dataDict)
+
+  def histories(self) -> List[Dict[str, List]]:
+    """
+    Series of each grapher, in order
+    """
+    return [grapher.series() for grapher in self.graphers]
+
+  def restore(self, histories: List[Dict[str, List]]) -> None:
+    """
+    Refills graphers with the histories of a previous run (see histories)
+    """
+    mergedDict = {}
+
+    for grapher, values in zip(self.graphers, histories):
+      grapher.restore(values)
+      mergedDict |= grapher.series()
+
+    self.valuesDict = mergedDict
+
+    # Collectors (e.g. aggregators) receive restored generations as if they had just been computed
+    generationsNumber = len(next(iter(mergedDict.values()), []))
+    for generation in range(generationsNumber):
+      self.collect({name: values[:generation + 1] for name, values in mergedDict.items()})
+
   @abstractmethod
   def stat(self, population: Population) -> Dict[str, List]:
     ...
 
 
 class StubStatService(IStatService):
+  """
+  Collects graphers' values without saving them
+  """
   def stat(self, population: Population) -> Dict[str, List]:
+    mergedDict = {}
+
     for grapher in self.graphers:
-      grapher.plot(population)
+      mergedDict |= grapher.plot(population)
+
+    self.valuesDict = mergedDict
+    self.collect(mergedDict)
+    return mergedDict
 
 
 class StatService(IStatService):
@@ -61,10 +115,90 @@ class StatService(IStatService):
       mergedDict |= grapher.plot(population)
 
     self.valuesDict = mergedDict
+    self.collect(mergedDict)
     savemat(self.filename, mergedDict)
     return mergedDict
 
 
+class StreamingStatService(IStatService):
+  """
+  Appends one record per generation (the last value of every grapher's series)
+  to a column store next to filename, flushing it every flushPeriod generations.
+  The .mat file is exported only on close (or on demand with export).
+  """
+  def __init__(self, filename: str, flushPeriod: int = 10):
+    super().__init__(filename)
+    self.columnsPath = splitext(filename)[0] + ".cols"
+    self.flushPeriod = flushPeriod
+    self.store: ColumnStore = None    # Opened lazily: the service may be pickled to a worker first
+    self.recordsNumber = 0
+
+  def stat(self, population: Population) -> Dict[str, List]:
+    mergedDict = {}
+
+    for grapher in self.graphers:
+      mergedDict |= grapher.plot(population)
+
+    self.valuesDict = mergedDict
+    self.collect(mergedDict)
+
+    if self.store is None:
+      self.store = ColumnStore(self.columnsPath, "w")
+
+    self.store.append(**{name: values[-1] for name, values in mergedDict.items()})
+    self.recordsNumber += 1
+    if self.recordsNumber % self.flushPeriod == 0:
+      self.store.flush()
+
+    return mergedDict
+
+  def restore(self, histories: List[Dict[str, List]]) -> None:
+    """
+    The column store is rewritten with the restored records: those of the
+    previous run past its last checkpoint are discarded
+    """
+    super().restore(histories)
+
+    self.store = ColumnStore(self.columnsPath, "w")
+    if len(self.valuesDict) > 0:
+      self.store.appendMany(**{name: np.array(values) for name, values in self.valuesDict.items()})
+    self.store.flush()
+    self.recordsNumber = len(self.store)
+
+  def export(self) -> Dict[str, np.ndarray]:
+    if self.store is not None:
+      self.store.flush()
+
+    return exportColumnsToMat(self.columnsPath, self.filename)
+
+  def close(self) -> None:
+    if self.store is None:
+      return
+
+    self.store.close()
+    self.store = None
+    exportColumnsToMat(self.columnsPath, self.filename)
+
+
+def exportColumnsToMat(columnsPath: str, matFilename: str) -> Dict[str, np.ndarray]:
+  """
+  Writes every column of a stats column store to a .mat file
+  """
+  store = ColumnStore(columnsPath)
+  values = {name: np.array(store.column(name)) for name in store.names()}
+  savemat(matFilename, values)
+
+  return values
+
+
+def lastRecord(dataDict: Dict[str, List]) -> Tuple[int, Dict[str, float]]:
+  """
+  Generation index and last value of each scalar series of a grapher values dictionary
+  """
+  generation = len(next(iter(dataDict.values()))) - 1
+  return generation, {name: float(values[-1]) for name, values in dataDict.items() if np.ndim(values[-1]) == 0}
+
+
 class StubAggregator(ICollectorService):
   def __init__(self):
     pass
@@ -73,11 +207,88 @@ class StubAggregator(ICollectorService):
     pass
 
 
+class QueueCollector(ICollectorService):
+  """
+  Forwards the last record of each generation of an instance to a (multiprocessing) queue,
+  the other end is drained by an AggregateStatService
+  """
+  def __init__(self, queue: Any, instanceNumber: int):
+    self.queue = queue
+    self.instanceNumber = instanceNumber
+
+  def updateData(self, dataDict: Dict[str, List]) -> None:
+    generation, record = lastRecord(dataDict)
+    self.queue.put((self.instanceNumber, generation, record))
+
+
 class AggregateStatService(ICollectorService):
-  def __init__(self, filename: str):
+  """
+  Online aggregation of the statistics of several instances, by generation:
+  running mean and standard deviation (Welford) and quantiles.
+  The .mat file is rewritten at most once every savePeriod seconds, so partial
+  results are available while instances are still running.
+  """
+  QUANTILES = {"Q25": 0.25, "Median": 0.5, "Q75": 0.75}
+
+  def __init__(self, filename: str, savePeriod: float = 10):
     self.filename: str = filename
-    self.dataSnapshots: dict[int, List[Dict[str, List]]] = defaultdict(list)
+    self.savePeriod = savePeriod
+    self.lastSaveTime = time.monotonic()
+    self.counts: Dict[str, List[int]] = defaultdict(list)
+    self.means: Dict[str, List[float]] = defaultdict(list)
+    self.m2s: Dict[str, List[float]] = defaultdict(list)
+    self.samples: Dict[str, List[List[float]]] = defaultdict(list)    # Few instances: exact quantiles are cheap
 
   def updateData(self, dataDict: Dict[str, List]) -> None:
-    self.dataSnapshots[dataDict['timeline'][-1]].append(dataDict.copy())
-    print(self.dataSnapshots)
+    self.addRecord(*lastRecord(dataDict))
+
+  def addRecord(self, generation: int, record: Dict[str, float]) -> None:
+    for name, value in record.items():
+      while len(self.counts[name]) <= generation:
+        self.counts[name].append(0)
+        self.means[name].append(0.0)
+        self.m2s[name].append(0.0)
+        self.samples[name].append([])
+
+      self.counts[name][generation] += 1
+      delta = value - self.means[name][generation]
+      self.means[name][generation] += delta / self.counts[name][generation]
+      self.m2s[name][generation] += delta * (value - self.means[name][generation])
+      self.samples[name][generation].append(value)
+
+    if time.monotonic() - self.lastSaveTime > self.savePeriod:
+      self.save()
+
+  def aggregate(self) -> Dict[str, np.ndarray]:
+    """
+    Means keep the series' names, other aggregates are suffixed (e.g. maxFitnessSd)
+    """
+    outStats = {}
+
+    for name, counts in self.counts.items():
+      counts = np.array(counts)
+      outStats[name] = np.array(self.means[name])
+      outStats[f"{name}Sd"] = np.sqrt(np.array(self.m2s[name]) / np.maximum(counts, 1))
+      outStats[f"{name}Count"] = counts
+      for suffix, q in AggregateStatService.QUANTILES.items():
+        outStats[f"{name}{suffix}"] = np.array([np.quantile(s, q) if s else np.nan for s in self.samples[name]])
+
+    return outStats
+
+  def save(self) -> Dict[str, np.ndarray]:
+    outStats = self.aggregate()
+    savemat(self.filename, outStats)
+    self.lastSaveTime = time.monotonic()
+
+    return outStats
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(
+    description = "Export streamed statistics (statsX.cols folder) to a .mat file"
+  )
+
+  parser.add_argument("columns", help="Column store folder", type=str)
+  parser.add_argument("mat", help="Output .mat file", type=str)
+
+  args = parser.parse_args()
+  exportColumnsToMat(args.columns, args.mat)
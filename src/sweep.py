@@ -0,0 +1,235 @@
+"""
+Hyperparameter sweep over config.yaml keys.
+
+Runs repeated, seeded, headless simulations for every point of a grid (or
+random search) described in a spec file (see sweep.yaml), on a process pool.
+Longest jobs are scheduled first and jobs whose king fitness falls clearly
+behind their peers at a checkpoint are terminated early.
+"""
+import argparse, logging
+import csv, time, random
+import itertools
+import numpy as np
+import yaml
+from dataclasses import dataclass
+from typing import Dict, List, Any
+from multiprocessing import Pool, Manager
+from core.config import Config
+from core.simulation import Simulation
+from core.optimizers import createPopulation
+from services.statistics import StubStatService, AxesStub
+from services.plotters import FitnessPlotter, KilledGenesPlotter, EuclideanDistancePlotter
+
+CONFIG_FILENAME = "config.yaml"
+
+@dataclass
+class SweepJob:
+  point: Dict[str, Any]
+  seed: int
+  config: Config
+  generations: int
+  checkInterval: int
+  targetFitness: float = None    # King fitness whose NEC evaluations to reach are counted
+
+  def cost(self) -> float:
+    """
+    Rough estimate of the job duration, used to schedule longest jobs first
+    """
+    return self.config.GeneticAlgoTuning.populationSize * self.config.GeneEncoding.segmentsNumber * self.generations
+
+
+class Pruner:
+  """
+  Shared scoreboard of king fitness by generation. A job is clearly losing
+  when, at a checkpoint, its score is below the given quantile of its peers'.
+  """
+  def __init__(self, manager: Manager, quantile: float, minPeers: int):
+    self.scores = manager.dict()
+    self.lock = manager.Lock()
+    self.quantile = quantile
+    self.minPeers = minPeers
+
+  def shouldStop(self, generation: int, score: float) -> bool:
+    with self.lock:
+      peers = self.scores.get(generation, [])
+      self.scores[generation] = peers + [score]
+
+    return len(peers) >= self.minPeers and score < np.quantile(peers, self.quantile)
+
+
+def gridPoints(parameters: Dict[str, List]) -> List[Dict[str, Any]]:
+  keys = list(parameters.keys())
+  return [dict(zip(keys, values)) for values in itertools.product(*parameters.values())]
+
+def randomPoints(parameters: Dict[str, Any], samples: int, rng: np.random.Generator) -> List[Dict[str, Any]]:
+  """
+  Lists are sampled uniformly, {min, max} ranges are sampled uniformly (as integers if both bounds are)
+  """
+  points = []
+
+  for _ in range(samples):
+    point = {}
+    for key, domain in parameters.items():
+      if isinstance(domain, dict):
+        if isinstance(domain["min"], int) and isinstance(domain["max"], int):
+          point[key] = int(rng.integers(domain["min"], domain["max"] + 1))
+        else:
+          point[key] = float(rng.uniform(domain["min"], domain["max"]))
+      else:
+        point[key] = domain[rng.integers(len(domain))]
+    points.append(point)
+
+  return points
+
+def buildJobs(spec: Dict[str, Any], baseConfig: Config) -> List[SweepJob]:
+  if spec.get("mode", "grid") == "random":
+    points = randomPoints(spec["parameters"], spec["samples"], np.random.default_rng(spec.get("seed", 0)))
+  else:
+    points = gridPoints(spec["parameters"])
+
+  generations = spec.get("generations", baseConfig.GeneticAlgoTuning.iterationsNumber)
+  checkInterval = spec.get("check_interval", max(generations // 5, 1))
+  jobs = [
+    SweepJob(point, seed, baseConfig.withOverrides(point), generations, checkInterval, spec.get("target_fitness"))
+    for point in points
+    for seed in range(spec.get("seeds", 1))
+  ]
+
+  return sorted(jobs, key=SweepJob.cost, reverse=True)
+
+def _initWorker(pruner: Pruner) -> None:
+  global _pruner
+  _pruner = pruner
+  logging.getLogger().setLevel(logging.ERROR)    # Generation logs of parallel runs would be unreadable
+
+def runJob(job: SweepJob) -> Dict[str, Any]:
+  random.seed(job.seed)
+  np.random.seed(job.seed)
+
+  statService = StubStatService("").withGraphers(
+    FitnessPlotter(AxesStub()),
+    KilledGenesPlotter(AxesStub()),
+    EuclideanDistancePlotter(AxesStub())
+  )
+  sim = Simulation(
+    createPopulation(job.config),
+    job.config.GeneticAlgoTuning.useNiches,
+    job.config.GeneticAlgoTuning.nichesActivationThreshold
+  ).withService(statService)
+
+  row = {**job.point, "seed": job.seed, "status": "done", "generations": 0, "evaluationsToTarget": None}
+  startTime = time.perf_counter()
+  try:
+    for generation in range(1, job.generations + 1):
+      try:
+        sim.run()
+      except StopIteration:
+        break    # Stopped by run control (iterations_number, budgets, stagnation)
+      row["generations"] = generation
+      if job.targetFitness is not None and row["evaluationsToTarget"] is None and sim.population.king.fitnessCached >= job.targetFitness:
+        row["evaluationsToTarget"] = sim.population.necEvaluations
+
+      isCheckpoint = generation % job.checkInterval == 0 and generation < job.generations
+      if isCheckpoint and _pruner.shouldStop(generation, statService.valuesDict["maxFitness"][-1]):
+        row["status"] = "pruned"
+        break
+  except Exception as e:
+    logging.error(f"Job {job.point} (seed {job.seed}) failed: {e!r}")
+    row["status"] = "failed"
+
+  values = statService.valuesDict
+  row["wallTime"] = time.perf_counter() - startTime
+  row["necEvaluations"] = sim.population.necEvaluations
+  row["maxFitness"] = values["maxFitness"][-1] if values else float("nan")
+  row["meanFitness"] = values["meanFitness"][-1] if values else float("nan")
+  row["killedGenes"] = np.mean(values["killedGenes"]) if values else float("nan")
+  row["repairedGenes"] = np.mean(values["repairedGenes"]) if values else float("nan")
+  row["kingDistance"] = values["kingDistance"][-1] if values else float("nan")
+  row["pairwiseDistance"] = values["pairwiseDistance"][-1] if values else float("nan")
+  row["angleEntropy"] = values["angleEntropy"][-1] if values else float("nan")
+
+  return row
+
+def summarize(rows: List[Dict[str, Any]], keys: List[str]) -> List[Dict[str, Any]]:
+  """
+  One line per point: king fitness mean and standard deviation over seeds that weren't pruned
+  """
+  groups: Dict[tuple, List[Dict[str, Any]]] = {}
+  for row in rows:
+    groups.setdefault(tuple(row[k] for k in keys), []).append(row)
+
+  summary = []
+  for values, group in groups.items():
+    completed = [r["maxFitness"] for r in group if r["status"] == "done"]
+    reached = [r["evaluationsToTarget"] for r in group if r["evaluationsToTarget"] is not None]
+    summary.append({
+      **dict(zip(keys, values)),
+      "runs": len(group),
+      "completed": len(completed),
+      "maxFitnessMean": np.mean(completed) if completed else float("nan"),
+      "maxFitnessSd": np.std(completed) if completed else float("nan"),
+      "killedGenes": np.mean([r["killedGenes"] for r in group]),
+      "repairedGenes": np.mean([r["repairedGenes"] for r in group]),
+      "reachedTarget": len(reached),
+      "evaluationsToTarget": float(np.median(reached)) if reached else float("nan")
+    })
+
+  return sorted(summary, key=lambda s: s["maxFitnessMean"] if s["completed"] else float("-inf"), reverse=True)
+
+def writeTable(filename: str, rows: List[Dict[str, Any]]) -> None:
+  with open(filename, "w", newline="") as f:
+    writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+    writer.writeheader()
+    writer.writerows(rows)
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(
+    description = "Planar evolved antenna hyperparameter sweep"
+  )
+
+  parser.add_argument(
+    "spec", help="Sweep specification (yaml)",
+    type=str
+  )
+
+  parser.add_argument(
+    "-o", "--output", help="Output csv table, one row per run. Summary is written next to it.",
+    type=str, default="sweep.csv"
+  )
+
+  parser.add_argument(
+    "-j", "--jobs", help="Number of parallel processes",
+    type=int, default=None
+  )
+
+  args = parser.parse_args()
+
+  logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(levelname)s: %(message)s",
+    datefmt="%H:%M:%S"
+  )
+
+  with open(args.spec) as f:
+    spec = yaml.safe_load(f)
+
+  jobs = buildJobs(spec, Config.fromFile(CONFIG_FILENAME))
+  logging.info(f"{len(jobs)} runs scheduled")
+
+  rows = []
+  with Manager() as manager:
+    pruning = spec.get("pruning", {})
+    pruner = Pruner(manager, pruning.get("quantile", 0.25), pruning.get("min_peers", 4))
+
+    with Pool(args.jobs, initializer=_initWorker, initargs=(pruner,)) as pool:
+      for row in pool.imap_unordered(runJob, jobs, chunksize=1):
+        rows.append(row)
+        logging.info(f"[{len(rows)}/{len(jobs)}] {row}")
+
+  writeTable(args.output, rows)
+
+  summary = summarize(rows, list(spec["parameters"].keys()))
+  writeTable(args.output.replace(".csv", "") + "_summary.csv", summary)
+  for line in summary:
+    print(", ".join(f"{k}={v:.4g}" if isinstance(v, float) else f"{k}={v}" for k, v in line.items()))
@@ -1 +1 @@
-__all__ = ["geometry", "amenities", "stats"]
\ No newline at end of file
+__all__ = ["geometry", "amenities", "stats", "columns", "svg", "profiling", "archive"]
\ No newline at end of file
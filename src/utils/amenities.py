@@ -11,21 +11,27 @@ from core.gene import Gene
 
 CANSAT_RED = '#ffcdd2'
 
-def plotCansatBottomProfile(axes: plt.Axes):
+def plotCansatBottomProfile(axes: plt.Axes, config: Config):
   SAFE_MARGIN = 0.05
-  outerRadius = Config.ShapeConstraints.outerDiam / 2
+  outerRadius = config.ShapeConstraints.outerDiam / 2
   outerCircle = plt.Circle((0, 0), outerRadius, color=CANSAT_RED)
   axes.set_xlim((-outerRadius - SAFE_MARGIN*outerRadius, outerRadius + SAFE_MARGIN * outerRadius))
   axes.set_ylim((-outerRadius - SAFE_MARGIN*outerRadius, outerRadius + SAFE_MARGIN * outerRadius))
   axes.add_patch(outerCircle)
   
-  innerRadius = Config.ShapeConstraints.innerDiam / 2
-  innerCircle = plt.Circle((Config.ShapeConstraints.centerShift, 0), innerRadius, color='#000000')
+  innerRadius = config.ShapeConstraints.innerDiam / 2
+  innerCircle = plt.Circle((config.ShapeConstraints.centerShift, 0), innerRadius, color='#000000')
   axes.add_patch(innerCircle)
 
-def plotCansatProfile(axes: plt.Axes, len: float, downwardOffset: float):
+def cansatProfileData(len: float, downwardOffset: float) -> Tuple[List[float], List[float]]:
+  """
+  Polar (thetas, radii) of the CanSat profile line
+  """
   alpha = np.arcsin(downwardOffset / len)
-  axes.plot([alpha, np.pi - alpha], [len, len], color=CANSAT_RED, linewidth=5)
+  return [alpha, np.pi - alpha], [len, len]
+
+def plotCansatProfile(axes: plt.Axes, len: float, downwardOffset: float):
+  axes.plot(*cansatProfileData(len, downwardOffset), color=CANSAT_RED, linewidth=5)
 
 def plotAntennaPath(axes: plt.Axes, polychain: List[Segment], color: str = "#4caf50", width: int = 3):
   lines = [line.toList() for line in polychain]
@@ -41,7 +47,8 @@ def plotPathAndRad(
       radiationSagittal: RadiationPattern,
       radiationFrontal: RadiationPattern,
       groundPlaneDistance: float,
-      axes: Tuple[plt.Axes, plt.Axes, plt.Axes]
+      axes: Tuple[plt.Axes, plt.Axes, plt.Axes],
+      config: Config
     ) -> None:
     ax, radiSag, radiFront = axes
     ax.axis("equal")
@@ -49,7 +56,7 @@ def plotPathAndRad(
     radiSag.clear()
     radiFront.clear()
 
-    plotCansatBottomProfile(ax)
+    plotCansatBottomProfile(ax, config)
     plotAntennaPath(ax, polychain)
 
     plotCansatProfile(radiSag, max(radiationSagittal.gainsMw), -groundPlaneDistance/30)
@@ -70,7 +77,7 @@ def plotMiniatures(fig: Figure, generation: List[Gene], doPlotConstraints: bool)
       axes[i][j].axis("equal")
       axes[i][j].axis("off")
       if doPlotConstraints:
-        plotCansatBottomProfile(axes[i][j])
+        plotCansatBottomProfile(axes[i][j], generation[idx].config)
         pathColor = "#4caf50"
       else:
         pathColor = "#000000"
@@ -81,3 +88,4 @@ def saveMiniaturesSvg(stream: IO[Any], generation: List[Gene], doPlotConstraints
   fig = plt.figure()
   plotMiniatures(fig, generation, doPlotConstraints)
   fig.savefig(stream, format="svg")
+  plt.close(fig)
@@ -1,6 +1,281 @@
+"""
+Seeded microbenchmarks of the hot paths: geometry, selection, sorting and NEC.
+
+  python3 -m utils.benchmark -o bench.json                  # run and save results
+  python3 -m utils.benchmark -b baseline.json               # compare with a baseline
+  python3 -m utils.benchmark -b baseline.json --save-baseline
+
+Results are per call timings (median and min over repeats) plus machine
+metadata. When compared with a baseline, cases whose median got slower by
+more than the threshold are flagged and the exit status is 1.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import timeit
+import numpy as np
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Any
+from core.config import Config
+from core.gene import Gene
+from core.population import Population
+from core.evaluation import encodeGenes
+from core.repair import repairEncodings
+from core.initialization import randomValidEncodings
+from core.pareto import OBJECTIVES, nonDominatedRanks, crowdingDistances
+from rf.nec_analysis import NecAnalysis
+from rf.radiation import RadiationPattern
+from utils.geometry import (
+  PolarCoord, Point, rodToPolar, polarToPolychain,
+  isSelfIntersectingPath, doesPathIntersectCircle
+)
+
+CONFIG_FILENAME = "config.yaml"
+
+# name -> setup(config) returning the callable to time. Setups run right after seeding.
+CASES: Dict[str, Callable[[Config], Callable[[], Any]]] = {}
+
+def case(name: str):
+  def register(setup: Callable[[Config], Callable[[], Any]]):
+    CASES[name] = setup
+    return setup
+
+  return register
+
+def randomRod(config: Config, segmentsNumber: int) -> List[PolarCoord]:
+  """
+  Rod encoding drawn as in gene initialization, with any number of segments
+  """
+  maxAngle = config.GeneEncoding.maxAngle
+  return [
+    PolarCoord(np.random.uniform(-maxAngle / 2, maxAngle / 2), np.random.uniform(config.GeneEncoding.minSegmentLen, config.GeneEncoding.maxSegmentLen))
+    for _ in range(segmentsNumber)
+  ]
+
+def randomPolychain(config: Config, segmentsNumber: int):
+  return polarToPolychain(Point(-config.ShapeConstraints.outerDiam / 2, 0), rodToPolar(randomRod(config, segmentsNumber)))
+
+def nonIntersectingPolychain(config: Config, segmentsNumber: int):
+  """
+  Path without self intersections, the worst case of isSelfIntersectingPath (every pair is checked):
+  a valid gene's when genes can have segmentsNumber segments, a staircase (every segment
+  heading up and right, so that no two segments overlap) otherwise
+  """
+  startPoint = Point(-config.ShapeConstraints.outerDiam / 2, 0)
+  if segmentsNumber == config.GeneEncoding.segmentsNumber:
+    encoding = randomValidEncodings(config, 1)[0]
+    return polarToPolychain(startPoint, rodToPolar([PolarCoord(float(a), float(l)) for a, l in encoding]))
+
+  return polarToPolychain(startPoint, [
+    PolarCoord(np.random.uniform(0.1, np.pi / 2 - 0.1), np.random.uniform(config.GeneEncoding.minSegmentLen, config.GeneEncoding.maxSegmentLen))
+    for _ in range(segmentsNumber)
+  ])
+
+def validGene(config: Config) -> Gene:
+  while True:
+    gene = Gene(config)
+    if gene.isValid() and gene.evaluate() > float("-inf"):
+      return gene
+
+def populationWithFitness(config: Config, size: int) -> Population:
+  """
+  A population whose fitness is already known (no NEC involved)
+  """
+  population = Population(config, size)
+  for gene in population.individuals:
+    gene.fitnessCached = np.random.uniform(-1, 3)
+    gene.evaluated = True
+
+  return population
+
+
+@case("rodToPolar+polarToPolychain N=20")
+def _(config: Config):
+  rod = randomRod(config, 20)
+  startPoint = Point(-config.ShapeConstraints.outerDiam / 2, 0)
+  return lambda: polarToPolychain(startPoint, rodToPolar(rod))
+
+for _segments in (20, 100, 500):
+  @case(f"isSelfIntersectingPath N={_segments}")
+  def _(config: Config, segmentsNumber: int = _segments):
+    polychain = nonIntersectingPolychain(config, segmentsNumber)
+    return lambda: isSelfIntersectingPath(polychain)
+
+@case("doesPathIntersectCircle N=20")
+def _(config: Config):
+  polychain = randomPolychain(config, 20)
+  center = Point(config.ShapeConstraints.centerShift, 0)
+  return lambda: doesPathIntersectCircle(polychain, center, config.ShapeConstraints.innerDiam / 2)
+
+for _size in (300, 3000):
+  @case(f"extractParentFitness P={_size}")
+  def _(config: Config, size: int = _size):
+    return populationWithFitness(config, size).extractParentFitness
+
+@case("fight P=600")
+def _(config: Config):
+  population = populationWithFitness(config, 600)    # Survivors are a share of populationSize
+  individuals = population.individuals
+
+  def fight():
+    population.individuals = individuals
+    population.fight()
+
+  return fight
+
+@case("repairEncodings P=300")
+def _(config: Config):
+  encodings, _ = encodeGenes(Population(config, 300).individuals)    # Random genes, mostly invalid
+  return lambda: repairEncodings(config, encodings, config.GeneticAlgoTuning.repairRounds)
+
+@case("randomValidEncodings P=300")
+def _(config: Config):
+  return lambda: randomValidEncodings(config, 300)
+
+@case("nonDominatedRanks + crowdingDistances P=3000")
+def _(config: Config):
+  objectives = np.random.random((3000, len(OBJECTIVES)))    # Random points: many fronts
+
+  def rank():
+    crowdingDistances(objectives, nonDominatedRanks(objectives))
+
+  return rank
+
+@case("RadiationPattern.fromNecContext")
+def _(config: Config):
+  gene = validGene(config)
+  analysis = NecAnalysis(gene, config.ShapeConstraints.targetFreq).__enter__()    # Context kept alive for the whole run
+  analysis.addInfiniteGroundPlane()
+  analysis.runExcitation()
+  analysis.computeRadiationPattern(Gene.SAGITTAL_RP_EVALUATIONS)
+  evaluations = NecAnalysis.patternEvaluations(Gene.SAGITTAL_RP_EVALUATIONS)
+
+  return lambda: RadiationPattern.fromNecContext(analysis.getNecContext(), evaluations)
+
+@case("Gene.fitness NEC solve")
+def _(config: Config):
+  return validGene(config).evaluate
+
+
+def measure(function: Callable[[], Any], minTime: float, repeats: int) -> Dict[str, float]:
+  """
+  Per call timings: loops are calibrated so that each repeat lasts at least minTime
+  """
+  timer = timeit.Timer(function)
+  loops = 1
+  while timer.timeit(loops) < minTime:
+    loops *= 2 if loops < 1000 else 10
+
+  times = np.array(timer.repeat(repeats, loops)) / loops
+  return {"median": float(np.median(times)), "min": float(times.min()), "loops": loops, "repeats": repeats}
+
+def machineMetadata() -> Dict[str, Any]:
+  try:
+    commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, timeout=5).stdout.strip()
+  except OSError:
+    commit = ""
+
+  return {
+    "timestamp": datetime.now(timezone.utc).isoformat(),
+    "platform": platform.platform(),
+    "machine": platform.machine(),
+    "processor": platform.processor(),
+    "cpus": os.cpu_count(),
+    "python": platform.python_version(),
+    "numpy": np.__version__,
+    "commit": commit
+  }
+
+def runSuite(config: Config, seed: int = 0, minTime: float = 0.2, repeats: int = 5, select: str = "") -> Dict[str, Any]:
+  results = {}
+
+  for name, setup in CASES.items():
+    if select not in name:
+      continue
+
+    random.seed(seed)
+    np.random.seed(seed)
+    results[name] = measure(setup(config), minTime, repeats)
+    print(f"{name:40s} {results[name]['median'] * 1e6:12.2f} us", file=sys.stderr)
+
+  return {"metadata": machineMetadata(), "seed": seed, "results": results}
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[Dict[str, Any]]:
+  """
+  One row per case: ratio of medians (current / baseline) and status
+  (regression, improvement, ok, new)
+  """
+  rows = []
+
+  for name, current in results["results"].items():
+    reference = baseline["results"].get(name)
+    row = {"case": name, "median": current["median"], "baseline": None, "ratio": None, "status": "new"}
+
+    if reference is not None:
+      ratio = current["median"] / reference["median"]
+      row.update(baseline=reference["median"], ratio=ratio, status="ok")
+      if ratio > 1 + threshold:
+        row["status"] = "regression"
+      elif ratio < 1 / (1 + threshold):
+        row["status"] = "improvement"
+
+    rows.append(row)
+
+  return rows
+
+def formatComparison(rows: List[Dict[str, Any]]) -> str:
+  lines = [f"{'case':40s} {'baseline (us)':>14s} {'current (us)':>14s} {'ratio':>7s}  status"]
+  for row in rows:
+    baseline = f"{row['baseline'] * 1e6:14.2f}" if row["baseline"] is not None else f"{'-':>14s}"
+    ratio = f"{row['ratio']:7.2f}" if row["ratio"] is not None else f"{'-':>7s}"
+    lines.append(f"{row['case']:40s} {baseline} {row['median'] * 1e6:14.2f} {ratio}  {row['status']}")
+
+  return "\n".join(lines)
+
+
 class Benchmark:
   """
   A container of Simulations that runs them simultaneously, in order to
   gather data about their relative performance.
   """
-  ...
\ No newline at end of file
+  ...
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(
+    description = "Planar evolved antenna microbenchmarks"
+  )
+
+  parser.add_argument("-o", "--output", help="Results file (json)", type=str, default=None)
+  parser.add_argument("-b", "--baseline", help="Baseline results file (json) to compare with", type=str, default=None)
+  parser.add_argument("--save-baseline", help="Overwrite the baseline with these results", default=False, action="store_true")
+  parser.add_argument("-t", "--threshold", help="Relative slowdown flagged as a regression", type=float, default=0.2)
+  parser.add_argument("-k", "--select", help="Run only cases whose name contains this string", type=str, default="")
+  parser.add_argument("-s", "--seed", type=int, default=0)
+  parser.add_argument("--min-time", help="Minimum duration of each repeat (s)", type=float, default=0.2)
+  parser.add_argument("--repeats", type=int, default=5)
+
+  args = parser.parse_args()
+
+  results = runSuite(Config.fromFile(CONFIG_FILENAME), args.seed, args.min_time, args.repeats, args.select)
+
+  if args.output:
+    with open(args.output, "w") as f:
+      json.dump(results, f, indent=2)
+
+  regressions = []
+  if args.baseline and os.path.exists(args.baseline) and not args.save_baseline:
+    with open(args.baseline) as f:
+      rows = compare(results, json.load(f), args.threshold)
+    print(formatComparison(rows))
+    regressions = [r for r in rows if r["status"] == "regression"]
+
+  if args.baseline and args.save_baseline:
+    with open(args.baseline, "w") as f:
+      json.dump(results, f, indent=2)
+
+  sys.exit(1 if regressions else 0)
@@ -0,0 +1,156 @@
+import os
+import json
+import numpy as np
+from os.path import join, exists
+from typing import Dict, List, Tuple
+
+class ColumnStore:
+    """
+    Append-only columnar storage: a directory with one raw binary file per
+    column (rows of fixed shape and dtype) and a meta.json holding dtypes,
+    row shapes and the number of committed rows.
+
+    Files are preallocated and grown geometrically, rows are written through
+    np.memmap. Only flushed rows are visible to readers, so a killed writer
+    leaves a consistent store behind.
+    """
+    META_FILENAME = "meta.json"
+
+    def __init__(self, path: str, mode: str = "r", initialCapacity: int = 1024):
+        """
+        mode is "r" (read only), "w" (truncate) or "a" (append to existing columns)
+        """
+        self.path = path
+        self.mode = mode
+        self.initialCapacity = initialCapacity
+        self.length = 0
+        self.capacity = 0
+        self.columns: Dict[str, Tuple[str, Tuple[int, ...]]] = {}    # name -> (dtype, row shape)
+        self.maps: Dict[str, np.memmap] = {}
+
+        if mode == "w":
+            os.makedirs(path, exist_ok=True)
+            for name in os.listdir(path):
+                os.remove(join(path, name))
+            self.writeMeta()
+        elif exists(join(path, ColumnStore.META_FILENAME)):
+            with open(join(path, ColumnStore.META_FILENAME)) as f:
+                meta = json.load(f)
+            self.length = meta["length"]
+            self.columns = {name: (dtype, tuple(shape)) for name, (dtype, shape) in meta["columns"].items()}
+            self.capacity = self.length
+        elif mode == "a":
+            os.makedirs(path, exist_ok=True)
+            self.writeMeta()
+        else:
+            raise FileNotFoundError(f"No column store in {path}")
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def columnFilename(self, name: str) -> str:
+        return join(self.path, f"{name}.bin")
+
+    def rowBytes(self, name: str) -> int:
+        dtype, shape = self.columns[name]
+        return np.dtype(dtype).itemsize * int(np.prod(shape))
+
+    def names(self) -> List[str]:
+        return list(self.columns.keys())
+
+    def writeMeta(self) -> None:
+        meta = {
+            "length": self.length,
+            "columns": {name: [dtype, list(shape)] for name, (dtype, shape) in self.columns.items()}
+        }
+
+        # Atomic replace, readers never see a partially written meta
+        tmpFilename = join(self.path, ColumnStore.META_FILENAME + ".tmp")
+        with open(tmpFilename, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmpFilename, join(self.path, ColumnStore.META_FILENAME))
+
+    def addColumn(self, name: str, dtype: np.dtype, shape: Tuple[int, ...]) -> None:
+        if self.length > 0:
+            raise ValueError(f"Can't add column {name} to a non-empty store")
+
+        self.columns[name] = (np.dtype(dtype).str, tuple(shape))
+        open(self.columnFilename(name), "wb").close()
+        self.resizeColumn(name, self.capacity)
+
+    def resizeColumn(self, name: str, capacity: int) -> None:
+        self.maps.pop(name, None)
+        with open(self.columnFilename(name), "r+b") as f:
+            f.truncate(capacity * self.rowBytes(name))
+
+        if capacity > 0:
+            dtype, shape = self.columns[name]
+            self.maps[name] = np.memmap(self.columnFilename(name), dtype=dtype, mode="r+", shape=(capacity, *shape))
+
+    def reserve(self, rows: int) -> None:
+        if rows <= self.capacity:
+            return
+
+        newCapacity = max(rows, 2 * self.capacity, self.initialCapacity)
+        for name in self.columns:
+            self.resizeColumn(name, newCapacity)
+        self.capacity = newCapacity
+
+    def appendMany(self, **arrays: np.ndarray) -> None:
+        """
+        Appends a batch of rows, every column receiving the same number of them
+        """
+        if self.mode == "r":
+            raise IOError("Column store opened read only")
+
+        arrays = {name: np.asarray(values) for name, values in arrays.items()}
+        for name, values in arrays.items():
+            if name not in self.columns:
+                self.addColumn(name, values.dtype, values.shape[1:])
+
+        rowsNumber = len(next(iter(arrays.values())))
+        self.reserve(self.length + rowsNumber)
+
+        for name, values in arrays.items():
+            self.maps[name][self.length : self.length + rowsNumber] = values
+        self.length += rowsNumber
+
+    def append(self, **values) -> None:
+        """
+        Appends a single row
+        """
+        self.appendMany(**{name: np.asarray(value)[np.newaxis] for name, value in values.items()})
+
+    def flush(self) -> None:
+        for memmap in self.maps.values():
+            memmap.flush()
+        self.writeMeta()
+
+    def column(self, name: str) -> np.ndarray:
+        """
+        Read only view of the committed rows of a column (nothing is loaded until sliced)
+        """
+        if name in self.maps:
+            return self.maps[name][:self.length]
+
+        dtype, shape = self.columns[name]
+        if self.length == 0:
+            return np.empty((0, *shape), dtype=dtype)
+
+        return np.memmap(self.columnFilename(name), dtype=dtype, mode="r", shape=(self.length, *shape))
+
+    def close(self) -> None:
+        if self.mode == "r":
+            return
+
+        self.flush()
+        for name in self.columns:
+            self.resizeColumn(name, self.length)    # Drop the preallocated tail
+        self.capacity = self.length
+        self.maps.clear()
@@ -1,3 +1,4 @@
+import math
 import numpy as np
 from typing import List, Tuple
 from itertools import tee
@@ -70,16 +71,35 @@ def polarToPolychain(startPoint: Point, polarCoords: List[PolarCoord]) -> List[S
 
     p1 = startPoint
     for rc in polarCoords:
-        p2 = p1 + Point(*polarToCart(rc.distance, rc.angle))
+        dx, dy = polarToCart(rc.distance, rc.angle)
+        p2 = Point(p1.x + dx, p1.y + dy)
         segments.append(Segment(p1, p2))
         p1 = p2
     
     return segments
 
+def rodToVertices(encodings: np.ndarray, startPoint: Tuple[float, float]) -> np.ndarray:
+    """
+    Vectorized rodToPolar + polarToPolychain: (P, N, 2) rod encodings (angle, length)
+    to the (P, N+1, 2) cartesian vertices of their paths
+    """
+    angles = np.cumsum(encodings[..., 0], axis=-1)
+    lengths = encodings[..., 1]
+
+    # Coordinates are accumulated in place, without stacking steps
+    vertices = np.empty((*encodings.shape[:-2], encodings.shape[-2] + 1, 2))
+    vertices[..., 0, :] = startPoint
+    np.cumsum(lengths * np.cos(angles), axis=-1, out=vertices[..., 1:, 0])
+    np.cumsum(lengths * np.sin(angles), axis=-1, out=vertices[..., 1:, 1])
+    vertices[..., 1:, :] += startPoint
+
+    return vertices
+
 def polarToCart(distance: float, angle: float) -> Tuple:
+    # Scalars only: math is much faster than numpy on them
     return (
-        np.cos(angle) * distance,
-        np.sin(angle) * distance
+        math.cos(angle) * distance,
+        math.sin(angle) * distance
     )
 
 def isSelfIntersectingPath(polychain: List[Segment]) -> bool:
@@ -141,6 +161,57 @@ def doesPathIntersectCircle(polychain: List[Segment], center: Point, radius: flo
     
     return False
 
+def intersectingIntervals(a: Tuple[np.ndarray, np.ndarray], b: Tuple[np.ndarray, np.ndarray]) -> np.ndarray:
+    """
+    Vectorized areIntersectingIntervals, interval ends needn't be sorted
+    """
+    a1, a2 = np.minimum(*a), np.maximum(*a)
+    b1, b2 = np.minimum(*b), np.maximum(*b)
+
+    return (
+        ((a1 < b1) & (b1 < a2)) |
+        ((a1 < b2) & (b2 < a2)) |
+        ((b1 < a1) & (a1 < b2)) |
+        ((b1 < a2) & (a2 < b2))
+    )
+
+def intersectingSegmentPairs(vertices: np.ndarray) -> np.ndarray:
+    """
+    Vectorized areIntersectingSegments between every pair of segments of (P, N+1, 2) paths:
+    (P, N, N) mask, true at [i, j] when segment i intersects a later segment j
+    """
+    starts, ends = vertices[..., :-1, np.newaxis, :], vertices[..., 1:, np.newaxis, :]
+    others = (vertices[..., np.newaxis, :-1, :], vertices[..., np.newaxis, 1:, :])
+    pairs = intersectingIntervals((starts[..., 0], ends[..., 0]), (others[0][..., 0], others[1][..., 0])) & \
+        intersectingIntervals((starts[..., 1], ends[..., 1]), (others[0][..., 1], others[1][..., 1]))
+
+    pairs &= np.triu(np.ones(pairs.shape[-2:], dtype=bool), k=1)    # Cheaper than np.triu on the whole batch
+    return pairs
+
+def segmentsCrossingCircle(vertices: np.ndarray, center: Tuple[float, float], radius: float) -> np.ndarray:
+    """
+    Vectorized doesPathIntersectCircle (same square approximation), per segment: (P, N) mask
+    """
+    return intersectingIntervals((vertices[..., :-1, 0], vertices[..., 1:, 0]), (center[0] - radius, center[0] + radius)) & \
+        intersectingIntervals((vertices[..., :-1, 1], vertices[..., 1:, 1]), (center[1] - radius, center[1] + radius))
+
+def segmentsOutOfCircle(vertices: np.ndarray, radius: float) -> np.ndarray:
+    """
+    Vectorized isPathInCircle (circle centered in the origin), per segment: (P, N) mask of segments ending outside
+    """
+    return (vertices[..., 1:, :]**2).sum(axis=-1) > radius**2
+
+def validPathsMask(vertices: np.ndarray, constraints: Config.ShapeConstraints) -> np.ndarray:
+    """
+    Vectorized Gene.isValid of (P, N+1, 2) paths: (P,) mask.
+    Cheaper checks come first, segment pairs are only checked on the paths passing them.
+    """
+    valid = ~segmentsOutOfCircle(vertices, constraints.outerDiam / 2).any(axis=-1)
+    valid[valid] = ~segmentsCrossingCircle(vertices[valid], (constraints.centerShift, 0), constraints.innerDiam / 2).any(axis=-1)
+    valid[valid] = ~intersectingSegmentPairs(vertices[valid]).any(axis=(-2, -1))
+
+    return valid
+
 def randomPointsInsideCircle(numberOfPoints: int, circleRadius: float) -> np.ndarray[Tuple]:
     x = np.random.uniform(-circleRadius, circleRadius, numberOfPoints)
     x = np.sort(x)
@@ -150,15 +221,16 @@ def randomPointsInsideCircle(numberOfPoints: int, circleRadius: float) -> np.nda
 
     return points
 
-def randomPointsRod(config: Config.GeneEncoding) -> np.ndarray[Tuple]:
-    lengths = np.random.uniform(config.minSegmentLen, config.maxSegmentLen, config.segmentsNumber)
-    angles = np.random.uniform(-np.pi/config.segmentsNumber, np.pi/config.segmentsNumber, config.segmentsNumber)
+def randomRodEncodings(config: Config.GeneEncoding, size: int, maxAngle: float, angleBias: float = 0) -> np.ndarray:
+    """
+    (size, N, 2) random rod encodings: angles uniform in angleBias +- maxAngle, lengths uniform within bounds
+    """
+    angles = np.random.uniform(angleBias - maxAngle, angleBias + maxAngle, (size, config.segmentsNumber))
+    lengths = np.random.uniform(config.minSegmentLen, config.maxSegmentLen, (size, config.segmentsNumber))
 
-    rodEncoding = list(zip(angles, lengths))
-    rodEncoding = [PolarCoord(a, l) for (a, l) in rodEncoding]
+    return np.stack([angles, lengths], axis=-1)
 
-    polychain = polarToPolychain(Point(-33, 0), rodToPolar(rodEncoding))    #TODO: extract -33 as parameter
-
-    points = polychainToCartesian(polychain)
+def randomPointsRod(config: Config.GeneEncoding) -> np.ndarray[Tuple]:
+    encoding = randomRodEncodings(config, 1, np.pi/config.segmentsNumber)[0]
 
-    return np.array([(p.x, p.y) for p in points])
\ No newline at end of file
+    return rodToVertices(encoding, (-33, 0))    #TODO: extract -33 as parameter
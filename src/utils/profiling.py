@@ -0,0 +1,169 @@
+"""
+Low-overhead instrumentation of the generation loop.
+
+Code is instrumented once with the module-wide PROFILER:
+
+    with PROFILER.phase("crossover"):
+        ...
+    PROFILER.count("isValid")
+
+While the profiler is disabled (the default) phase() returns a shared no-op
+context manager and count() returns immediately. Once enabled, it accumulates
+wall time, calls and (with trackMemory) tracemalloc peak memory of every
+phase until collect() is called, usually once per generation. A single
+generation can also be captured with cProfile and tracemalloc.
+"""
+import cProfile
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from os.path import join
+from typing import Dict, List, ContextManager
+
+NULL_PHASE = nullcontext()
+
+# Phases of the generation loop, services are timed as service<ClassName>
+GENERATION_PHASES = ["evaluate", "nec", "offspring", "selection", "crossover", "mutate", "cleanup", "repair", "isValid", "fight", "rank", "memetic"]
+
+class PhaseStats:
+    __slots__ = ("time", "calls", "peakMemory")
+
+    def __init__(self):
+        self.time = 0.0
+        self.calls = 0
+        self.peakMemory = 0
+
+
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.trackMemory = False
+        self.captureGeneration: int = None
+        self.captureDir: str = None
+        self.capturePrefix = ""
+        self.stats: Dict[str, PhaseStats] = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()    # Stack of open phases, per thread (services may run in background)
+
+    def enable(self, trackMemory: bool = False, captureGeneration: int = None, captureDir: str = ".", capturePrefix: str = "") -> None:
+        """
+        captureGeneration, if given, is profiled with cProfile (and tracemalloc), results
+        are written to captureDir as <capturePrefix>generation<n>.prof and .memory.txt
+        """
+        self.enabled = True
+        self.trackMemory = trackMemory
+        self.captureGeneration = captureGeneration
+        self.captureDir = captureDir
+        self.capturePrefix = capturePrefix
+        if trackMemory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def disable(self) -> None:
+        self.enabled = False
+        if self.trackMemory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.trackMemory = False
+
+    def phase(self, name: str) -> ContextManager:
+        if not self.enabled:
+            return NULL_PHASE
+
+        return self.timedPhase(name)
+
+    def count(self, name: str, calls: int = 1) -> None:
+        if not self.enabled:
+            return
+
+        with self.lock:
+            self.stats.setdefault(name, PhaseStats()).calls += calls
+
+    @contextmanager
+    def timedPhase(self, name: str):
+        stack = self.local.__dict__.setdefault("stack", [])
+        startMemory = 0
+        if self.trackMemory:
+            startMemory, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1][0] = max(stack[-1][0], peak)    # The parent's peak so far, reset_peak would lose it
+            tracemalloc.reset_peak()
+        stack.append([0])    # Highest peak of nested phases
+
+        startTime = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - startTime
+            nestedPeak, = stack.pop()
+
+            peakMemory = 0
+            if self.trackMemory:
+                peak = max(tracemalloc.get_traced_memory()[1], nestedPeak)
+                peakMemory = peak - startMemory
+                if stack:
+                    stack[-1][0] = max(stack[-1][0], peak)
+
+            with self.lock:
+                stats = self.stats.setdefault(name, PhaseStats())
+                stats.time += elapsed
+                stats.calls += 1
+                stats.peakMemory = max(stats.peakMemory, peakMemory)
+
+    def collect(self) -> Dict[str, PhaseStats]:
+        """
+        Returns what was accumulated since the previous call and starts over
+        """
+        with self.lock:
+            stats, self.stats = self.stats, {}
+
+        return stats
+
+    def generation(self, generationNumber: int) -> ContextManager:
+        """
+        Wraps a whole generation: captures it when it's the selected one
+        """
+        if not self.enabled or generationNumber != self.captureGeneration:
+            return NULL_PHASE
+
+        return self.capture(generationNumber)
+
+    @contextmanager
+    def capture(self, generationNumber: int):
+        profile = cProfile.Profile()
+        startedTracing = not tracemalloc.is_tracing()
+        if startedTracing:
+            tracemalloc.start()
+
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            snapshot = tracemalloc.take_snapshot()
+            if startedTracing:
+                tracemalloc.stop()
+
+            basename = join(self.captureDir, f"{self.capturePrefix}generation{generationNumber}")
+            profile.dump_stats(basename + ".prof")    # python3 -m pstats generationN.prof
+            with open(basename + ".memory.txt", "w") as f:
+                for stat in snapshot.statistics("lineno")[:50]:
+                    f.write(f"{stat}\n")
+
+
+PROFILER = Profiler()
+
+def servicePhaseName(service: object) -> str:
+    return f"service{type(service).__name__}"
+
+def flattenStats(stats: Dict[str, PhaseStats], names: List[str]) -> Dict[str, float]:
+    """
+    One value per phase and quantity: <phase>Time (s), <phase>Calls, <phase>PeakMemory (bytes)
+    """
+    values = {}
+    for name in names:
+        phaseStats = stats.get(name, PhaseStats())
+        values[f"{name}Time"] = phaseStats.time
+        values[f"{name}Calls"] = phaseStats.calls
+        values[f"{name}PeakMemory"] = phaseStats.peakMemory
+
+    return values
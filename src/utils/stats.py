@@ -0,0 +1,60 @@
+"""
+Population diversity metrics, computed with broadcasting over (P, N+1, 2)
+vertex arrays (see geometry.rodToVertices) and (P, N) angle arrays.
+"""
+import numpy as np
+from typing import Tuple
+
+def pathDistances(vertices: np.ndarray, others: np.ndarray) -> np.ndarray:
+    """
+    Distance between paths: sum of the distances between their corresponding vertices
+    """
+    return np.linalg.norm(vertices - others, axis=-1).sum(axis=-1)
+
+def meanDistanceFrom(vertices: np.ndarray, reference: np.ndarray) -> float:
+    """
+    Mean distance of (P, N+1, 2) paths from a (N+1, 2) reference one (e.g. the king)
+    """
+    return float(pathDistances(vertices, reference[np.newaxis]).mean())
+
+def samplePairs(size: int, maxPairs: int, rng: np.random.Generator) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Every unordered pair of distinct indices, or maxPairs random ones when there are more
+    """
+    if size * (size - 1) // 2 <= maxPairs:
+        return np.triu_indices(size, k=1)
+
+    first = rng.integers(size, size=maxPairs)
+    second = (first + rng.integers(1, size, size=maxPairs)) % size    # Never equal to first
+    return first, second
+
+def meanPairwiseDistance(vertices: np.ndarray, maxPairs: int = 50000, rng: np.random.Generator = None) -> float:
+    """
+    Mean distance between paths, estimated on maxPairs random pairs for large populations
+    """
+    if len(vertices) < 2:
+        return 0.0
+
+    first, second = samplePairs(len(vertices), maxPairs, rng or np.random.default_rng())
+    return float(pathDistances(vertices[first], vertices[second]).mean())
+
+def angleEntropy(angles: np.ndarray, angleLimit: float, bins: int = 16) -> float:
+    """
+    Shannon entropy of the histogram of (P, N) rod angles at each segment position,
+    normalized in [0, 1] (1 when angles are uniformly spread) and averaged over positions.
+    Bins span [-angleLimit, angleLimit], angles outside fall in the outer bins.
+    """
+    populationSize, segmentsNumber = angles.shape
+    binIdx = np.clip(((angles + angleLimit) / (2 * angleLimit) * bins).astype(int), 0, bins - 1)
+
+    # One histogram per segment position, in a single bincount
+    counts = np.bincount(
+        (binIdx + bins * np.arange(segmentsNumber)).ravel(),
+        minlength=bins * segmentsNumber
+    ).reshape(segmentsNumber, bins)
+
+    probabilities = counts / populationSize
+    with np.errstate(divide="ignore", invalid="ignore"):
+        entropies = -np.sum(np.where(counts > 0, probabilities * np.log(probabilities), 0), axis=1)
+
+    return float(entropies.mean() / np.log(bins))
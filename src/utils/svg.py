@@ -0,0 +1,116 @@
+"""
+Direct SVG writer for generation miniatures.
+
+Produces the same picture as amenities.saveMiniaturesSvg (a square grid of
+antenna paths, optionally over the CanSat bottom profile) by emitting text
+straight from vertex arrays, without building a matplotlib figure. Layout
+follows matplotlib defaults: 6.4x4.8 in figure, default subplot parameters,
+equal aspect axes autoscaled with 5% margins.
+"""
+import gzip
+import math
+import numpy as np
+from typing import List, IO, Tuple
+from core.config import Config
+from core.gene import Gene
+from utils.geometry import Polychain, polychainToCartesian
+
+CANSAT_RED = '#ffcdd2'
+
+FIGURE_SIZE = (460.8, 345.6)    # pt
+SUBPLOT_LEFT, SUBPLOT_RIGHT = 0.125, 0.9
+SUBPLOT_BOTTOM, SUBPLOT_TOP = 0.11, 0.88
+SUBPLOT_SPACE = 0.2
+AXES_MARGIN = 0.05
+
+def polychainVertices(polychain: Polychain) -> np.ndarray:
+    """
+    (N+1, 2) array of the vertices of a polychain
+    """
+    return np.array([(p.x, p.y) for p in polychainToCartesian(polychain)], dtype=np.float64)
+
+def gridCells(edgeLen: int) -> List[Tuple[float, float, float, float]]:
+    """
+    (left, top, width, height) of each subplot in figure coordinates (pt, y downwards), row by row
+    """
+    width, height = FIGURE_SIZE
+    gridWidth = (SUBPLOT_RIGHT - SUBPLOT_LEFT) * width
+    gridHeight = (SUBPLOT_TOP - SUBPLOT_BOTTOM) * height
+    cellWidth = gridWidth / (edgeLen + SUBPLOT_SPACE * (edgeLen - 1))
+    cellHeight = gridHeight / (edgeLen + SUBPLOT_SPACE * (edgeLen - 1))
+
+    return [
+        (
+            SUBPLOT_LEFT * width + j * cellWidth * (1 + SUBPLOT_SPACE),
+            (1 - SUBPLOT_TOP) * height + i * cellHeight * (1 + SUBPLOT_SPACE),
+            cellWidth,
+            cellHeight
+        )
+        for i in range(edgeLen)
+        for j in range(edgeLen)
+    ]
+
+def cellTransform(cell: Tuple[float, float, float, float], dataMin: np.ndarray, dataMax: np.ndarray) -> Tuple[float, np.ndarray]:
+    """
+    Scale and offset mapping data coordinates to the cell, as an equal aspect autoscaled axes would
+    """
+    left, top, width, height = cell
+    span = np.maximum(dataMax - dataMin, 1e-12) * (1 + 2 * AXES_MARGIN)
+    scale = min(width / span[0], height / span[1])
+    center = (dataMin + dataMax) / 2
+
+    # y grows downwards in SVG
+    offset = np.array([left + width / 2 - scale * center[0], top + height / 2 + scale * center[1]])
+    return scale, offset
+
+def formatPoints(points: np.ndarray) -> str:
+    return ("%.3f,%.3f " * len(points)) % tuple(points.ravel())
+
+def writeMiniaturesSvg(stream: IO[str], vertices: List[np.ndarray], config: Config, doPlotConstraints: bool) -> None:
+    """
+    vertices are the (N+1, 2) path vertices of every gene; as with matplotlib
+    only the first floor(sqrt(len))^2 are drawn
+    """
+    edgeLen = math.floor(math.sqrt(len(vertices)))
+    width, height = FIGURE_SIZE
+
+    outerRadius = config.ShapeConstraints.outerDiam / 2
+    innerRadius = config.ShapeConstraints.innerDiam / 2
+    innerCenter = np.array([config.ShapeConstraints.centerShift, 0])
+    pathColor = "#4caf50" if doPlotConstraints else "#000000"
+
+    stream.write(
+        '<?xml version="1.0" encoding="utf-8" standalone="no"?>\n'
+        f'<svg xmlns="http://www.w3.org/2000/svg" version="1.1" width="{width}pt" height="{height}pt" viewBox="0 0 {width} {height}">\n'
+        f'<rect width="{width}" height="{height}" fill="#ffffff"/>\n'
+        f'<g fill="none" stroke="{pathColor}" stroke-width="1" stroke-linejoin="round">\n'
+    )
+
+    for cell, points in zip(gridCells(edgeLen), vertices):
+        dataMin, dataMax = points.min(axis=0), points.max(axis=0)
+        if doPlotConstraints:
+            dataMin = np.minimum(dataMin, [-outerRadius, -outerRadius])
+            dataMax = np.maximum(dataMax, [outerRadius, outerRadius])
+        scale, offset = cellTransform(cell, dataMin, dataMax)
+
+        if doPlotConstraints:
+            cx, cy = offset
+            ix, iy = offset + scale * innerCenter * [1, -1]
+            stream.write(
+                f'<circle cx="{cx:.3f}" cy="{cy:.3f}" r="{scale * outerRadius:.3f}" fill="{CANSAT_RED}" stroke="none"/>'
+                f'<circle cx="{ix:.3f}" cy="{iy:.3f}" r="{scale * innerRadius:.3f}" fill="#000000" stroke="none"/>\n'
+            )
+
+        stream.write(f'<polyline points="{formatPoints(points * [scale, -scale] + offset)}"/>\n')
+
+    stream.write('</g>\n</svg>\n')
+
+def saveMiniaturesSvg(filename: str, generation: List[Gene], doPlotConstraints: bool, compress: bool = False) -> None:
+    """
+    Writes filename, gzip compressed (svgz) if compress
+    """
+    vertices = [polychainVertices(g.getCartesianCoords()) for g in generation]
+    opener = gzip.open if compress else open
+
+    with opener(filename, "wt") as outFile:
+        writeMiniaturesSvg(outFile, vertices, generation[0].config, doPlotConstraints)
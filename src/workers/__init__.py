@@ -0,0 +1 @@
+__all__ = ["remote", "shared"]
\ No newline at end of file
@@ -0,0 +1,324 @@
+"""
+Remote evaluation over a socket protocol.
+
+Every message is a fixed header (4-byte kind, 8-byte payload length) followed
+by an uncompressed npz archive, so only plain arrays travel on the wire
+(no pickles). The configuration travels with each batch as a JSON string. A worker daemon serves EVAL requests on a TCP or Unix socket:
+
+  python3 -m workers.remote 0.0.0.0:5555
+  python3 -m workers.remote unix:/tmp/antenna-worker.sock
+"""
+import io
+import json
+import socket
+import socketserver
+import struct
+import logging
+import argparse
+import threading
+import numpy as np
+from queue import Queue, Empty
+from typing import Dict, List, Tuple
+from multiprocessing import Process, Pipe
+from concurrent.futures import ThreadPoolExecutor
+from core.config import Config
+from core.gene import Gene
+from core.evaluation import IEvaluator, LocalEvaluator, EvaluationResult, encodeGenes, evaluateEncodings, applyResult
+
+HEADER = struct.Struct("!4sQ")
+
+EVAL = b"EVAL"
+RESULT = b"RSLT"
+PING = b"PING"
+PONG = b"PONG"
+BYE = b"BYE_"
+
+UNIX_PREFIX = "unix:"
+
+
+def parseAddress(address: str) -> Tuple[int, object]:
+  """
+  "host:port" is a TCP address, "unix:/path/to/socket" a Unix one
+  """
+  if address.startswith(UNIX_PREFIX):
+    return socket.AF_UNIX, address[len(UNIX_PREFIX):]
+
+  host, port = address.rsplit(":", 1)
+  return socket.AF_INET, (host, int(port))
+
+def sendMessage(sock: socket.socket, kind: bytes, **arrays: np.ndarray) -> None:
+  buffer = io.BytesIO()
+  np.savez(buffer, **arrays)
+  payload = buffer.getbuffer()
+
+  # A single write per message: with Nagle's algorithm a separate header would wait for the peer's delayed ACK
+  sock.sendall(HEADER.pack(kind, len(payload)) + payload)
+
+def setNoDelay(sock: socket.socket) -> None:
+  """
+  Disables Nagle's algorithm on TCP sockets: messages are small and latency bound
+  """
+  if sock.family in (socket.AF_INET, socket.AF_INET6):
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+def receiveExactly(sock: socket.socket, size: int) -> bytearray:
+  data = bytearray(size)
+  view = memoryview(data)
+  received = 0
+
+  while received < size:
+    chunkSize = sock.recv_into(view[received:], size - received)
+    if chunkSize == 0:
+      raise ConnectionError("Connection closed by peer")
+    received += chunkSize
+
+  return data
+
+def receiveMessage(sock: socket.socket) -> Tuple[bytes, Dict[str, np.ndarray]]:
+  kind, size = HEADER.unpack(receiveExactly(sock, HEADER.size))
+
+  with np.load(io.BytesIO(receiveExactly(sock, size)), allow_pickle=False) as archive:
+    return kind, {name: archive[name] for name in archive.files}
+
+
+class EvaluationRequestHandler(socketserver.BaseRequestHandler):
+  def setup(self):
+    setNoDelay(self.request)
+
+  def handle(self):
+    configs: Dict[str, Config] = {}    # Parsed configurations, by JSON string
+
+    while True:
+      try:
+        kind, arrays = receiveMessage(self.request)
+      except ConnectionError:
+        return
+
+      if kind == PING:
+        sendMessage(self.request, PONG)
+      elif kind == EVAL:
+        configJson = str(arrays["config"])
+        if configJson not in configs:
+          configs[configJson] = Config.fromDict(json.loads(configJson))
+
+        with self.server.necLock:    # NEC keeps global state, one solve at a time
+          result = evaluateEncodings(configs[configJson], arrays["encodings"], arrays["gpDistances"])
+
+        sendMessage(
+          self.request, RESULT,
+          jobId=arrays["jobId"],
+          fitness=result.fitness,
+          gains=result.gains,
+          thetas=result.thetas,
+          phis=result.phis,
+          solveTimes=result.solveTimes,
+          failures=result.failures
+        )
+      elif kind == BYE:
+        return
+      else:
+        logging.warning(f"Unknown message kind {kind}, closing connection")
+        return
+
+
+class TcpEvaluationServer(socketserver.ThreadingTCPServer):
+  allow_reuse_address = True
+  daemon_threads = True
+
+  def __init__(self, address: Tuple[str, int]):
+    super().__init__(address, EvaluationRequestHandler)
+    self.necLock = threading.Lock()
+
+  def getAddress(self) -> str:
+    host, port = self.server_address[:2]
+    return f"{host}:{port}"
+
+
+class UnixEvaluationServer(socketserver.ThreadingUnixStreamServer):
+  daemon_threads = True
+
+  def __init__(self, path: str):
+    super().__init__(path, EvaluationRequestHandler)
+    self.necLock = threading.Lock()
+
+  def getAddress(self) -> str:
+    return UNIX_PREFIX + self.server_address
+
+
+def createServer(address: str) -> socketserver.BaseServer:
+  family, target = parseAddress(address)
+
+  if family == socket.AF_UNIX:
+    return UnixEvaluationServer(target)
+
+  return TcpEvaluationServer(target)
+
+def _localWorkerMain(address: str, connection) -> None:
+  with createServer(address) as server:
+    connection.send(server.getAddress())
+    connection.close()
+    server.serve_forever()
+
+def spawnLocalWorkers(workersNumber: int, host: str = "127.0.0.1") -> Tuple[List[Process], List[str]]:
+  """
+  Starts workersNumber worker daemons on localhost (ports chosen by the OS).
+  Returns the processes and their addresses.
+  """
+  processes = []
+  addresses = []
+
+  for _ in range(workersNumber):
+    parentConnection, childConnection = Pipe()
+    process = Process(target=_localWorkerMain, args=(f"{host}:0", childConnection), daemon=True)
+    process.start()
+    processes.append(process)
+    addresses.append(parentConnection.recv())
+
+  return processes, addresses
+
+
+class WorkerConnection:
+  """
+  Client side of a single worker daemon. Connects lazily and reconnects after failures.
+  """
+  def __init__(self, address: str, timeout: float):
+    self.address = address
+    self.timeout = timeout
+    self.sock: socket.socket = None
+
+  def connect(self) -> bool:
+    if self.sock is not None:
+      return True
+
+    family, target = parseAddress(self.address)
+    try:
+      self.sock = socket.socket(family, socket.SOCK_STREAM)
+      setNoDelay(self.sock)
+      self.sock.settimeout(self.timeout)
+      self.sock.connect(target)
+    except OSError as e:
+      logging.warning(f"Worker {self.address} unreachable: {e}")
+      self.close()
+      return False
+
+    return True
+
+  def evaluate(self, jobId: int, encodings: np.ndarray, gpDistances: np.ndarray, configJson: str) -> EvaluationResult:
+    sendMessage(
+      self.sock, EVAL,
+      jobId=np.int64(jobId),
+      encodings=encodings,
+      gpDistances=gpDistances,
+      config=np.array(configJson)
+    )
+
+    kind, arrays = receiveMessage(self.sock)
+    if kind != RESULT or int(arrays["jobId"]) != jobId:
+      raise ConnectionError(f"Unexpected reply from worker {self.address}")
+
+    return EvaluationResult(arrays["fitness"], arrays["gains"], arrays["thetas"], arrays["phis"], arrays["solveTimes"], arrays["failures"])
+
+  def close(self, graceful: bool = False) -> None:
+    if self.sock is None:
+      return
+
+    try:
+      if graceful:
+        sendMessage(self.sock, BYE)
+      self.sock.close()
+    except OSError:
+      pass
+
+    self.sock = None
+
+
+class RemoteEvaluator(IEvaluator):
+  """
+  Dispatches batches of genes to registered worker daemons. Batches are split
+  in chunks that idle workers pull from a shared queue (load balancing), and
+  chunks lost because of a dead or slow worker are put back in the queue.
+  After maxRetries rounds without any alive worker, evaluation falls back to the local process.
+  """
+  def __init__(self, addresses: List[str] = None, chunkSize: int = 8, timeout: float = 120, maxRetries: int = 3):
+    self.workers: List[WorkerConnection] = []
+    self.chunkSize = chunkSize
+    self.timeout = timeout
+    self.maxRetries = maxRetries
+    self.fallback = LocalEvaluator()
+
+    for address in addresses or []:
+      self.register(address)
+
+  def register(self, address: str) -> None:
+    self.workers.append(WorkerConnection(address, self.timeout))
+
+  def evaluate(self, genes: List[Gene]) -> None:
+    if len(genes) == 0:
+      return
+
+    encodings, gpDistances = encodeGenes(genes)
+    configJson = json.dumps(genes[0].config.toDict())
+
+    jobs = Queue()
+    for jobId, start in enumerate(range(0, len(genes), self.chunkSize)):
+      jobs.put((jobId, slice(start, start + self.chunkSize)))
+
+    def drain(worker: WorkerConnection) -> None:
+      while True:
+        try:
+          jobId, chunk = jobs.get_nowait()
+        except Empty:
+          return
+
+        try:
+          result = worker.evaluate(jobId, encodings[chunk], gpDistances[chunk], configJson)
+        except (OSError, ValueError) as e:
+          logging.warning(f"Worker {worker.address} lost job {jobId} ({e}), rescheduling")
+          jobs.put((jobId, chunk))
+          worker.close()
+          return
+
+        applyResult(genes[chunk], result, necFitness=True)
+
+    for _ in range(self.maxRetries):
+      aliveWorkers = [w for w in self.workers if w.connect()]
+      if len(aliveWorkers) == 0:
+        continue
+
+      with ThreadPoolExecutor(len(aliveWorkers)) as executor:
+        list(executor.map(drain, aliveWorkers))
+
+      if jobs.empty():
+        return
+
+    logging.warning(f"No worker available, evaluating {jobs.qsize()} chunks locally")
+    while not jobs.empty():
+      _, chunk = jobs.get_nowait()
+      self.fallback.evaluate(genes[chunk])
+
+  def close(self) -> None:
+    for worker in self.workers:
+      worker.close(graceful=True)
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(
+    description = "Planar evolved antenna evaluation worker"
+  )
+
+  parser.add_argument(
+    "address", help="TCP (host:port) or Unix (unix:/path) address to listen on",
+    type=str
+  )
+
+  args = parser.parse_args()
+
+  logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(levelname)s: %(message)s",
+    datefmt="%H:%M:%S"
+  )
+
+  with createServer(args.address) as server:
+    logging.info(f"Evaluation worker listening on {server.getAddress()}")
+    server.serve_forever()
@@ -0,0 +1,236 @@
+"""
+Zero-copy evaluation through multiprocessing.shared_memory.
+
+Genome batches are written once into a shared block as (P, N, 2) rod
+encodings plus (P,) ground plane distances; evaluation processes hold
+persistent NumPy views on it and write fitness and gains back in place.
+Only small job descriptors (block name, capacity, slice bounds, configuration)
+travel through the queues.
+"""
+import logging
+import numpy as np
+from math import ceil
+from queue import Empty
+from typing import Dict, List, Tuple
+from multiprocessing import Array, Process, Queue
+from multiprocessing.shared_memory import SharedMemory
+from core.gene import Gene
+from core.evaluation import IEvaluator, EvaluationResult, encodeGenes, evaluateEncodings, applyResult, radiationPatternSizes
+
+class SharedBatch:
+  """
+  A shared memory block holding a batch of at most capacity genes,
+  with a NumPy view for each field.
+  """
+  def __init__(self, capacity: int, segmentsNumber: int, name: str = None):
+    self.capacity = capacity
+    self.segmentsNumber = segmentsNumber
+    layout, size = SharedBatch.layout(capacity, segmentsNumber)
+
+    if name is None:
+      self.memory = SharedMemory(create=True, size=size)
+    else:
+      self.memory = SharedMemory(name=name)
+
+    self.views: Dict[str, np.ndarray] = {
+      field: np.ndarray(shape, dtype=np.float64, buffer=self.memory.buf, offset=offset)
+      for field, (offset, shape) in layout.items()
+    }
+
+  @staticmethod
+  def layout(capacity: int, segmentsNumber: int) -> Tuple[Dict[str, Tuple[int, Tuple]], int]:
+    gainsSize, thetasSize, phisSize = radiationPatternSizes()
+    shapes = {
+      "batchId": (1,),
+      "encodings": (capacity, segmentsNumber, 2),
+      "gpDistances": (capacity,),
+      "fitness": (capacity,),
+      "gains": (capacity, 2, gainsSize),
+      "thetas": (2, thetasSize),
+      "phis": (2, phisSize),
+      "solveTimes": (capacity,),
+      "failures": (capacity,),
+      "slotBatchIds": (capacity,)    # Batch each slot's results come from
+    }
+
+    layout = {}
+    offset = 0
+    for field, shape in shapes.items():
+      layout[field] = (offset, shape)
+      offset += int(np.prod(shape)) * np.dtype(np.float64).itemsize
+
+    return layout, max(offset, 1)
+
+  @property
+  def name(self) -> str:
+    return self.memory.name
+
+  def result(self, size: int) -> EvaluationResult:
+    return EvaluationResult(
+      self.views["fitness"][:size],
+      self.views["gains"][:size],
+      self.views["thetas"],
+      self.views["phis"],
+      self.views["solveTimes"][:size],
+      self.views["failures"][:size]
+    )
+
+  def close(self) -> None:
+    self.views.clear()
+    self.memory.close()
+
+  def unlink(self) -> None:
+    self.close()
+    self.memory.unlink()
+
+
+def _sharedWorkerMain(jobs: Queue, done: Queue, index: int, claims: Array) -> None:
+  """
+  claims[2 * index : 2 * index + 2] is the (batch id, start) of the job being processed, batch id -1 when idle
+  """
+  batch: SharedBatch = None
+
+  while True:
+    job = jobs.get()
+    if job is None:
+      break
+
+    batchId, name, capacity, start, stop, config = job
+    claims[2 * index], claims[2 * index + 1] = batchId, start
+    segmentsNumber = config.GeneEncoding.segmentsNumber
+    if batch is None or batch.name != name:
+      if batch is not None:
+        batch.close()
+        batch = None
+      try:
+        batch = SharedBatch(capacity, segmentsNumber, name)
+      except FileNotFoundError:
+        claims[2 * index] = -1
+        continue    # Stale job rescheduled after a crash, its block is gone
+
+    views = batch.views
+    if views["batchId"][0] != batchId:
+      claims[2 * index] = -1
+      continue    # Stale job rescheduled after a crash
+
+    result = evaluateEncodings(config, views["encodings"][start:stop], views["gpDistances"][start:stop])
+    if views["batchId"][0] != batchId:
+      claims[2 * index] = -1
+      continue
+
+    views["fitness"][start:stop] = result.fitness
+    views["gains"][start:stop] = result.gains
+    views["solveTimes"][start:stop] = result.solveTimes
+    views["failures"][start:stop] = result.failures
+    if np.any(result.fitness > float("-inf")):
+      views["thetas"][:] = result.thetas
+      views["phis"][:] = result.phis
+    views["slotBatchIds"][start:stop] = batchId
+
+    # A new batch may have started while writing: the evaluator finds the slots' batch ids wrong and reschedules them
+    claims[2 * index] = -1
+    if views["batchId"][0] == batchId:
+      done.put((batchId, start))
+
+  if batch is not None:
+    batch.close()
+
+
+class SharedMemoryEvaluator(IEvaluator):
+  """
+  Evaluates batches with a pool of local processes through shared memory.
+  Dead processes are respawned and the chunks they had claimed rescheduled.
+  """
+  def __init__(self, processesNumber: int, chunksPerProcess: int = 4, pollTimeout: float = 5, initialCapacity: int = 512, segmentsNumber: int = 20):
+    self.processesNumber = processesNumber
+    self.chunksPerProcess = chunksPerProcess
+    self.pollTimeout = pollTimeout
+    self.batchId = 0
+    # The block is created before spawning processes, so that they share the parent's resource tracker
+    self.batch = SharedBatch(initialCapacity, segmentsNumber)
+    self.jobs = Queue()
+    self.done = Queue()
+    self.claims = Array("q", [-1, 0] * processesNumber, lock=False)    # Job of each process, see _sharedWorkerMain
+    self.processes: List[Process] = [self.spawn(i) for i in range(processesNumber)]
+
+  def spawn(self, index: int) -> Process:
+    self.claims[2 * index] = -1
+    process = Process(target=_sharedWorkerMain, args=(self.jobs, self.done, index, self.claims), daemon=True)
+    process.start()
+    return process
+
+  def ensureCapacity(self, size: int, segmentsNumber: int) -> None:
+    if size <= self.batch.capacity and segmentsNumber == self.batch.segmentsNumber:
+      return
+
+    # Workers re-attach as soon as they receive a job with the new block name
+    capacity = max(size, 2 * self.batch.capacity) if size > self.batch.capacity else self.batch.capacity
+    self.batch.unlink()
+    self.batch = SharedBatch(capacity, segmentsNumber)
+
+  def evaluate(self, genes: List[Gene]) -> None:
+    if len(genes) == 0:
+      return
+
+    config = genes[0].config
+    self.ensureCapacity(len(genes), config.GeneEncoding.segmentsNumber)
+    self.batchId += 1
+    self.batch.views["batchId"][0] = self.batchId
+    encodings, gpDistances = encodeGenes(genes)
+    self.batch.views["encodings"][:len(genes)] = encodings
+    self.batch.views["gpDistances"][:len(genes)] = gpDistances
+
+    chunkSize = ceil(len(genes) / (self.processesNumber * self.chunksPerProcess))
+    chunks = {
+      start: (self.batchId, self.batch.name, self.batch.capacity, start, min(start + chunkSize, len(genes)), config)
+      for start in range(0, len(genes), chunkSize)
+    }
+    pending = dict(chunks)
+    while len(pending) > 0:
+      for job in pending.values():
+        self.jobs.put(job)
+
+      while len(pending) > 0:
+        try:
+          batchId, start = self.done.get(timeout=self.pollTimeout)
+          if batchId == self.batchId:
+            pending.pop(start, None)
+        except Empty:
+          self.respawnDead(pending)
+
+      # Stale jobs of earlier batches may have overwritten slots of this one
+      slotBatchIds = self.batch.views["slotBatchIds"]
+      pending = {start: job for start, job in chunks.items() if np.any(slotBatchIds[start:job[4]] != self.batchId)}
+      if len(pending) > 0:
+        logging.warning(f"{len(pending)} chunks overwritten by stale results, rescheduling them")
+
+    applyResult(genes, self.batch.result(len(genes)), necFitness=True)
+
+  def respawnDead(self, pending: Dict[int, Tuple]) -> None:
+    """
+    Respawns dead processes and reschedules the chunks they had claimed. Chunks lost
+    by a process dying before claiming them are rescheduled once every process is idle.
+    """
+    dead = [i for i, p in enumerate(self.processes) if not p.is_alive()]
+    rescheduled = []
+    for i in dead:
+      claimedBatchId, claimedStart = self.claims[2 * i], self.claims[2 * i + 1]
+      if claimedBatchId == self.batchId and claimedStart in pending:
+        rescheduled.append(claimedStart)
+      self.processes[i] = self.spawn(i)
+
+    if all(self.claims[2 * i] == -1 for i in range(self.processesNumber)):
+      rescheduled += [start for start in pending if start not in rescheduled]
+
+    if len(dead) > 0 or len(rescheduled) > 0:
+      logging.warning(f"{len(dead)} evaluation processes died, rescheduling {len(rescheduled)} chunks")
+    for start in rescheduled:
+      self.jobs.put(pending[start])
+
+  def close(self) -> None:
+    for _ in self.processes:
+      self.jobs.put(None)
+    for process in self.processes:
+      process.join(self.pollTimeout)
+
+    self.batch.unlink()